@@ -0,0 +1,131 @@
+import time
+import threading
+from collections import Counter
+# ---
+import requests
+from requests.adapters import HTTPAdapter
+from azure.identity import ManagedIdentityCredential
+from azure.storage.blob import BlobServiceClient, ExponentialRetry
+# ---
+from io_throttle import SDK_RETRY_TOTAL, SDK_RETRY_BACKOFF
+
+# Credential types
+CREDENTIAL_MANAGED_IDENTITY = 'managed_identity'
+
+# Refresh cached tokens this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 300
+
+# Connections kept per host by each client's HTTP pool (upload_workers threads share it)
+CONNECTION_POOL_SIZE = 32
+
+# Blob calls of these clients go through an IOController (function_app.throttled_container_client) that retries
+# throttling itself - the SDK retry policy is kept to one quick retry so the two do not stack
+SDK_RETRY_POLICY = dict(initial_backoff=SDK_RETRY_BACKOFF, increment_base=2, retry_total=SDK_RETRY_TOTAL)
+
+# Process-wide registry - clients/credentials stay warm across function invocations
+_credentials = {}
+_blob_service_clients = {}
+_lock = threading.Lock()
+_stats = Counter()
+
+
+class CachedTokenCredential:
+    # wraps a credential so tokens are cached per scope and refreshed refresh_margin seconds
+    # before they expire, instead of being fetched by every new client
+
+    def __init__(self, credential, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self._credential = credential
+        self._refresh_margin = refresh_margin
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def get_token(self, *scopes, **kwargs):
+        # tokens requested with claims (CAE challenges) always go to the wrapped credential
+        key = (scopes, kwargs.get('tenant_id'))
+        if not kwargs.get('claims'):
+            with self._lock:
+                token = self._tokens.get(key)
+            if token is not None and token.expires_on - time.time() > self._refresh_margin:
+                with _lock:
+                    _stats['token_hits'] += 1
+                return token
+
+        token = self._credential.get_token(*scopes, **kwargs)
+        with self._lock:
+            self._tokens[key] = token
+        # _stats is shared by every credential - counted under the registry lock like the client counters
+        with _lock:
+            _stats['token_fetches'] += 1
+        return token
+
+    def close(self):
+        self._credential.close()
+
+
+def _new_credential(credential_kind):
+    if credential_kind == CREDENTIAL_MANAGED_IDENTITY:
+        return ManagedIdentityCredential()
+    raise ValueError(f"Unknown credential type - {credential_kind}")
+
+
+def _new_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=CONNECTION_POOL_SIZE, pool_maxsize=CONNECTION_POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_credential(credential_kind=CREDENTIAL_MANAGED_IDENTITY):
+    # shared, token-caching credential for credential_kind
+    with _lock:
+        credential = _credentials.get(credential_kind)
+        if credential is None:
+            _stats['credential_misses'] += 1
+            credential = CachedTokenCredential(_new_credential(credential_kind))
+            _credentials[credential_kind] = credential
+        else:
+            _stats['credential_hits'] += 1
+        return credential
+
+
+def get_blob_service_client(account_url, credential_kind=CREDENTIAL_MANAGED_IDENTITY):
+    # shared BlobServiceClient per (account url, credential type) - keeps its connection pool warm
+    key = (account_url.rstrip('/'), credential_kind)
+    with _lock:
+        client = _blob_service_clients.get(key)
+        if client is not None:
+            _stats['client_hits'] += 1
+            return client
+
+    credential = get_credential(credential_kind)
+    with _lock:
+        client = _blob_service_clients.get(key)
+        if client is None:
+            _stats['client_misses'] += 1
+            client = BlobServiceClient(account_url=account_url, credential=credential, session=_new_session(),
+                                       retry_policy=ExponentialRetry(**SDK_RETRY_POLICY))
+            _blob_service_clients[key] = client
+        else:
+            _stats['client_hits'] += 1
+        return client
+
+
+def register_blob_service_client(account_url, client, credential_kind=CREDENTIAL_MANAGED_IDENTITY):
+    # use client for (account url, credential type) instead of creating one - e.g. local stand-ins in benchmarks
+    with _lock:
+        _blob_service_clients[(account_url.rstrip('/'), credential_kind)] = client
+
+
+def client_cache_stats():
+    # hit/miss counters for clients, credentials and tokens since worker start
+    with _lock:
+        return {
+            'client_hits': _stats['client_hits'],
+            'client_misses': _stats['client_misses'],
+            'credential_hits': _stats['credential_hits'],
+            'credential_misses': _stats['credential_misses'],
+            'token_hits': _stats['token_hits'],
+            'token_fetches': _stats['token_fetches'],
+            'cached_clients': len(_blob_service_clients)
+        }
@@ -0,0 +1 @@
+# Local benchmarks for the HL7 pipeline - run from the repo root, e.g. python -m benchmarks.bench_extractor
@@ -0,0 +1,74 @@
+import os
+import json
+import time
+import logging
+import tempfile
+from types import SimpleNamespace
+# ---
+import azure.functions as func
+import function_app
+from azure_clients import register_blob_service_client
+from benchmarks.common import HL7_CLIENT_CONFIG, INTERFACE_CONFIG
+from benchmarks.corpus import generate_corpus, write_corpus
+from benchmarks.standins import LocalBlobServiceClient
+
+# Archive step of http_trigger_parsehl7 - one request per capture file vs one request for all of them, async copy
+# polled to completion and retried failed copies (copy retry/abort and etag-conditional delete checks:
+# tests/test_blob_archive.py)
+
+FILES = 8
+MESSAGES = 1600
+UPLOAD_LATENCY = 0.005
+COPY_POLLS = 3
+
+handler = function_app.http_trigger_parsehl7._function.get_user_function()
+context = SimpleNamespace(function_name='bench')
+
+
+def request(ic, fsfavro):
+    body = {'from_source_file_avro': fsfavro, 'interface_config': ic, 'hl7_client_config': HL7_CLIENT_CONFIG}
+    return handler(func.HttpRequest(method='POST', url='/api/http_trigger_parsehl7', body=json.dumps(body).encode()),
+                   context)
+
+
+def setup(root, **options):
+    # capture files in a fresh local account registered for INTERFACE_CONFIG's host - returns (container, names)
+    service_client = LocalBlobServiceClient(root, UPLOAD_LATENCY, **options)
+    register_blob_service_client(INTERFACE_CONFIG['from_source_host'], service_client)
+    container = service_client.get_container_client(INTERFACE_CONFIG['from_source_container'])
+    names = write_corpus(os.path.join(container.root, INTERFACE_CONFIG['from_source_folder']),
+                         generate_corpus(MESSAGES), FILES)
+    return container, names
+
+
+def main():
+    logging.disable(logging.ERROR)
+    ic = dict(INTERFACE_CONFIG, output_mode='ndjson', parse_mode='fast', archive_poll_interval=0.01)
+
+    for name, batched in (('one request per file', False), ('one request, 4 file workers', True)):
+        with tempfile.TemporaryDirectory() as root:
+            container, names = setup(root, copy_polls=COPY_POLLS)
+            start = time.perf_counter()
+            if batched:
+                responses = [request(dict(ic, file_workers=4), names)]
+            else:
+                responses = [request(ic, fsfavro) for fsfavro in names]
+            elapsed = time.perf_counter() - start
+            print(f"{name:28s}: {FILES} files / {MESSAGES} messages in {elapsed:.2f}s")
+
+    # failed copies - one retried successfully, then files whose copy never succeeds (left in place)
+    with tempfile.TemporaryDirectory() as root:
+        container, names = setup(root, copy_polls=COPY_POLLS, copy_failures=1)
+        start = time.perf_counter()
+        request(ic, names[0])
+        retried = time.perf_counter() - start
+
+        container.copy_failures = 100
+        start = time.perf_counter()
+        request(dict(ic, archive_copy_attempts=3, file_workers=2), names[1:3])
+        print(f"failed copy retried         : {retried:.2f}s; 2 files with 3 failed copies each "
+              f"{time.perf_counter() - start:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
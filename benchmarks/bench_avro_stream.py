@@ -0,0 +1,73 @@
+import os
+import sys
+import resource
+import subprocess
+import tempfile
+# ---
+from fastavro import reader
+from blob_io import open_blob_stream
+from benchmarks.common import synthetic_adt, write_capture_avro
+from benchmarks.standins import LocalContainerClient
+
+# Peak RSS of reading a capture file whole vs streamed in ranges (the bound and the records read are checked in
+# tests/test_blob_io.py)
+
+# Size of the generated capture file and the streaming chunk size
+TARGET_FILE_SIZE = 128 * 1024 * 1024
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def peak_rss():
+    # peak resident set size of this process in bytes (ru_maxrss is KiB on linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def consume(root, name, mode):
+    # read every record of the capture file the way http_trigger_parsehl7 does, return peak RSS growth
+    from io import BytesIO
+
+    avro_file = LocalContainerClient(root).get_blob_client(name)
+    baseline = peak_rss()
+
+    if mode == 'stream':
+        avro_data = open_blob_stream(avro_file, CHUNK_SIZE)
+    else:
+        avro_data = BytesIO(avro_file.download_blob().readall())
+
+    records = body_bytes = 0
+    with avro_data:
+        for record in reader(avro_data):
+            records += 1
+            body_bytes += len(record.get('Body'))
+
+    print(records, body_bytes, peak_rss() - baseline)
+
+
+def main():
+    if len(sys.argv) == 4:
+        consume(*sys.argv[1:])
+        return
+
+    with tempfile.TemporaryDirectory() as root:
+        name = 'capture/bench.avro'
+        os.makedirs(os.path.join(root, 'capture'))
+        path = os.path.join(root, 'capture', 'bench.avro')
+
+        corpus = [m.encode('utf-8') for m in synthetic_adt(5000)]
+        copies = max(1, TARGET_FILE_SIZE // sum(len(m) for m in corpus))
+        write_capture_avro(path, (m for _ in range(copies) for m in corpus))
+        file_size = os.path.getsize(path)
+        print(f"capture file: {file_size / 2**20:.1f} MiB, chunk size: {CHUNK_SIZE / 2**20:.1f} MiB")
+
+        for mode in ('readall', 'stream'):
+            out = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_avro_stream', root, name, mode],
+                check=True, capture_output=True, text=True
+            ).stdout.split()
+            records, body_bytes, rss_growth = (int(v) for v in out)
+            print(f"{mode:8s}: {records} records, peak RSS growth {rss_growth / 2**20:7.1f} MiB "
+                  f"({rss_growth / file_size:.2f}x file size)")
+
+
+if __name__ == '__main__':
+    main()
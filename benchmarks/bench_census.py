@@ -0,0 +1,60 @@
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+# ---
+import numpy as np
+from censusCount import census_counts, generate_hourly_timestamps, BIN_15_MINUTES, BIN_HOURLY, BIN_DAILY
+
+STAYS = 1000000
+POCS = 100
+LEGACY_STAYS = 5000
+FORMAT = '%b %d %Y %H:%M'
+
+
+def synthetic_stays(n, seed=7):
+    # n stays over 2024 - start minute uniform, length 1 hour .. 20 days, 0.5% reversed
+    rng = np.random.default_rng(seed)
+    origin = np.datetime64('2024-01-01T00:00', 'm')
+    starts = origin + rng.integers(0, 366 * 24 * 60, n).astype('timedelta64[m]')
+    lengths = rng.integers(60, 20 * 24 * 60, n)
+    lengths[rng.random(n) < 0.005] *= -1
+    return starts, starts + lengths.astype('timedelta64[m]'), rng.integers(0, POCS, n)
+
+
+def legacy_counts(starts, ends):
+    # hourly timestamp expansion + Counter, as censusCount did it before the sweep-line engine
+    all_timestamps = []
+    for start, end in zip(starts.astype(datetime), ends.astype(datetime)):
+        all_timestamps.extend(generate_hourly_timestamps(start.strftime(FORMAT), end.strftime(FORMAT)))
+    return Counter(all_timestamps)
+
+
+def main():
+    starts, ends, pocs = synthetic_stays(STAYS)
+
+    # legacy on a sample (it doesn't scale to 1M), checked against the engine
+    sample = slice(0, LEGACY_STAYS)
+    start = time.perf_counter()
+    legacy = legacy_counts(starts[sample], ends[sample])
+    legacy_elapsed = time.perf_counter() - start
+
+    bin_starts, counts, valid = census_counts(starts[sample], ends[sample], BIN_HOURLY)
+    engine = {ts: int(c) for ts, c in zip(bin_starts.astype(datetime), counts) if c}
+    if engine != dict(legacy):
+        raise AssertionError('sweep-line census differs from hourly expansion')
+    print(f"legacy expansion: {LEGACY_STAYS} stays in {legacy_elapsed:.2f}s "
+          f"(~{legacy_elapsed * STAYS / LEGACY_STAYS:.0f}s extrapolated to {STAYS})")
+
+    for name, bin_width in (('15 min', BIN_15_MINUTES), ('hourly', BIN_HOURLY), ('daily', BIN_DAILY)):
+        start = time.perf_counter()
+        invalid = 0
+        for poc in range(POCS):
+            mask = pocs == poc
+            _, _, valid = census_counts(starts[mask], ends[mask], bin_width)
+            invalid += int((~valid).sum())
+        elapsed = time.perf_counter() - start
+        print(f"sweep-line {name:7s}: {STAYS} stays / {POCS} POCs in {elapsed:.3f}s ({invalid} reversed ranges reported)")
+
+
+if __name__ == '__main__':
+    main()
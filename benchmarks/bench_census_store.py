@@ -0,0 +1,183 @@
+import os
+import time
+import tempfile
+from datetime import datetime, timedelta
+# ---
+import numpy as np
+from censusCount import census_counts, BIN_HOURLY
+from census_store import CensusStore, hour_of, hour_start
+
+# Census store at multi-year, 100-POC scale - a dashboard query ("ICU, last 90 days, daily peak") by recomputing the
+# census from the stays (what censusCount does per run) vs the store's prefix sums / max tree / rollups; store
+# answers checked against the dense counts, rollups against calendar periods computed with datetime
+
+YEARS = 3
+POCS = 100
+STAYS = 3000000
+QUERIES = 2000
+ORIGIN = datetime(2022, 1, 1)
+
+
+def synthetic_stays(n, seed=11):
+    # n stays over YEARS - start minute uniform, length 1 hour .. 20 days
+    rng = np.random.default_rng(seed)
+    origin = np.datetime64(ORIGIN, 'm')
+    starts = origin + rng.integers(0, YEARS * 365 * 24 * 60, n).astype('timedelta64[m]')
+    ends = starts + rng.integers(60, 20 * 24 * 60, n).astype('timedelta64[m]')
+    return starts, ends, rng.integers(0, POCS, n)
+
+
+def recompute(starts, ends, pocs, poc):
+    # one POC's hourly census from its stays - the batch engine, per query
+    mask = pocs == poc
+    return census_counts(starts[mask], ends[mask], BIN_HOURLY)
+
+
+def dense_counts(starts, ends, pocs):
+    # (origin hour, {poc name: hourly counts from origin}) - all POCs aligned
+    census = {f"POC{poc:03d}": recompute(starts, ends, pocs, poc)[:2] for poc in range(POCS)}
+    origin = min(hour_of(bin_starts[0]) for bin_starts, _ in census.values())
+    hours = max(hour_of(bin_starts[0]) - origin + len(counts) for bin_starts, counts in census.values())
+    dense = {}
+    for poc, (bin_starts, counts) in census.items():
+        dense[poc] = np.zeros(hours, dtype=np.int32)
+        dense[poc][hour_of(bin_starts[0]) - origin:][:len(counts)] = counts
+    return origin, dense
+
+
+def build(origin, dense, chunk_hours):
+    # store built by appends of chunk_hours - (store, seconds per append)
+    store = CensusStore()
+    hours = len(next(iter(dense.values())))
+    start = time.perf_counter()
+    appends = 0
+    for offset in range(0, hours, chunk_hours):
+        store.extend(hour_start(origin + offset), {poc: counts[offset:offset + chunk_hours]
+                                                  for poc, counts in dense.items()})
+        appends += 1
+    return store, (time.perf_counter() - start) / appends
+
+
+def check_ranges(store, origin, dense, rng):
+    # random [start, end) ranges - range_stats vs the dense counts; returns seconds per query
+    hours = store.length
+    queries = []
+    for _ in range(QUERIES):
+        poc = store.pocs[rng.integers(len(store.pocs))]
+        a = int(rng.integers(0, hours))
+        b = int(rng.integers(a, hours + 1))
+        queries.append((poc, hour_start(origin + a), hour_start(origin + b), a, b))
+    start = time.perf_counter()
+    results = [store.range_stats(poc, s, e) for poc, s, e, _, _ in queries]
+    elapsed = (time.perf_counter() - start) / len(queries)
+    for (poc, _, _, a, b), stats in zip(queries, results):
+        counts = dense[poc][a:b]
+        expected_max = int(counts.max()) if b > a else None
+        if stats['sum'] != int(counts.sum()) or stats['max'] != expected_max or stats['hours'] != b - a:
+            raise AssertionError(f"{poc} [{a}, {b}) - {stats}")
+    return elapsed
+
+
+def calendar_periods(period, first, last):
+    # period starts (datetime) from first to last - computed with datetime, independent of the store's period ids
+    day = datetime(first.year, first.month, first.day)
+    if period == 'day':
+        current, step = day, lambda d: d + timedelta(days=1)
+    elif period == 'week':
+        current, step = day - timedelta(days=day.weekday()), lambda d: d + timedelta(days=7)
+    else:
+        current = datetime(first.year, first.month, 1)
+        step = lambda d: datetime(d.year + d.month // 12, d.month % 12 + 1, 1)
+    starts = []
+    while current < last:
+        starts.append(current)
+        current = step(current)
+    return starts + [current]
+
+
+def check_rollups(store, origin, dense):
+    for period in ('day', 'week', 'month'):
+        starts = calendar_periods(period, store.start, store.end)
+        for poc in store.pocs[:5]:
+            rollup = store.rollup(poc, period)
+            if len(rollup['start']) != len(starts) - 1:
+                raise AssertionError(f"{poc} {period} - {len(rollup['start'])} periods, expected {len(starts) - 1}")
+            for i, (s, e) in enumerate(zip(starts, starts[1:])):
+                a, b = max(hour_of(s), origin) - origin, min(hour_of(e) - origin, store.length)
+                counts = dense[poc][a:b]
+                if (rollup['hours'][i], rollup['sum'][i], rollup['max'][i]) != (b - a, counts.sum(), counts.max()):
+                    raise AssertionError(f"{poc} {period} {s} - rollup differs")
+
+
+def main():
+    starts, ends, pocs = synthetic_stays(STAYS)
+    start = time.perf_counter()
+    origin, dense = dense_counts(starts, ends, pocs)
+    print(f"census recompute, all POCs  : {STAYS} stays / {POCS} POCs in {time.perf_counter() - start:.2f}s "
+          f"({len(dense['POC000'])} hours)")
+
+    store, append_s = build(origin, dense, 24 * 30)
+    print(f"30-day appends              : {store.length} hours x {len(store.pocs)} POCs, "
+          f"{append_s * 1000:.1f} ms per append")
+
+    # dashboard query: POC000, the last 90 full days, daily peak
+    poc, poc_id = 'POC000', 0
+    query_end = datetime(store.end.year, store.end.month, store.end.day)
+    query_start = query_end - timedelta(days=90)
+    start = time.perf_counter()
+    bin_starts, counts, _ = recompute(starts, ends, pocs, poc_id)
+    offset = hour_of(query_start) - hour_of(bin_starts[0])
+    recomputed_peaks = counts[offset:offset + 90 * 24].reshape(90, 24).max(axis=1)
+    recompute_ms = (time.perf_counter() - start) * 1000
+
+    # streaming appends - one hour at a time on a store of the full history
+    streaming, _ = build(origin, {p: c[:-24 * 7] for p, c in dense.items()}, 24 * 30)
+    start = time.perf_counter()
+    for offset in range(store.length - 24 * 7, store.length):
+        streaming.extend(hour_start(origin + offset), {p: c[offset:offset + 1] for p, c in dense.items()})
+    print(f"hourly appends              : {(time.perf_counter() - start) / (24 * 7) * 1000:.2f} ms per hour "
+          f"(all {POCS} POCs)")
+
+    start = time.perf_counter()
+    rollup = store.rollup(poc, 'day', query_start, query_end)
+    store_ms = (time.perf_counter() - start) * 1000
+    if not np.array_equal(rollup['max'], recomputed_peaks):
+        raise AssertionError('90-day daily peaks differ from the recompute')
+    print(f"90 days daily peak, {poc}  : recompute {recompute_ms:.1f} ms, store {store_ms:.3f} ms "
+          f"({len(rollup['max'])} days, {recompute_ms / store_ms:.0f}x)")
+
+    start = time.perf_counter()
+    for _ in range(100):
+        store.rollup(poc, 'month')
+    print(f"monthly rollup, {YEARS} years     : {(time.perf_counter() - start) * 10:.3f} ms")
+
+    rng = np.random.default_rng(5)
+    elapsed = check_ranges(store, origin, dense, rng)
+    check_ranges(streaming, origin, dense, rng)
+    print(f"range sum/max/mean          : {elapsed * 1000:.3f} ms per query ({QUERIES} random ranges, "
+          f"checked against the dense counts)")
+    check_rollups(store, origin, dense)
+    check_rollups(streaming, origin, dense)
+    print('rollups                     : day/week/month match calendar periods')
+
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, 'census.npz')
+        start = time.perf_counter()
+        store.save(path)
+        save_s = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded = CensusStore.load(path)
+        load_s = time.perf_counter() - start
+        if loaded.range_stats(poc, query_start, query_end) != store.range_stats(poc, query_start, query_end):
+            raise AssertionError('loaded store differs')
+        print(f"save / load                 : {save_s * 1000:.0f} / {load_s * 1000:.0f} ms, "
+              f"{os.path.getsize(path) / 2**20:.1f} MB")
+
+        start = time.perf_counter()
+        rows = loaded.export_csv(os.path.join(root, 'icu.csv'), [poc], 'hour', query_start, query_end)
+        print(f"csv export on demand        : {rows} rows ({poc}, 90 days) in "
+              f"{(time.perf_counter() - start) * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
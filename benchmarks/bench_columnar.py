@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import tempfile
+from collections import Counter
+# ---
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+# ---
+from function_app import get_message
+from hl7_fields import get_extractor, parse_hl7_dtm
+from output_sinks import create_sink
+from columnar_sink import PARQUET_SUFFIX, RAW_SUFFIX
+from pipeline import process_records
+from benchmarks.common import HL7_CLIENT_CONFIG, INTERFACE_CONFIG, synthetic_adt, capture_records
+from benchmarks.standins import LocalContainerClient
+
+MESSAGES = 50000
+QUERY_COLUMNS = ['point_of_care_cd', 'admit_dttm']
+
+
+def folder_size(folder, match):
+    return sum(
+        os.path.getsize(os.path.join(dir_path, name))
+        for dir_path, _, files in os.walk(folder) for name in files if match(name)
+    )
+
+
+def query_ndjson(folder):
+    # admits per point of care and month - every message is read and json-decoded
+    counts = Counter()
+    for dir_path, _, files in os.walk(folder):
+        for name in files:
+            if name.endswith('.ndjson') and not name.endswith('.index.ndjson'):
+                with open(os.path.join(dir_path, name), 'rb') as f:
+                    for line in f:
+                        hl7_parsed = json.loads(line)['hl7_parsed']
+                        admit = parse_hl7_dtm(hl7_parsed['admit_dttm'])
+                        if admit is not None:
+                            counts[(hl7_parsed['point_of_care_cd'], admit.strftime('%Y-%m'))] += 1
+    return counts
+
+
+def query_parquet(folder):
+    # same query - only the two columns are read, hl7_raw files are never opened
+    paths = [
+        os.path.join(dir_path, name) for dir_path, _, files in os.walk(folder)
+        for name in files if name.endswith(PARQUET_SUFFIX) and not name.endswith(RAW_SUFFIX)
+    ]
+    partitioning = ds.partitioning(
+        pa.schema([('interface_id', pa.string()), ('processed_hour', pa.string())]), flavor='hive'
+    )
+    dataset = ds.dataset(paths, format='parquet', partitioning=partitioning, partition_base_dir=folder)
+    table = dataset.to_table(columns=QUERY_COLUMNS, filter=ds.field('admit_dttm').is_valid())
+    table = table.append_column('month', pc.strftime(table['admit_dttm'], '%Y-%m'))
+    grouped = table.group_by(['point_of_care_cd', 'month']).aggregate([('admit_dttm', 'count')])
+    return Counter(dict(zip(
+        zip(grouped['point_of_care_cd'].to_pylist(), grouped['month'].to_pylist()),
+        grouped['admit_dttm_count'].to_pylist()
+    )))
+
+
+def main():
+    records = list(capture_records(m.encode('utf-8') for m in synthetic_adt(MESSAGES)))
+    extractor = get_extractor(HL7_CLIENT_CONFIG)
+
+    with tempfile.TemporaryDirectory() as root:
+        ic = dict(INTERFACE_CONFIG, output_mode='ndjson,parquet', parse_mode='fast')
+        sink = create_sink(LocalContainerClient(root), ic, 'bench', HL7_CLIENT_CONFIG)
+        start = time.perf_counter()
+        process_records(iter(records), get_message, ic, HL7_CLIENT_CONFIG, 'bench', sink, extractor)
+        print(f"ndjson + parquet output: {MESSAGES} messages in {time.perf_counter() - start:.2f}s")
+
+        folder = os.path.join(root, ic['to_source_folder'])
+        ndjson_size = folder_size(folder, lambda name: name == 'bench.ndjson')
+        fields_size = folder_size(folder, lambda name: name == 'bench' + PARQUET_SUFFIX)
+        raw_size = folder_size(folder, lambda name: name == 'bench' + RAW_SUFFIX)
+        print(f"ndjson {ndjson_size / 2**20:.1f} MiB, parquet fields {fields_size / 2**20:.1f} MiB, "
+              f"parquet hl7_raw {raw_size / 2**20:.1f} MiB")
+
+        results = {}
+        for name, query in (('ndjson', query_ndjson), ('parquet', query_parquet)):
+            start = time.perf_counter()
+            results[name] = query(folder)
+            elapsed = time.perf_counter() - start
+            print(f"admits per POC/month from {name:7s}: {elapsed:.3f}s")
+
+        if results['ndjson'] != results['parquet']:
+            raise AssertionError('parquet query result differs from ndjson')
+
+
+if __name__ == '__main__':
+    main()
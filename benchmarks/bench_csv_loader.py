@@ -0,0 +1,105 @@
+import os
+import csv
+import time
+import tempfile
+import tracemalloc
+# ---
+import pandas as pd
+from azure.eventhub import EventData
+from eventHubProducer import send_messages_from_csv
+from benchmarks.corpus import generate_corpus
+from benchmarks.standins import LocalEventHubProducer
+
+# CSV export -> Event Hubs loader - pandas full-file read + serial send (as eventHubProducer did it) vs the
+# streaming csv reader with concurrent batch sends; peak traced memory at two export sizes (bad lines, dead letters
+# and per-partition order are checked in tests/test_eventhub.py)
+
+ROWS = 20000
+# round trip per send, batch size limit of the stand-in producer (smaller than the service's 1 MB, more batches)
+SEND_LATENCY = 0.05
+MAX_BATCH_SIZE = 256 * 1024
+COLUMN = 'dataset'
+BAD_LINE_EVERY = 997
+
+
+def write_export(path, rows):
+    # export layout - id, escaped hl7 (\r as a literal backslash-r), source; some lines with an extra field
+    corpus = generate_corpus(min(rows, 5000))
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', COLUMN, 'source'])
+        for i in range(rows):
+            body = corpus[i % len(corpus)][3].decode('utf-8')
+            escaped = body.replace('\\', '\\\\').replace('\r', '\\r').replace('\n', '\\n')
+            row = [i, escaped, 'EPIC']
+            if i % BAD_LINE_EVERY == BAD_LINE_EVERY - 1:
+                row.append('unexpected')
+            writer.writerow(row)
+
+
+def legacy_load(path, producer):
+    # pandas read twice (main read it once more before sending), one batch filled and sent at a time
+    pd.read_csv(path, delimiter=',', on_bad_lines='skip')[COLUMN]
+    messages = pd.read_csv(path, delimiter=',', on_bad_lines='skip')[COLUMN]
+    batch = producer.create_batch()
+    for message in messages:
+        if not isinstance(message, str):
+            continue
+        event = EventData(message.encode('utf-8').decode('unicode_escape'))
+        try:
+            batch.add(event)
+        except ValueError:
+            producer.send_batch(batch)
+            batch = producer.create_batch()
+            batch.add(event)
+    if len(batch) > 0:
+        producer.send_batch(batch)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def peak_memory(fn):
+    # peak traced memory of fn (timed separately - tracing slows the python-heavy path more than pandas)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def producer():
+    return LocalEventHubProducer(4, SEND_LATENCY, MAX_BATCH_SIZE, keep_sent=False)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, 'export.csv')
+        write_export(path, ROWS)
+        size_mb = os.path.getsize(path) / 2**20
+
+        elapsed = timed(lambda: legacy_load(path, producer()))
+        peak = peak_memory(lambda: legacy_load(path, producer()))
+        print(f"pandas + serial send : {ROWS / elapsed:9.1f} rows/sec, peak traced memory {peak / 2**20:7.1f} MB "
+              f"({size_mb:.1f} MB export)")
+
+        summary = send_messages_from_csv(path, COLUMN, producer())
+        peak = peak_memory(lambda: send_messages_from_csv(path, COLUMN, producer()))
+        print(f"streaming, 4 senders : {summary['rows_per_sec']:9.1f} rows/sec, peak traced memory {peak / 2**20:7.1f} MB "
+              f"({summary['batches']} batches, {summary['bad_lines']} bad lines skipped)")
+
+        # memory stays flat with the export size
+        path = os.path.join(root, 'export4.csv')
+        write_export(path, ROWS * 4)
+        peak = peak_memory(lambda: legacy_load(path, producer()))
+        print(f"pandas, 4x export    : {'':9s}           peak traced memory {peak / 2**20:7.1f} MB "
+              f"({os.path.getsize(path) / 2**20:.1f} MB export)")
+        peak = peak_memory(lambda: send_messages_from_csv(path, COLUMN, producer()))
+        print(f"streaming, 4x export : {'':9s}           peak traced memory {peak / 2**20:7.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
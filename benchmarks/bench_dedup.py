@@ -0,0 +1,52 @@
+import os
+import time
+import tempfile
+# ---
+from function_app import get_message
+from hl7_fields import get_extractor
+from output_sinks import create_sink
+from pipeline import process_records
+from dedup_cache import DedupCache, DedupFilter
+from benchmarks.common import HL7_CLIENT_CONFIG, INTERFACE_CONFIG, synthetic_adt, capture_records
+from benchmarks.standins import LocalContainerClient
+
+MESSAGES = 2000
+DUPLICATE_EVERY = 3     # every 3rd message is re-sent (at-least-once delivery)
+UPLOAD_LATENCY = 0.002
+
+
+def main():
+    messages = synthetic_adt(MESSAGES)
+    bodies = [m.encode('utf-8') for m in messages]
+    bodies += [bodies[i] for i in range(0, MESSAGES, DUPLICATE_EVERY)]
+    records = list(capture_records(bodies))
+    extractor = get_extractor(HL7_CLIENT_CONFIG)
+
+    with tempfile.TemporaryDirectory() as root:
+        for name, path in (('off', None), ('memory', None), ('sqlite', os.path.join(root, 'dedup.sqlite'))):
+            cache = DedupCache(path=path) if name != 'off' else None
+            ic = dict(INTERFACE_CONFIG, to_source_folder=f"parsed_{name}", parse_mode='fast')
+            container_client = LocalContainerClient(root, latency=UPLOAD_LATENCY)
+
+            # same capture file delivered twice - the replay should be skipped entirely
+            for run in ('first delivery', 'replay'):
+                dedup = DedupFilter(cache, ic, HL7_CLIENT_CONFIG) if cache is not None else None
+                sink = create_sink(container_client, ic, 'bench', HL7_CLIENT_CONFIG)
+                uploads = container_client.uploads
+
+                start = time.perf_counter()
+                process_records(iter(records), get_message, ic, HL7_CLIENT_CONFIG, 'bench', sink, extractor, dedup)
+                elapsed = time.perf_counter() - start
+
+                skipped = dedup.skipped if dedup is not None else 0
+                print(f"dedup {name:6s} {run:14s}: {len(records)} records in {elapsed:6.2f}s, "
+                      f"{sink.messages} parsed, {skipped} skipped, {container_client.uploads - uploads} uploads")
+                if dedup is not None and sink.messages != (MESSAGES if run == 'first delivery' else 0):
+                    raise AssertionError(f"dedup {name} {run} parsed {sink.messages} messages")
+
+            if cache is not None:
+                cache.close()
+
+
+if __name__ == '__main__':
+    main()
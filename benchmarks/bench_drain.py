@@ -0,0 +1,88 @@
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from types import SimpleNamespace
+# ---
+import azure.functions as func
+import function_app
+from azure_clients import register_blob_service_client
+from benchmarks.common import HL7_CLIENT_CONFIG, INTERFACE_CONFIG
+from benchmarks.corpus import generate_corpus, write_corpus
+from benchmarks.standins import LocalBlobServiceClient
+
+# Folder drain mode of http_trigger_parsehl7 - one call per capture file vs sharded drain calls running at the same
+# time (plus a duplicate caller per shard, kept off by the blob leases), and a time budget that leaves files for
+# the next call (exactly-once/lease/time budget checks: tests/test_folder_drain.py)
+
+FILES = 24
+MESSAGES = 4800
+SHARDS = 3
+UPLOAD_LATENCY = 0.005
+
+handler = function_app.http_trigger_parsehl7._function.get_user_function()
+context = SimpleNamespace(function_name='bench')
+
+
+def request(ic, **args):
+    body = dict(args, interface_config=ic, hl7_client_config=HL7_CLIENT_CONFIG)
+    return handler(
+        func.HttpRequest(method='POST', url='/api/http_trigger_parsehl7', body=json.dumps(body).encode()), context
+    )
+
+
+def setup(root):
+    service_client = LocalBlobServiceClient(root, UPLOAD_LATENCY)
+    register_blob_service_client(INTERFACE_CONFIG['from_source_host'], service_client)
+    container = service_client.get_container_client(INTERFACE_CONFIG['from_source_container'])
+    names = write_corpus(os.path.join(container.root, INTERFACE_CONFIG['from_source_folder']),
+                         generate_corpus(MESSAGES), FILES)
+    os.remove(os.path.join(container.root, INTERFACE_CONFIG['from_source_folder'], 'manifest.json'))
+    return container, names
+
+
+def main():
+    logging.disable(logging.ERROR)
+    ic = dict(INTERFACE_CONFIG, output_mode='ndjson', parse_mode='fast', file_workers=4)
+
+    with tempfile.TemporaryDirectory() as root:
+        container, names = setup(root)
+        start = time.perf_counter()
+        for name in names:
+            request(ic, from_source_file_avro=name)
+        print(f"one call per file           : {FILES} files in {time.perf_counter() - start:.2f}s ({FILES} calls)")
+
+    with tempfile.TemporaryDirectory() as root:
+        container, names = setup(root)
+        summaries = []
+
+        def call(shard_index):
+            response = request(ic, from_source_drain={'shard_index': shard_index, 'shard_count': SHARDS})
+            summaries.append(json.loads(response.get_body()))
+
+        # two callers per shard at the same time - leases keep them from processing the same file
+        threads = [threading.Thread(target=call, args=(shard,)) for shard in range(SHARDS) for _ in range(2)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        print(f"{SHARDS} shards x 2 callers        : {FILES} files in {elapsed:.2f}s ({len(threads)} calls, "
+              f"{sum(s['files_leased'] for s in summaries)} lease conflicts skipped, "
+              f"files per shard {sorted(s['files_listed'] for s in summaries)[::2]})")
+
+    with tempfile.TemporaryDirectory() as root:
+        container, names = setup(root)
+        calls = []
+        while not calls or calls[-1]['files_remaining']:
+            response = request(dict(ic, file_workers=2), from_source_drain={'time_budget_seconds': 0.15})
+            calls.append(json.loads(response.get_body()))
+        print(f"time budget 0.15s           : {FILES} files over {len(calls)} calls "
+              f"(done per call {[c['files_done'] for c in calls]})")
+
+
+if __name__ == '__main__':
+    main()
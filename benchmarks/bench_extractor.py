@@ -0,0 +1,44 @@
+from hl7apy.parser import parse_message
+# ---
+from hl7_fields import get_extractor
+from benchmarks.common import HL7_CLIENT_CONFIG, ADT_A01, timed
+
+ITERATIONS = 500
+
+
+def getattr_loop(pm, hl7cc):
+    # field walk as get_message did it before the compiled extractor
+    hl7_parsed = {}
+    for hl7_key, label in hl7cc.items():
+        hl7_key_parts = hl7_key.split('.')
+        hl7_object = pm
+        value = ""
+
+        for part in hl7_key_parts:
+            hl7_object = getattr(hl7_object, part, None)
+            if hl7_object is None:
+                break
+            else:
+                value = hl7_object.value.strip()
+
+        hl7_parsed.update({label: value})
+    return hl7_parsed
+
+
+def main():
+    pm = parse_message(ADT_A01)
+    extractor = get_extractor(HL7_CLIENT_CONFIG)
+
+    if getattr_loop(pm, HL7_CLIENT_CONFIG) != extractor.extract(pm):
+        raise AssertionError('compiled extractor output differs from getattr loop')
+
+    loop_total, loop_us = timed(lambda: getattr_loop(pm, HL7_CLIENT_CONFIG), ITERATIONS)
+    comp_total, comp_us = timed(lambda: get_extractor(HL7_CLIENT_CONFIG).extract(pm), ITERATIONS)
+
+    print(f"getattr loop:       {loop_us:9.1f} us/message ({loop_total:.3f}s for {ITERATIONS})")
+    print(f"compiled extractor: {comp_us:9.1f} us/message ({comp_total:.3f}s for {ITERATIONS})")
+    print(f"speedup:            {loop_total / comp_total:9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
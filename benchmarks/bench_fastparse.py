@@ -0,0 +1,35 @@
+import time
+# ---
+from function_app import get_message, PARSE_MODE_FAST
+from hl7_fields import get_extractor
+from benchmarks.common import HL7_CLIENT_CONFIG, INTERFACE_CONFIG, synthetic_adt, synthetic_oru
+
+MESSAGES = 500
+
+
+def run(corpus, ic, extractor):
+    start = time.perf_counter()
+    results = [get_message(m, ic, HL7_CLIENT_CONFIG, 'bench', extractor) for m in corpus]
+    return results, len(corpus) / (time.perf_counter() - start)
+
+
+def main():
+    extractor = get_extractor(HL7_CLIENT_CONFIG)
+    fast_ic = dict(INTERFACE_CONFIG, parse_mode=PARSE_MODE_FAST)
+
+    # ADT (PV1 top-level - fast path) and ORU^R01 (PV1 in a group - fast mode falls back to the full parse)
+    for name, messages in (('ADT', synthetic_adt), ('ORU', synthetic_oru)):
+        for version in ('2.5', '2.9'):
+            corpus = [m.encode('utf-8') for m in messages(MESSAGES, version)]
+            full, full_rate = run(corpus, INTERFACE_CONFIG, extractor)
+            fast, fast_rate = run(corpus, fast_ic, extractor)
+
+            mismatches = sum(1 for a, b in zip(full, fast) if a['hl7_parsed'] != b['hl7_parsed'])
+            print(f"{name} v{version} full hl7apy parse:  {full_rate:10.1f} messages/sec")
+            print(f"{name} v{version} fast:               {fast_rate:10.1f} messages/sec "
+                  f"({fast_rate / full_rate:.1f}x, {mismatches} mismatched)")
+            if mismatches:
+                raise AssertionError(f"{name} v{version} - fast mode differs from the full parse")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+# ---
+import requests
+from blob_hubsHttp import EventHubsHttpSender, get_auth_token, BATCH_CONTENT_TYPE
+from benchmarks.common import synthetic_adt
+
+MESSAGES = 2000
+LATENCY = 0.002
+
+
+class EventHubsStandIn(BaseHTTPRequestHandler):
+    # local stand-in for the Event Hubs REST send endpoint - counts messages, answers 201
+    protocol_version = 'HTTP/1.1'
+    received = []
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers['Content-Type'] == BATCH_CONTENT_TYPE:
+            messages = [m['Body'] for m in json.loads(body)]
+        else:
+            messages = [body.decode('utf-8')]
+        time.sleep(LATENCY)
+        with self.lock:
+            self.received.extend(messages)
+
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), EventHubsStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    url = f"{base_url}/bench/messages"
+    corpus = synthetic_adt(MESSAGES)
+
+    try:
+        # send_message as used before - bare requests.post (new connection) per message, token per run
+        EventHubsStandIn.received = []
+        start = time.perf_counter()
+        sas_token = get_auth_token('bench', 'bench', 'bench', 'key')
+        for hl7_message in corpus:
+            requests.post(url, headers={'Content-Type': 'text/plain', 'Authorization': sas_token}, data=hl7_message)
+        bare_elapsed = time.perf_counter() - start
+        if EventHubsStandIn.received != corpus:
+            raise AssertionError('bare post did not deliver every message')
+
+        for max_in_flight in (1, 4):
+            EventHubsStandIn.received = []
+            sender = EventHubsHttpSender('bench', 'bench', 'bench', 'key', max_in_flight,
+                                         max_batch_bytes=64 * 1024, base_url=base_url)
+            start = time.perf_counter()
+            for hl7_message in corpus:
+                sender.add(hl7_message)
+            sender.close()
+            elapsed = time.perf_counter() - start
+
+            if sorted(EventHubsStandIn.received) != sorted(corpus):
+                raise AssertionError('batched sender did not deliver every message')
+            print(f"batched, {max_in_flight} in flight: {MESSAGES / elapsed:9.1f} messages/sec "
+                  f"({sender.requests} requests, {bare_elapsed / elapsed:.1f}x bare post)")
+
+        print(f"bare requests.post:   {MESSAGES / bare_elapsed:9.1f} messages/sec ({MESSAGES} requests)")
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
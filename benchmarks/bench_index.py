@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import random
+import logging
+import tempfile
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+# ---
+import azure.functions as func
+import function_app
+from azure_clients import register_blob_service_client
+from output_index import IndexReader, compact, index_folder
+from benchmarks.common import HL7_CLIENT_CONFIG, INTERFACE_CONFIG
+from benchmarks.corpus import generate_corpus, write_corpus
+from benchmarks.standins import LocalBlobServiceClient
+
+# Lookup index over the parsed output - finding a visit's / control id's / type+time range's messages by listing and
+# reading the whole output folder vs the index (sync of its segments into the local copy, then sqlite lookups),
+# before and after compaction (lookup-vs-scan and compaction checks: tests/test_output_index.py)
+
+FILES = 24
+MESSAGES = 6000
+LOOKUPS = 200
+LATENCY = 0.002             # per blob request
+SCAN_WORKERS = 16
+
+handler = function_app.http_trigger_parsehl7._function.get_user_function()
+context = SimpleNamespace(function_name='bench')
+
+
+def request(ic, **args):
+    body = dict(args, interface_config=ic, hl7_client_config=HL7_CLIENT_CONFIG)
+    return handler(
+        func.HttpRequest(method='POST', url='/api/http_trigger_parsehl7', body=json.dumps(body).encode()), context
+    )
+
+
+def scan(container, ic):
+    # every parsed message in the output folder - the baseline without an index
+    names = [blob.name for blob in container.list_blobs(name_starts_with=f"{ic['to_source_folder']}/")
+             if not blob.name.endswith('.index.ndjson')]
+
+    def read(name):
+        data = container.get_blob_client(name).download_blob().readall()
+        if name.endswith('.json'):
+            return [json.loads(data)]
+        return [json.loads(line) for line in data.splitlines() if line]
+
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+        return [message for messages in executor.map(read, names) for message in messages]
+
+
+def parsed(message):
+    # hl7_parsed fields, none for messages that did not parse
+    return message.get('hl7_parsed') or {}
+
+
+def queries(messages, rng):
+    # (name, lookup kwargs, expected message_uids) - visits, control ids and a type over a 6 hour window
+    visits = sorted({parsed(m)['visit_number'] for m in messages if parsed(m).get('visit_number')})
+    control_ids = sorted({parsed(m)['message_control_id'] for m in messages
+                          if parsed(m).get('message_control_id')})
+    result = []
+    for visit in rng.sample(visits, min(LOOKUPS, len(visits))):
+        expected = {m['message_uid'] for m in messages if parsed(m).get('visit_number') == visit}
+        result.append(('visit_number', {'visit_number': visit}, expected))
+    for control_id in rng.sample(control_ids, min(LOOKUPS, len(control_ids))):
+        expected = {m['message_uid'] for m in messages if parsed(m).get('message_control_id') == control_id}
+        result.append(('message_control_id', {'message_control_id': control_id}, expected))
+    expected = {m['message_uid'] for m in messages if parsed(m).get('message_type_cd') == 'ADT'
+                and '20240601060000' <= parsed(m).get('message_dttm', '')[:14] < '20240601120000'}
+    result.append(('type + 6h window', {'message_type_cd': 'ADT', 'start': '2024-06-01T06:00:00',
+                                        'end': '2024-06-01T12:00:00', 'limit': len(messages)}, expected))
+    return result
+
+
+def run_lookups(reader, lookups):
+    # seconds per lookup by kind
+    timings = {}
+    for name, kwargs, _ in lookups:
+        start = time.perf_counter()
+        reader.lookup(**kwargs)
+        timings.setdefault(name, []).append(time.perf_counter() - start)
+    return {name: sum(t) / len(t) for name, t in timings.items()}
+
+
+def report(label, timings):
+    print(f"  {label:25s}: " + ', '.join(f"{name} {seconds * 1000:.2f} ms" for name, seconds in timings.items()))
+
+
+def bench(mode):
+    ic = dict(INTERFACE_CONFIG, output_mode=mode, parse_mode='fast', upload_workers=8, output_index=True)
+    with tempfile.TemporaryDirectory() as root:
+        service_client = LocalBlobServiceClient(root, LATENCY)
+        register_blob_service_client(ic['from_source_host'], service_client)
+        container = service_client.get_container_client(ic['from_source_container'])
+        names = write_corpus(os.path.join(container.root, ic['from_source_folder']), generate_corpus(MESSAGES), FILES)
+        os.remove(os.path.join(container.root, ic['from_source_folder'], 'manifest.json'))
+
+        start = time.perf_counter()
+        for name in names:
+            request(ic, from_source_file_avro=name)
+        print(f"{mode}: {FILES} files processed with output_index in {time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        messages = scan(container, ic)
+        scan_seconds = time.perf_counter() - start
+        lookups = queries(messages, random.Random(7))
+        print(f"  scan of the output       : {len(messages)} messages in {scan_seconds * 1000:.0f} ms per lookup")
+
+        reader = IndexReader(container, index_folder(ic), os.path.join(root, 'index.sqlite'))
+        start = time.perf_counter()
+        synced = reader.sync()
+        print(f"  index sync               : {synced['entries']} entries from {synced['segments']} segments in "
+              f"{(time.perf_counter() - start) * 1000:.0f} ms")
+        entries = reader.lookup(limit=2 * len(messages))
+        report('lookup', run_lookups(reader, lookups))
+
+        sample = random.Random(3).sample(entries, 50)
+        start = time.perf_counter()
+        for entry in sample:
+            reader.fetch(entry)
+        print(f"  fetch                    : {(time.perf_counter() - start) / len(sample) * 1000:.2f} ms per message")
+
+        start = time.perf_counter()
+        summary = compact(container, index_folder(ic), min_segments=4, segment_bytes=512 * 1024)
+        compact_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        synced = reader.sync()
+        sync_seconds = time.perf_counter() - start
+        print(f"  compaction               : {summary['merged']} segments -> {len(summary['written'])} in "
+              f"{compact_seconds * 1000:.0f} ms, incremental sync {sync_seconds * 1000:.0f} ms "
+              f"(+{synced['loaded']} -{synced['dropped']})")
+        report('lookup after compaction', run_lookups(reader, lookups))
+
+        reader.close()
+
+
+def main():
+    logging.disable(logging.ERROR)
+    for mode in ('ndjson', 'json'):
+        bench(mode)
+
+
+if __name__ == '__main__':
+    main()
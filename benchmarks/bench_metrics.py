@@ -0,0 +1,46 @@
+import time
+import json
+import tempfile
+# ---
+from function_app import get_message
+from hl7_fields import get_extractor
+from output_sinks import create_sink
+from pipeline import process_records
+from pipeline_metrics import PipelineMetrics
+from benchmarks.common import HL7_CLIENT_CONFIG, INTERFACE_CONFIG, synthetic_adt, capture_records
+from benchmarks.standins import LocalContainerClient
+
+# Overhead of the per-stage instrumentation - same run with metrics off (NULL_METRICS) and on
+
+MESSAGES = {'fast': 2000, 'full': 200}
+RUNS = 3
+
+
+def run(records, ic, extractor, metrics):
+    with tempfile.TemporaryDirectory() as root:
+        sink = create_sink(LocalContainerClient(root), ic, 'bench', HL7_CLIENT_CONFIG)
+        start = time.perf_counter()
+        process_records(iter(records), get_message, ic, HL7_CLIENT_CONFIG, 'bench', sink, extractor, None, metrics)
+        return time.perf_counter() - start
+
+
+def main():
+    records = list(capture_records(m.encode('utf-8') for m in synthetic_adt(max(MESSAGES.values()))))
+    extractor = get_extractor(HL7_CLIENT_CONFIG)
+
+    for parse_mode, messages in MESSAGES.items():
+        ic = dict(INTERFACE_CONFIG, output_mode='ndjson', parse_mode=parse_mode)
+        run(records[:20], ic, extractor, None)
+        off = min(run(records[:messages], ic, extractor, None) for _ in range(RUNS))
+        on = min(run(records[:messages], ic, extractor, PipelineMetrics()) for _ in range(RUNS))
+        print(f"parse_mode={parse_mode}: metrics off {off / messages * 1e6:7.1f} us/message, "
+              f"on {on / messages * 1e6:7.1f} us/message (overhead {(on / off - 1) * 100:+.1f}%)")
+
+    metrics = PipelineMetrics()
+    run(records, dict(INTERFACE_CONFIG, output_mode='ndjson', parse_mode='fast'), extractor, metrics)
+    print(json.dumps(metrics.summary(), indent=2))
+    print(metrics.to_prometheus().splitlines()[-4:])
+
+
+if __name__ == '__main__':
+    main()
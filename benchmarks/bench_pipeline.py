@@ -0,0 +1,69 @@
+import os
+import json
+import time
+import tempfile
+# ---
+from function_app import get_message
+from hl7_fields import get_extractor
+from output_sinks import create_sink
+from pipeline import process_records, available_cores, PARALLEL_PARSE_MIN_SECONDS
+from benchmarks.common import HL7_CLIENT_CONFIG, INTERFACE_CONFIG, synthetic_adt, capture_records
+from benchmarks.standins import LocalContainerClient
+
+MESSAGES = 400
+UPLOAD_LATENCY = 0.01
+CONFIGS = [
+    ('serial', {}),
+    ('2 parse / 8 upload', {'parse_workers': 2, 'upload_workers': 8, 'parse_batch_size': 16}),
+    ('4 parse / 16 upload', {'parse_workers': 4, 'upload_workers': 16, 'parse_batch_size': 16}),
+]
+
+
+def read_outputs(folder):
+    # output file name -> content without the per-run processed_dttm and the output folder name
+    outputs = {}
+    for name in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, name), 'rb') as f:
+            lines = [json.loads(line) for line in f]
+        for line in lines:
+            line.pop('processed_dttm', None)
+            line.pop('blob', None)
+        outputs[name] = json.dumps(lines).encode('utf-8')
+    return outputs
+
+
+def main():
+    records = list(capture_records(m.encode('utf-8') for m in synthetic_adt(MESSAGES)))
+    extractor = get_extractor(HL7_CLIENT_CONFIG)
+    # parse_workers only start the pool with a core to spare and a parse of PARALLEL_PARSE_MIN_SECONDS+ per message
+    print(f"{available_cores()} core(s) available - parse pool used with 2+ cores and a parse of "
+          f"{PARALLEL_PARSE_MIN_SECONDS * 1000:.1f}+ ms per message, inline otherwise")
+
+    with tempfile.TemporaryDirectory() as root:
+        baseline = None
+        for output_mode in ('json', 'ndjson'):
+            serial_elapsed = None
+            for name, options in CONFIGS:
+                folder = f"{output_mode}_{name.replace(' ', '').replace('/', '_')}"
+                ic = dict(INTERFACE_CONFIG, to_source_folder=folder, output_mode=output_mode, **options)
+                container_client = LocalContainerClient(root, latency=UPLOAD_LATENCY)
+
+                start = time.perf_counter()
+                sink = create_sink(container_client, ic, 'bench')
+                process_records(iter(records), get_message, ic, HL7_CLIENT_CONFIG, 'bench', sink, extractor)
+                elapsed = time.perf_counter() - start
+
+                outputs = read_outputs(os.path.join(root, folder))
+                if name == 'serial':
+                    serial_elapsed, baseline = elapsed, outputs
+                elif outputs != baseline:
+                    raise AssertionError(f"{output_mode} {name} output differs from the serial path")
+
+                cores = max(1, options.get('parse_workers', 1))
+                speedup = serial_elapsed / elapsed
+                print(f"{output_mode:6s} {name:20s}: {MESSAGES / elapsed:8.1f} messages/sec, "
+                      f"{speedup:5.2f}x serial, {speedup / cores:5.2f}x per parse core")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import os
+import json
+import tempfile
+# ---
+from blob_hubsProducer import replay
+from benchmarks.common import synthetic_adt
+from benchmarks.standins import LocalContainerClient, LocalEventHubProducer
+
+BLOBS = 2000
+LATENCY = 0.005
+PREFIX = 'AP/2024/7/'
+
+
+def write_blobs(root, count):
+    # blob layout of the replay source - json documents with payload.eventData.HL7
+    folder = os.path.join(root, *PREFIX.split('/'))
+    os.makedirs(folder, exist_ok=True)
+    for i, hl7_message in enumerate(synthetic_adt(count)):
+        with open(os.path.join(folder, f"{i:06d}.txt"), 'w') as f:
+            json.dump({'payload': {'eventData': {'HL7': hl7_message}}}, f)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as root:
+        write_blobs(root, BLOBS)
+
+        baseline = None
+        for name, download_workers, send_workers in (('one at a time', 1, 1), ('concurrent', 16, 4)):
+            container_client = LocalContainerClient(root, latency=LATENCY)
+            producer = LocalEventHubProducer(partitions=4, latency=LATENCY)
+            summary = replay(container_client, producer, PREFIX, download_workers, send_workers)
+
+            sent = sorted(body for bodies in producer.sent.values() for body in bodies)
+            if baseline is None:
+                baseline = sent
+            elif sent != baseline:
+                raise AssertionError('concurrent replay sent different events')
+
+            print(f"{name:14s}: {summary['events_per_sec']:9.1f} events/sec, {summary['mb_per_sec']:7.3f} MB/sec, "
+                  f"{summary['batches']} batches over {len(producer.partition_ids)} partitions")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import random
+import tempfile
+# ---
+from blob_hubsProducer import replay
+from eventHubProducer import send_messages
+from benchmarks.standins import LocalContainerClient, LocalEventHubProducer
+
+# Partition-key routing of the producers - events of a visit (PV1-19) must reach one partition in order, with batch
+# sends still concurrent over partitions; round-robin (no routing field) as the baseline (order checked in
+# tests/test_eventhub.py)
+
+VISITS = 300
+EVENTS_PER_VISIT = 8
+PARTITIONS = 8
+# send round trip (random per send - sends finishing out of submission order), small batches for many sends
+SEND_LATENCY = (0.002, 0.02)
+MAX_BATCH_SIZE = 16 * 1024
+PREFIX = 'AP/2024/7/'
+
+
+class JitterProducer(LocalEventHubProducer):
+    def send_batch(self, batch, **kwargs):
+        time.sleep(random.uniform(*SEND_LATENCY))
+        super().send_batch(batch, **kwargs)
+
+
+def visit_messages(visits, events_per_visit, seed=7):
+    # events of all visits interleaved, visit order shuffled per round - MSH-10 is '<visit>.<event seq>'
+    rng = random.Random(seed)
+    messages = []
+    for seq in range(events_per_visit):
+        for visit in rng.sample(range(visits), visits):
+            messages.append(
+                f"MSH|^~\\&|SendingApp|SendingFac|ReceivingApp|ReceivingFac|2024060112{seq:02d}||ADT^A08|{visit}.{seq}|P|2.5\r"
+                f"EVN|A08|2024060112{seq:02d}\r"
+                f"PID|1||{500000 + visit}^^^MRN||Doe^Jane||19800101|F\r"
+                f"PV1|1|I|MED^101^1^MAIN||||1234^Smith^John^J|||MED|||||||1234567||{700000 + visit}^^^VN\r"
+            )
+    return messages
+
+
+def check_order(producer):
+    # (visits split over partitions, visits with events out of order) from the events the producer sent
+    partitions, last_seq, out_of_order = {}, {}, set()
+    for partition_id, bodies in producer.sent.items():
+        for body in bodies:
+            visit, seq = (int(v) for v in body.split('|', 10)[9].split('.'))
+            partitions.setdefault(visit, set()).add(partition_id)
+            if seq <= last_seq.get((partition_id, visit), -1):
+                out_of_order.add(visit)
+            last_seq[partition_id, visit] = seq
+    split = sum(1 for ids in partitions.values() if len(ids) > 1)
+    return split, len(out_of_order)
+
+
+def write_blobs(root, messages):
+    folder = os.path.join(root, *PREFIX.split('/'))
+    os.makedirs(folder, exist_ok=True)
+    for i, hl7_message in enumerate(messages):
+        with open(os.path.join(folder, f"{i:06d}.txt"), 'w') as f:
+            json.dump({'payload': {'eventData': {'HL7': hl7_message}}}, f)
+
+
+def report(name, producer, events_per_sec):
+    split, out_of_order = check_order(producer)
+    print(f"{name:28s}: {events_per_sec:9.1f} events/sec, {producer.batches:4d} batches, "
+          f"{split:3d} of {VISITS} visits split over partitions, {out_of_order:3d} with events out of order")
+
+
+def main():
+    messages = visit_messages(VISITS, EVENTS_PER_VISIT)
+
+    for routing_field in (None, 'pv1.pv1_19'):
+        label = routing_field or 'round-robin'
+        producer = JitterProducer(PARTITIONS, 0.0, MAX_BATCH_SIZE)
+        summary = send_messages(producer, messages, send_workers=PARTITIONS, routing_field=routing_field).summary()
+        report(f"csv loader, {label}", producer, summary['events'] / summary['elapsed_sec'])
+
+    with tempfile.TemporaryDirectory() as root:
+        write_blobs(root, messages)
+        for routing_field in (None, 'pv1.pv1_19'):
+            label = routing_field or 'round-robin'
+            producer = JitterProducer(PARTITIONS, 0.0, MAX_BATCH_SIZE)
+            summary = replay(LocalContainerClient(root), producer, PREFIX, send_workers=PARTITIONS,
+                             routing_field=routing_field)
+            report(f"replay, {label}", producer, summary['events_per_sec'])
+
+
+if __name__ == '__main__':
+    main()
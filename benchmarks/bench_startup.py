@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+import subprocess
+from collections import defaultdict
+
+# Import time of function_app and time to the first response per warm-up mode (that the modules below stay out
+# of a cold `import function_app` is checked in tests/test_startup.py)
+
+# Modules a cold `import function_app` must not load - deferred to the first request / warm-up
+DEFERRED_MODULES = ('fastavro', 'hl7apy', 'hl7parser', 'azure.identity', 'azure.storage.blob', 'pyarrow')
+TOP_MODULES = 12
+RUNS = 3
+
+
+def import_profile(module):
+    # -X importtime of a fresh `import module` - returns {module: (self us, cumulative us)} and the total
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        check=True, capture_output=True, text=True
+    ).stderr
+
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        modules[name] = (int(self_us), int(cumulative_us))
+    return modules, modules.get(module, (0, 0))[1]
+
+
+def first_response(mode, parse_mode):
+    # fresh interpreter - seconds to import function_app (warm-up per HL7_WARMUP) and parse one message
+    env = dict(os.environ)
+    env.pop('HL7_WARMUP', None)
+    if mode != 'none':
+        env['HL7_WARMUP'] = mode
+    code = (
+        "import time; start = time.perf_counter()\n"
+        "import function_app\n"
+        "loaded = time.perf_counter() - start\n"
+        "from benchmarks.common import HL7_CLIENT_CONFIG, INTERFACE_CONFIG, synthetic_adt\n"
+        f"ic = dict(INTERFACE_CONFIG, parse_mode='{parse_mode}')\n"
+        "start = time.perf_counter()\n"
+        "function_app.get_message(synthetic_adt(1)[0].encode(), ic, HL7_CLIENT_CONFIG, 'bench')\n"
+        "print(loaded, time.perf_counter() - start)\n"
+    )
+    out = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True, env=env)
+    return tuple(float(v) for v in out.stdout.split())
+
+
+def main():
+    modules, total = import_profile('function_app')
+    print(f"import function_app: {total / 1e3:.1f} ms")
+
+    # self import time summed per top-level package
+    packages = defaultdict(int)
+    for name, (self_us, _) in modules.items():
+        packages[name.split('.')[0]] += self_us
+    for name, self_us in sorted(packages.items(), key=lambda item: -item[1])[:TOP_MODULES]:
+        print(f"  {name:28s} {self_us / 1e3:8.1f} ms")
+
+    for module in ('logIPsFunctionApp',):
+        _, total = import_profile(module)
+        print(f"import {module}: {total / 1e3:.1f} ms")
+
+    for mode, parse_mode in (('none', 'fast'), ('none', 'full'), ('sync', 'full')):
+        runs = [first_response(mode, parse_mode) for _ in range(RUNS)]
+        loaded, first = (min(values) for values in zip(*runs))
+        print(f"HL7_WARMUP={mode:5s} parse_mode={parse_mode}: module load {loaded * 1e3:7.1f} ms, "
+              f"first message {first * 1e3:7.1f} ms, time to first response {(loaded + first) * 1e3:7.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
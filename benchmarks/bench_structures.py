@@ -0,0 +1,84 @@
+import sys
+import time
+import subprocess
+# ---
+from hl7parser.hl7 import HL7Message
+from hl7apy.parser import parse_message
+# ---
+from hl7_fields import get_extractor, override_version
+from benchmarks.common import HL7_CLIENT_CONFIG, synthetic_adt
+
+MESSAGES = 300
+# parsed as-is, and overridden by INVALID_VERSION_MAP (2.9 -> 2.8, 2.1 -> 2.5.1)
+VERSIONS = ('2.3', '2.4', '2.5', '2.6', '2.9', '2.1')
+INVALID_VERSION_MAP = {'2.1': '2.5.1', '2.9': '2.8'}
+
+
+def legacy_override(hl7_message, version_map):
+    # hl7parser round trip, as get_message did it before the er7 rewrite
+    pm1 = HL7Message(hl7_message)
+    vid = pm1.msh.version_id
+    str_vid = str(vid[0])
+    if str_vid in version_map:
+        vid.set_attributes(vid.field_map, [version_map.get(str_vid)])
+        return str_vid, '\r'.join(str(pm1).splitlines())
+    return str_vid, hl7_message
+
+
+def parse_all(corpus, override, extractor):
+    results = []
+    for hl7_message in corpus:
+        str_vid, ovrd_hl7_message = override(hl7_message, INVALID_VERSION_MAP)
+        results.append((str_vid, extractor.extract(parse_message(ovrd_hl7_message))))
+    return results
+
+
+def cold_start(mode):
+    # fresh interpreter - seconds for the preload (if any) and for the first message of every version
+    start = time.perf_counter()
+    if mode == 'preload':
+        from hl7_structures import preload_structures
+        preload_structures()
+    preload = time.perf_counter() - start
+
+    extractor = get_extractor(HL7_CLIENT_CONFIG)
+    override = override_version if mode == 'preload' else legacy_override
+    start = time.perf_counter()
+    parse_all([synthetic_adt(1, version)[0] for version in VERSIONS], override, extractor)
+    print(preload, time.perf_counter() - start)
+
+
+def main():
+    for mode in ('legacy', 'preload'):
+        out = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_structures', mode], check=True, capture_output=True, text=True
+        ).stdout.split()
+        preload, first = (float(v) for v in out)
+        print(f"cold start {mode:8s}: preload {preload * 1e3:7.1f} ms, first message of {len(VERSIONS)} versions "
+              f"{first * 1e3:7.1f} ms ({first / len(VERSIONS) * 1e3:.1f} ms each)")
+
+    extractor = get_extractor(HL7_CLIENT_CONFIG)
+    corpus = [m for version in VERSIONS for m in synthetic_adt(MESSAGES // len(VERSIONS), version)]
+
+    start = time.perf_counter()
+    legacy = parse_all(corpus, legacy_override, extractor)
+    legacy_elapsed = time.perf_counter() - start
+
+    from hl7_structures import preload_structures
+    preload_structures()
+    start = time.perf_counter()
+    current = parse_all(corpus, override_version, extractor)
+    elapsed = time.perf_counter() - start
+
+    if current != legacy:
+        raise AssertionError('er7 version override/memoized libraries changed the parsed fields')
+    print(f"per message legacy (hl7parser round trip): {legacy_elapsed / len(corpus) * 1e3:6.2f} ms")
+    print(f"per message er7 override + preloaded:      {elapsed / len(corpus) * 1e3:6.2f} ms "
+          f"({legacy_elapsed / elapsed:.2f}x)")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        cold_start(sys.argv[1])
+    else:
+        main()
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from types import SimpleNamespace
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+# ---
+import azure.functions as func
+import function_app
+from azure_clients import register_blob_service_client
+from blob_hubsHttp import EventHubsHttpSender, BATCH_CONTENT_TYPE
+from blob_hubsProducer import replay
+from eventHubProducer import send_messages
+from io_throttle import IOController, DeadLetterError, throttle_of
+from benchmarks.common import HL7_CLIENT_CONFIG, INTERFACE_CONFIG, synthetic_adt
+from benchmarks.corpus import generate_corpus, write_corpus
+from benchmarks.standins import LocalBlobServiceClient, LocalContainerClient, LocalEventHubProducer, ServiceLimit
+from benchmarks.bench_replay import write_blobs, PREFIX
+
+# Throttling of blob / event hubs I/O - stand-ins answer over a requests/sec limit with 503 ServerBusy (+Retry-After),
+# the amqp server-busy error or http 429; calls without the controller are dropped when throttled (as before),
+# with it they are retried under an adaptive concurrency/rate limit (that nothing is lost is checked in
+# tests/test_io_throttle.py - this reports delivery rates and how the controller settles)
+
+LIMIT = 200                 # requests/sec the stand-in service accepts
+HANDLER_LIMIT = 50          # ... for the handler run (parse bound at ~100 uploads/sec - ORU messages take the full parse)
+RETRY_AFTER = 0.2
+CALLERS = 16
+CALLS = 1600
+LATENCY = 0.005
+
+handler = function_app.http_trigger_parsehl7._function.get_user_function()
+context = SimpleNamespace(function_name='bench')
+
+
+def hammer(container, controller):
+    # CALLS uploads from CALLERS threads - returns (delivered, dropped, seconds)
+    dropped = 0
+    lock = threading.Lock()
+
+    def upload(i):
+        nonlocal dropped
+        blob_client = container.get_blob_client(f"load/{i:05d}.json")
+        try:
+            if controller is None:
+                blob_client.upload_blob(b'{}', overwrite=True)
+            else:
+                controller.call(blob_client.upload_blob, b'{}', overwrite=True)
+        except Exception as e:
+            if not throttle_of(e)[0] and not isinstance(e, DeadLetterError):
+                raise
+            with lock:
+                dropped += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CALLERS) as executor:
+        list(executor.map(upload, range(CALLS)))
+    return CALLS - dropped, dropped, time.perf_counter() - start
+
+
+def controller_settling(root):
+    for name, controller in (('no controller', None), ('IOController', IOController('bench', CALLERS))):
+        limit = ServiceLimit(LIMIT, RETRY_AFTER)
+        container = LocalContainerClient(os.path.join(root, name.replace(' ', '_')), LATENCY, limit=limit)
+        delivered, dropped, elapsed = hammer(container, controller)
+        attempts = limit.admitted + limit.throttled
+        print(f"{name:14s}: {delivered:5d} of {CALLS} uploads delivered, {dropped:4d} dropped, "
+              f"{delivered / elapsed:6.1f}/s (limit {LIMIT}/s), {limit.throttled / attempts:5.1%} of requests throttled"
+              + (f" - settled at {controller.stats()}" if controller is not None else ''))
+
+
+def request(ic, fsfavro):
+    body = {'from_source_file_avro': fsfavro, 'interface_config': ic, 'hl7_client_config': HL7_CLIENT_CONFIG}
+    return handler(func.HttpRequest(method='POST', url='/api/http_trigger_parsehl7', body=json.dumps(body).encode()),
+                   context)
+
+
+def handler_throttled(root):
+    # one capture file, legacy json output (one upload per message) against an unthrottled and a throttling account
+    corpus = generate_corpus(2000)
+    for name, rate, options in (('unthrottled', None, {}), ('throttled, retried', HANDLER_LIMIT, {}),
+                                ('throttled, no retries', HANDLER_LIMIT, {'io_retries': 0})):
+        host = f"https://{name.replace(' ', '').replace(',', '-')}"
+        limit = ServiceLimit(rate, RETRY_AFTER) if rate else None
+        service_client = LocalBlobServiceClient(os.path.join(root, host[8:]), LATENCY, limit=limit)
+        register_blob_service_client(host, service_client)
+        ic = dict(INTERFACE_CONFIG, from_source_host=host, output_mode='json', parse_mode='fast',
+                  upload_workers=CALLERS, **options)
+        container = service_client.get_container_client(ic['from_source_container'])
+        names = write_corpus(os.path.join(container.root, ic['from_source_folder']), corpus, 1)
+
+        start = time.perf_counter()
+        response = request(ic, names[0])
+        elapsed = time.perf_counter() - start
+        output = os.path.join(container.root, ic['to_source_folder'])
+        written = sum(1 for n in os.listdir(output) if n.endswith('.json'))
+        dead_letters = 0
+        for n in os.listdir(output):
+            if n.endswith('.deadletter.ndjson'):
+                with open(os.path.join(output, n)) as f:
+                    dead_letters += sum(1 for _ in f)
+        print(f"handler, {name:22s}: status {response.status_code}, {written} messages written + {dead_letters} "
+              f"dead-lettered in {elapsed:.2f}s ({limit.throttled if limit else 0} requests throttled)")
+
+
+def producers_throttled(root):
+    # replay and the csv loader against a throttling event hub - nothing lost, dead letters accounted for
+    write_blobs(root, 2000)
+    producer = LocalEventHubProducer(4, LATENCY, 16 * 1024, limit=ServiceLimit(20, RETRY_AFTER))
+    summary = replay(LocalContainerClient(root), producer, PREFIX, controller=IOController('bench-replay', 4))
+    print(f"replay        : {producer.events} of 2000 events sent, {summary['dead_lettered']} dead-lettered, "
+          f"{producer.limit.throttled} sends throttled, {summary['events_per_sec']:.1f} events/sec")
+
+    messages = synthetic_adt(2000)
+    dead_letters = []
+    producer = LocalEventHubProducer(4, LATENCY, 16 * 1024, limit=ServiceLimit(5, RETRY_AFTER))
+    stats = send_messages(producer, messages, controller=IOController('bench-csv', 4, retries=0),
+                          dead_letter=lambda batch, error: dead_letters.extend(batch))
+    print(f"csv, no retries: {producer.events} events sent + {len(dead_letters)} dead-lettered "
+          f"({stats.dead_lettered} counted)")
+
+
+class ThrottlingEventHubs(BaseHTTPRequestHandler):
+    # Event Hubs REST stand-in - 429 with Retry-After over its ServiceLimit
+    protocol_version = 'HTTP/1.1'
+    limit = None
+    received = []
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(LATENCY)
+        if not self.limit.admit():
+            self.send_response(429)
+            self.send_header('Retry-After', str(RETRY_AFTER))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        messages = [m['Body'] for m in json.loads(body)] if self.headers['Content-Type'] == BATCH_CONTENT_TYPE \
+            else [body.decode('utf-8')]
+        with self.lock:
+            self.received.extend(messages)
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def http_sender_throttled():
+    ThrottlingEventHubs.limit = ServiceLimit(10, RETRY_AFTER)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ThrottlingEventHubs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    corpus = synthetic_adt(2000)
+    try:
+        sender = EventHubsHttpSender('bench', 'bench', 'bench', 'key', 8, max_batch_bytes=8 * 1024,
+                                     base_url=f"http://127.0.0.1:{server.server_port}",
+                                     controller=IOController('bench-http', 8))
+        for hl7_message in corpus:
+            sender.add(hl7_message)
+        sender.close()
+    finally:
+        server.shutdown()
+    print(f"http sender   : {sender.sent} of {len(corpus)} messages sent, {sender.dead_lettered} dead-lettered, "
+          f"{ThrottlingEventHubs.limit.throttled} requests answered 429")
+
+
+def main():
+    logging.disable(logging.ERROR)
+    with tempfile.TemporaryDirectory() as root:
+        controller_settling(root)
+        handler_throttled(root)
+        producers_throttled(os.path.join(root, 'replay'))
+    http_sender_throttled()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import time
+
+# hl7_client_config used by the benchmarks (same shape as the interface configs in production)
+HL7_CLIENT_CONFIG = {
+    'msh.msh_3.msh_3_1': 'sending_application',
+    'msh.msh_4.msh_4_1': 'sending_facility',
+    'msh.msh_5.msh_5_1': 'receiving_application',
+    'msh.msh_6.msh_6_1': 'receiving_facility',
+    'msh.msh_7': 'message_dttm',
+    'msh.msh_10': 'message_control_id',
+    'msh.msh_11': 'processing_type_cd',
+    'msh.msh_12': 'version_id',
+    'msh.msh_9.msh_9_1': 'message_type_cd',
+    'msh.msh_9.msh_9_2': 'trigger_event_type_cd',
+    'evn.evn_2': 'recorded_dttm',
+    'pv1.pv1_19.pv1_19_1': 'visit_number',
+    'pv1.pv1_2': 'patient_class_cd',
+    'pv1.pv1_3.pv1_3_1': 'point_of_care_cd',
+    'pv1.pv1_3.pv1_3_2': 'room',
+    'pv1.pv1_3.pv1_3_3': 'bed',
+    'pv1.pv1_3.pv1_3_4': 'assigned_facility',
+    'pv1.pv1_4': 'admission_type_cd',
+    'pv1.pv1_10': 'hospital_service_cd',
+    'pv1.pv1_14': 'admit_source_cd',
+    'pv1.pv1_18': 'patient_type_cd',
+    'pv1.pv1_36': 'discharge_disposition_cd',
+    'pv1.pv1_44': 'admit_dttm',
+    'pv1.pv1_45': 'discharge_dttm'
+}
+
+INTERFACE_CONFIG = {
+    'interface_id': 1,
+    'short_name': 'BENCH_ADT',
+    'from_source_id': 1,
+    'from_source_short_name': 'BENCH_EH',
+    'to_source_id': 2,
+    'to_source_short_name': 'BENCH_BLOB',
+    'from_source_host': 'https://localhost',
+    'from_source_container': 'hl7',
+    'from_source_folder': 'capture',
+    'from_source_archive_folder': 'archive',
+    'to_source_folder': 'parsed'
+}
+
+ADT_A01 = (
+    "MSH|^~\\&|SendingApp|SendingFac|ReceivingApp|ReceivingFac|202410291200||ADT^A01|123456|P|2.5\r"
+    "EVN|A01|202410291200\r"
+    "PV1|1|I|ED^B1^Room 101^Bed 1||||1234^Smith^John^J|||SUR|||||||1234567||67890|||||||||||||||||||||||||202410291200\r"
+)
+
+
+def timed(fn, n):
+    # run fn n times and return (total seconds, per-call microseconds)
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    elapsed = time.perf_counter() - start
+    return elapsed, elapsed / n * 1e6
+
+
+def synthetic_adt(n, version='2.5'):
+    # n ADT A01/A02/A03/A08 messages with varying points of care, visits and timestamps
+    pocs = ('ED', 'ICU', 'MED', 'MEDTELE', 'PAT', 'OR')
+    events = ('A01', 'A02', 'A03', 'A08')
+    messages = []
+    for i in range(n):
+        event = events[i % len(events)]
+        poc = pocs[i % len(pocs)]
+        dttm = f"202406{1 + i % 28:02d}{i % 24:02d}{i % 60:02d}"
+        discharge = dttm if event == 'A03' else ''
+        messages.append(
+            f"MSH|^~\\&|SendingApp|SendingFac|ReceivingApp|ReceivingFac|{dttm}||ADT^{event}|{100000 + i}|P|{version}\r"
+            f"EVN|{event}|{dttm}\r"
+            f"PID|1||{500000 + i % 997}^^^MRN||Doe^Jane||19800101|F\r"
+            f"PV1|1|I|{poc}^{100 + i % 40}^{1 + i % 2}^MAIN||||1234^Smith^John^J|||MED|||||||1234567||"
+            f"{700000 + i % 4999}|||||||||||||||||||||||||{dttm}|{discharge}\r"
+        )
+    return messages
+
+
+
+def synthetic_oru(n, version='2.5'):
+    # n ORU^R01 results with PID/PV1 - PV1 sits in the PATIENT_RESULT.PATIENT.VISIT group of ORU_R01 (2.5+),
+    # so the full parse does not resolve pv1 paths from the message root
+    pocs = ('ED', 'ICU', 'MED')
+    messages = []
+    for i in range(n):
+        dttm = f"202406{1 + i % 28:02d}{i % 24:02d}{i % 60:02d}"
+        messages.append(
+            f"MSH|^~\\&|LAB|MAINHOSP|ReceivingApp|ReceivingFac|{dttm}||ORU^R01|{200000 + i}|P|{version}\r"
+            f"PID|1||{500000 + i % 997}^^^MRN||Doe^Jane||19800101|F\r"
+            f"PV1|1|I|{pocs[i % len(pocs)]}^B{1 + i % 9}^1^MAIN||||1234^Smith^John^J|||MED|||||||1234567||V{i}\r"
+            f"OBR|1|||2345-7^Glucose^LN|||{dttm}\r"
+            f"OBX|1|NM|2345-7^Glucose^LN||{70 + i % 70}|mg/dL|70-140|N|||F\r"
+        )
+    return messages
+
+# Event Hubs Capture avro schema
+CAPTURE_SCHEMA = {
+    'type': 'record',
+    'name': 'EventData',
+    'namespace': 'Microsoft.ServiceBus.Messaging',
+    'fields': [
+        {'name': 'SequenceNumber', 'type': 'long'},
+        {'name': 'Offset', 'type': 'string'},
+        {'name': 'EnqueuedTimeUtc', 'type': 'string'},
+        {'name': 'SystemProperties', 'type': {'type': 'map', 'values': ['long', 'double', 'string', 'bytes']}},
+        {'name': 'Properties', 'type': {'type': 'map', 'values': ['long', 'double', 'string', 'bytes', 'null']}},
+        {'name': 'Body', 'type': ['null', 'bytes']}
+    ]
+}
+
+
+def capture_records(bodies):
+    # wrap raw event bodies (bytes) as Event Hubs Capture records
+    for i, body in enumerate(bodies):
+        yield {
+            'SequenceNumber': i,
+            'Offset': str(i * 1024),
+            'EnqueuedTimeUtc': '6/1/2024 12:00:00 PM',
+            'SystemProperties': {'x-opt-enqueued-time': 1717243200000},
+            'Properties': {},
+            'Body': body
+        }
+
+
+def write_capture_avro(path, bodies, sync_interval=1000 * 1024):
+    # write bodies to path as an Event Hubs Capture avro file (~sync_interval bytes per avro block)
+    from fastavro import writer, parse_schema
+
+    with open(path, 'wb') as f:
+        writer(f, parse_schema(CAPTURE_SCHEMA), capture_records(bodies), sync_interval=sync_interval)
@@ -0,0 +1,182 @@
+import os
+import sys
+import json
+import random
+import argparse
+from collections import Counter
+from datetime import datetime, timedelta
+# ---
+from benchmarks.common import write_capture_avro
+
+# Synthetic HL7 corpus - deterministic for a seed, so runs on different commits parse the same messages
+
+# Versions seen on the wire (2.1, 2.7.1, 2.9, 2.9.1 go through INVALID_VERSION_MAP) with relative weights
+CORPUS_VERSIONS = {
+    '2.1': 1, '2.2': 1, '2.3': 8, '2.3.1': 4, '2.4': 4, '2.5': 6, '2.5.1': 10, '2.6': 2,
+    '2.7': 2, '2.7.1': 1, '2.8': 2, '2.8.1': 1, '2.8.2': 1, '2.9': 1, '2.9.1': 1
+}
+# Message types with relative weights
+CORPUS_MESSAGE_TYPES = {'ADT^A01': 3, 'ADT^A03': 3, 'ADT^A08': 6, 'ORU^R01': 4}
+
+# Malformed cases mixed in at DEFAULT_MALFORMED_RATE
+KIND_VALID = 'valid'
+MALFORMED_KINDS = ('no_msh', 'truncated', 'empty', 'bad_version', 'bad_encoding_chars', 'lf_separators')
+DEFAULT_MALFORMED_RATE = 0.03
+
+DEFAULT_MESSAGES = 5000
+DEFAULT_FILES = 5
+DEFAULT_SEED = 20240601
+
+POCS = ('ED', 'ICU', 'MED', 'MEDTELE', 'PAT', 'OR', 'L&D', 'PEDS')
+SERVICES = ('MED', 'SUR', 'CAR', 'ORT', 'OBS', 'NEU')
+OBSERVATIONS = (
+    ('2345-7', 'Glucose', 'mg/dL', 70, 140), ('2951-2', 'Sodium', 'mmol/L', 133, 147),
+    ('2823-3', 'Potassium', 'mmol/L', 3.2, 5.4), ('718-7', 'Hemoglobin', 'g/dL', 11.0, 17.5),
+    ('6690-2', 'WBC', '10*3/uL', 3.5, 11.5), ('2160-0', 'Creatinine', 'mg/dL', 0.5, 1.4)
+)
+ORIGIN = datetime(2024, 6, 1)
+
+
+def _weighted(rng, weights):
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+
+def _dttm(dt):
+    return dt.strftime('%Y%m%d%H%M%S')
+
+
+def _msh(version, message_type, dt, control_id):
+    return (f"MSH|^~\\&|EPIC|MAINHOSP|HL7ROUTER|ANALYTICS|{_dttm(dt)}||{message_type}|{control_id}|P|{version}")
+
+
+def _pid(rng, mrn):
+    return (f"PID|1||{mrn}^^^MRN^MR||{rng.choice(('Doe', 'Roe', 'Poe', 'Moe'))}^{rng.choice(('Jane', 'John', 'Alex'))}"
+            f"||{rng.randint(1930, 2023)}{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}|{rng.choice('FMU')}")
+
+
+def _pv1(rng, visit, admit, discharge=None):
+    fields = [''] * 46
+    fields[:5] = ['PV1', '1', rng.choice('IEO'), f"{rng.choice(POCS)}^{rng.randint(100, 160)}^{rng.randint(1, 2)}^MAIN",
+                  rng.choice('ERU')]
+    fields[7] = '1234^Smith^John^J'
+    fields[10] = rng.choice(SERVICES)
+    fields[14] = rng.choice('1279')
+    fields[18] = rng.choice(('INP', 'OBS', 'EMR'))
+    fields[19] = f"{visit}^^^VN"
+    fields[36] = '01' if discharge else ''
+    fields[44] = _dttm(admit)
+    fields[45] = _dttm(discharge) if discharge else ''
+    return '|'.join(fields).rstrip('|')
+
+
+def _adt(rng, i, version, event, dt):
+    visit = 700000 + rng.randint(0, 4999)
+    admit = dt - timedelta(hours=rng.randint(0, 240)) if event != 'A01' else dt
+    segments = [
+        _msh(version, f"ADT^{event}", dt, 100000 + i),
+        f"EVN|{event}|{_dttm(dt)}",
+        _pid(rng, 500000 + rng.randint(0, 19999)),
+        _pv1(rng, visit, admit, dt if event == 'A03' else None)
+    ]
+    if rng.random() < 0.3:
+        segments.append(f"AL1|1|DA|{rng.randint(1000, 9999)}^PENICILLIN|SV")
+    return segments
+
+
+def _oru(rng, i, version, dt):
+    segments = [
+        _msh(version, 'ORU^R01', dt, 100000 + i),
+        _pid(rng, 500000 + rng.randint(0, 19999)),
+        _pv1(rng, 700000 + rng.randint(0, 4999), dt - timedelta(hours=rng.randint(1, 96))),
+        f"OBR|1|{i}^LAB|{i}^LIS|80053^METABOLIC PANEL^CPT|||{_dttm(dt)}"
+    ]
+    for n, (code, name, units, low, high) in enumerate(rng.sample(OBSERVATIONS, rng.randint(2, len(OBSERVATIONS))), 1):
+        value = round(rng.uniform(low * 0.8, high * 1.2), 1)
+        flag = 'L' if value < low else 'H' if value > high else 'N'
+        segments.append(f"OBX|{n}|NM|{code}^{name}^LN||{value}|{units}|{low}-{high}|{flag}|||F|||{_dttm(dt)}")
+    return segments
+
+
+def _malform(rng, kind, segments):
+    if kind == 'no_msh':
+        return '\r'.join(segments[1:]) + '\r'
+    if kind == 'truncated':
+        text = '\r'.join(segments)
+        return text[:rng.randint(4, len(segments[0]) - 1)]
+    if kind == 'empty':
+        return ''
+    if kind == 'bad_version':
+        return '\r'.join([segments[0].rsplit('|', 1)[0] + '|3.0'] + segments[1:]) + '\r'
+    if kind == 'bad_encoding_chars':
+        return '\r'.join([segments[0].replace('^~\\&', '^', 1)] + segments[1:]) + '\r'
+    # lf_separators - segments split by \n instead of \r (seen from some interface engines)
+    return '\n'.join(segments) + '\n'
+
+
+def generate_corpus(n=DEFAULT_MESSAGES, seed=DEFAULT_SEED, malformed_rate=DEFAULT_MALFORMED_RATE,
+                    versions=CORPUS_VERSIONS, message_types=CORPUS_MESSAGE_TYPES):
+    # n messages as [(kind, version, message type, body bytes)] - same list for the same arguments
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(n):
+        version = _weighted(rng, versions)
+        message_type = _weighted(rng, message_types)
+        dt = ORIGIN + timedelta(minutes=i * 3 + rng.randint(0, 2))
+        if message_type == 'ORU^R01':
+            segments = _oru(rng, i, version, dt)
+        else:
+            segments = _adt(rng, i, version, message_type.split('^')[1], dt)
+
+        kind = rng.choice(MALFORMED_KINDS) if rng.random() < malformed_rate else KIND_VALID
+        text = '\r'.join(segments) + '\r' if kind == KIND_VALID else _malform(rng, kind, segments)
+        corpus.append((kind, version, message_type, text.encode('utf-8')))
+    return corpus
+
+
+def corpus_manifest(corpus, seed):
+    # counts per kind/version/message type (also a quick check that two corpora are the same)
+    return {
+        'seed': seed,
+        'messages': len(corpus),
+        'bytes': sum(len(body) for *_, body in corpus),
+        'kinds': dict(Counter(kind for kind, *_ in corpus)),
+        'versions': dict(Counter(version for _, version, *_ in corpus)),
+        'message_types': dict(Counter(message_type for _, _, message_type, _ in corpus))
+    }
+
+
+def capture_file_names(files):
+    return [f"corpus_{i:03d}.avro" for i in range(files)]
+
+
+def write_corpus(folder, corpus, files=DEFAULT_FILES, seed=DEFAULT_SEED):
+    # split corpus over files Event Hubs Capture avro files in folder (plus manifest.json) - returns the file names
+    os.makedirs(folder, exist_ok=True)
+    names = capture_file_names(files)
+    per_file = -(-len(corpus) // files)
+    for i, name in enumerate(names):
+        write_capture_avro(os.path.join(folder, name), [body for *_, body in corpus[i * per_file:(i + 1) * per_file]])
+
+    manifest = dict(corpus_manifest(corpus, seed), files=names)
+    with open(os.path.join(folder, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return names
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic HL7 corpus as Event Hubs Capture avro files')
+    parser.add_argument('folder')
+    parser.add_argument('--messages', type=int, default=DEFAULT_MESSAGES)
+    parser.add_argument('--files', type=int, default=DEFAULT_FILES)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--malformed-rate', type=float, default=DEFAULT_MALFORMED_RATE)
+    args = parser.parse_args(argv)
+
+    corpus = generate_corpus(args.messages, args.seed, args.malformed_rate)
+    write_corpus(args.folder, corpus, args.files, args.seed)
+    json.dump(corpus_manifest(corpus, args.seed), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import os
+import json
+import time
+import tempfile
+from datetime import datetime, timezone
+# ---
+import azure.functions as func
+# ---
+from function_app import process_event_batch, get_message
+from hl7_fields import get_extractor
+from output_sinks import create_sink
+from pipeline import process_records
+from benchmarks.common import HL7_CLIENT_CONFIG, INTERFACE_CONFIG, synthetic_adt, capture_records
+from benchmarks.standins import LocalContainerClient
+
+# Drives the event hubs batch handler (process_event_batch) with in-memory func.EventHubEvent lists - batch
+# latency, next to the capture/avro path for the same messages (output equivalence, redelivery and the trigger's
+# retry policy are checked in tests/test_eventhub.py)
+
+MESSAGES = 600
+BATCH_SIZE = 100
+PARTITION_ID = '3'
+
+
+def make_events(bodies, first_sequence_number=0, partition_id=PARTITION_ID):
+    # event batch as the host delivers it with cardinality many - batch trigger metadata on every event
+    metadata = {'PartitionContext': func.meta.Datum(json.dumps({'PartitionId': partition_id}), 'json')}
+    return [
+        func.EventHubEvent(
+            body=body, trigger_metadata=metadata, enqueued_time=datetime.now(timezone.utc),
+            sequence_number=first_sequence_number + i, offset=str(first_sequence_number + i)
+        )
+        for i, body in enumerate(bodies)
+    ]
+
+
+def read_messages(folder):
+    # parsed messages under folder (ndjson), without the per-run processed_dttm
+    messages = []
+    for name in sorted(os.listdir(folder)):
+        if name.endswith('.ndjson') and not name.endswith('.index.ndjson'):
+            with open(os.path.join(folder, name), 'rb') as f:
+                for line in f:
+                    message = json.loads(line)
+                    message.pop('processed_dttm')
+                    messages.append(message)
+    return messages
+
+
+def main():
+    bodies = [m.encode('utf-8') for m in synthetic_adt(MESSAGES)] + [b'not an hl7 message']
+    extractor = get_extractor(HL7_CLIENT_CONFIG)
+
+    with tempfile.TemporaryDirectory() as root:
+        container_client = LocalContainerClient(root)
+
+        # reference - the same messages through the avro path
+        avro_ic = dict(INTERFACE_CONFIG, to_source_folder='avro', output_mode='ndjson')
+        begin = time.perf_counter()
+        sink = create_sink(container_client, avro_ic, 'capture', HL7_CLIENT_CONFIG)
+        process_records(capture_records(bodies), get_message, avro_ic, HL7_CLIENT_CONFIG, 'harness', sink, extractor)
+        avro_elapsed = time.perf_counter() - begin
+
+        ic = dict(INTERFACE_CONFIG, to_source_folder='eventhub', output_mode='ndjson', dedup_mode='memory')
+        latencies = []
+        written = []
+        for start in range(0, len(bodies), BATCH_SIZE):
+            events = make_events(bodies[start:start + BATCH_SIZE], start)
+            begin = time.perf_counter()
+            _, batch_written = process_event_batch(events, ic, HL7_CLIENT_CONFIG, 'harness', container_client)
+            latencies.append(time.perf_counter() - begin)
+            written.extend(batch_written)
+
+        latencies.sort()
+        print(f"{len(bodies)} events in {len(latencies)} batches of {BATCH_SIZE} - {len(written)} blobs, "
+              f"batch latency p50 {latencies[len(latencies) // 2] * 1e3:.1f} ms, max {latencies[-1] * 1e3:.1f} ms")
+        print(f"avro path, same messages: {avro_elapsed * 1e3:.1f} ms, event batches: {sum(latencies) * 1e3:.1f} ms "
+              f"- blobs e.g. {written[0]}")
+
+
+if __name__ == '__main__':
+    main()
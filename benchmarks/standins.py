@@ -0,0 +1,407 @@
+import os
+import time
+import threading
+from itertools import count
+from types import SimpleNamespace
+from datetime import datetime, timezone
+# ---
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.eventhub.exceptions import EventHubError
+
+# Local stand-ins for the azure.storage.blob / azure.eventhub clients used by the pipeline and producers.
+# Only the calls the repo makes are implemented; blob names map to paths under a root folder.
+
+
+class ServiceLimit:
+    # service-side request limit shared by stand-in clients - `rate` requests/sec (token bucket, one second's
+    # burst); requests over it are throttled and told to come back after retry_after seconds
+
+    def __init__(self, rate, retry_after=1.0):
+        self.rate = rate
+        self.retry_after = retry_after
+        self.admitted = 0
+        self.throttled = 0
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def admit(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(float(self.rate), self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1.0:
+                self.throttled += 1
+                return False
+            self._tokens -= 1.0
+            self.admitted += 1
+            return True
+
+
+def _check_limit(limit):
+    # 503 ServerBusy with Retry-After, as storage answers over its limits
+    if limit is not None and not limit.admit():
+        headers = {'Retry-After': str(limit.retry_after), 'x-ms-error-code': 'ServerBusy'}
+        response = SimpleNamespace(status_code=503, reason='Server Busy', headers=headers, text=lambda: '')
+        raise HttpResponseError(message='Operations per second is over the account limit.', response=response,
+                                error_code='ServerBusy')
+
+
+class LocalDownloader:
+    def __init__(self, path, offset=None, length=None):
+        self._path = path
+        self._offset = offset or 0
+        size = os.path.getsize(path)
+        self._length = size - self._offset if length is None else min(length, size - self._offset)
+
+    def readall(self):
+        with open(self._path, 'rb') as f:
+            f.seek(self._offset)
+            return f.read(self._length)
+
+
+class LocalBlobClient:
+    def __init__(self, container, name):
+        self.container = container
+        self.blob_name = name
+        self.path = os.path.join(container.root, *name.split('/'))
+        self.url = 'file://' + self.path
+
+    def get_blob_properties(self):
+        copy = self.container.poll_copy(self.blob_name)
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            if copy is None:
+                raise ResourceNotFoundError(f"The specified blob does not exist - {self.blob_name}")
+            # destination of a copy that has not completed
+            return SimpleNamespace(name=self.blob_name, size=0, etag=None, copy=copy)
+        return SimpleNamespace(
+            name=self.blob_name,
+            size=stat.st_size,
+            etag=_etag(stat),
+            last_modified=datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+            content_settings=SimpleNamespace(
+                content_type='text/plain' if self.blob_name.endswith('.txt') else 'application/octet-stream'
+            ),
+            copy=copy or SimpleNamespace(id=None, status=None)
+        )
+
+    def download_blob(self, offset=None, length=None, etag=None, match_condition=None, **kwargs):
+        time.sleep(self.container.latency)
+        _check_limit(self.container.limit)
+        if etag is not None and match_condition == MatchConditions.IfNotModified and etag != _etag(os.stat(self.path)):
+            raise ResourceModifiedError('The condition specified using HTTP conditional header(s) is not met.')
+        self.container.downloads += 1
+        return LocalDownloader(self.path, offset, length)
+
+    def upload_blob(self, data, overwrite=False, **kwargs):
+        time.sleep(self.container.latency)
+        _check_limit(self.container.limit)
+        if not overwrite and os.path.exists(self.path):
+            raise ResourceExistsError(f"The specified blob already exists - {self.blob_name}")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with open(self.path, 'wb') as f:
+            f.write(data)
+        self.container.uploads += 1
+        self.container.requests += 1
+
+    def stage_block(self, block_id, data, **kwargs):
+        time.sleep(self.container.latency)
+        _check_limit(self.container.limit)
+        self.container.staged[(self.blob_name, block_id)] = bytes(data)
+        self.container.requests += 1
+
+    def commit_block_list(self, block_list, **kwargs):
+        data = b''.join(self.container.staged.pop((self.blob_name, block.id)) for block in block_list)
+        self.upload_blob(data, overwrite=True)
+
+    def start_copy_from_url(self, source_url, requires_sync=False, source_etag=None, **kwargs):
+        # sync copies complete at once; async copies per container.copy_polls/copy_failures
+        source_path = source_url[len('file://'):]
+        if source_etag is not None and source_etag != _etag(os.stat(source_path)):
+            raise ResourceModifiedError('The condition specified using HTTP conditional header(s) is not met.')
+        return self.container.start_copy(self.blob_name, source_path, self.path, requires_sync)
+
+    def abort_copy(self, copy_id, **kwargs):
+        self.container.abort_copy(self.blob_name, copy_id)
+
+    def acquire_lease(self, lease_duration=-1, lease_id=None, **kwargs):
+        return self.container.acquire_lease(self, lease_duration)
+
+    def delete_blob(self, etag=None, match_condition=None, lease=None, **kwargs):
+        self.container.delete(self, etag, getattr(lease, 'id', lease))
+
+
+class LocalLease:
+    # BlobLeaseClient - renew/release against the container's lease table
+
+    def __init__(self, container, name, lease_id, duration):
+        self._container = container
+        self._name = name
+        self._duration = duration
+        self.id = lease_id
+
+    def renew(self, **kwargs):
+        self._container.renew_lease(self._name, self.id, self._duration)
+
+    def release(self, **kwargs):
+        self._container.release_lease(self._name, self.id)
+
+
+def _etag(stat):
+    return f'"0x{stat.st_mtime_ns:X}{stat.st_size:X}"'
+
+
+def _copy_file(source_path, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(source_path, 'rb') as src, open(path, 'wb') as dst:
+        dst.write(src.read())
+
+
+class LocalContainerClient:
+    def __init__(self, root, latency=0.0, copy_polls=0, copy_failures=0, limit=None):
+        # latency: seconds slept per upload/stage request, to model the network round trip
+        # copy_polls: status polls an async copy stays pending; copy_failures: async copies that end 'failed'
+        # limit (ServiceLimit): download/upload/stage requests over it fail with 503 ServerBusy
+        self.root = root
+        self.latency = latency
+        self.limit = limit
+        self.copy_polls = copy_polls
+        self.copy_failures = copy_failures
+        self.downloads = 0
+        self.uploads = 0
+        self.requests = 0
+        self.staged = {}
+        self.copies = {}            # destination blob name -> [copy id, status, polls left, source path, path, etag]
+        self._copy_ids = count(1)
+        self._lock = threading.Lock()
+        self.leases = {}            # blob name -> (lease id, expiry monotonic time or None for infinite)
+        self._lease_ids = count(1)
+        os.makedirs(root, exist_ok=True)
+
+    def acquire_lease(self, blob_client, duration):
+        name = blob_client.blob_name
+        with self._lock:
+            if not os.path.exists(blob_client.path):
+                raise ResourceNotFoundError(f"The specified blob does not exist - {name}")
+            held = self.leases.get(name)
+            if held is not None and (held[1] is None or held[1] > time.monotonic()):
+                raise ResourceExistsError('There is already a lease present.')
+            lease_id = f"lease-{next(self._lease_ids)}"
+            self.leases[name] = (lease_id, None if duration == -1 else time.monotonic() + duration)
+            return LocalLease(self, name, lease_id, duration)
+
+    def renew_lease(self, name, lease_id, duration):
+        with self._lock:
+            if self.leases.get(name, (None,))[0] != lease_id:
+                raise HttpResponseError('The lease ID specified did not match the lease ID for the blob.')
+            self.leases[name] = (lease_id, None if duration == -1 else time.monotonic() + duration)
+
+    def release_lease(self, name, lease_id):
+        with self._lock:
+            if self.leases.get(name, (None,))[0] != lease_id:
+                raise HttpResponseError('The lease ID specified did not match the lease ID for the blob.')
+            del self.leases[name]
+
+    def delete(self, blob_client, etag, lease_id):
+        # conditional delete - the blob's etag must match (if given) and an active lease needs its lease id
+        name = blob_client.blob_name
+        with self._lock:
+            try:
+                stat = os.stat(blob_client.path)
+            except FileNotFoundError:
+                raise ResourceNotFoundError(f"The specified blob does not exist - {name}")
+            if etag is not None and etag != _etag(stat):
+                raise ResourceModifiedError('The condition specified using HTTP conditional header(s) is not met.')
+            held = self.leases.get(name)
+            if held is not None and (held[1] is None or held[1] > time.monotonic()) and held[0] != lease_id:
+                raise HttpResponseError('There is currently a lease on the blob and no lease ID was specified.')
+            os.remove(blob_client.path)
+            self.leases.pop(name, None)
+
+    def get_blob_client(self, blob):
+        return LocalBlobClient(self, getattr(blob, 'name', blob))
+
+    def start_copy(self, name, source_path, path, requires_sync):
+        with self._lock:
+            copy = self.copies[name] = [
+                f"copy-{next(self._copy_ids)}", 'pending', self.copy_polls, source_path, path, _etag(os.stat(source_path))
+            ]
+            if not requires_sync and self.copy_failures > 0:
+                self.copy_failures -= 1
+                copy[1] = 'failed'
+            elif requires_sync or self.copy_polls == 0:
+                self._finish_copy(copy)
+            return {'copy_id': copy[0], 'copy_status': copy[1]}
+
+    def poll_copy(self, name):
+        # copy properties of destination blob name (None if never copied to)
+        with self._lock:
+            copy = self.copies.get(name)
+            if copy is None:
+                return None
+            if copy[1] == 'pending':
+                copy[2] -= 1
+                if copy[2] <= 0:
+                    self._finish_copy(copy)
+            return SimpleNamespace(id=copy[0], status=copy[1])
+
+    def abort_copy(self, name, copy_id):
+        with self._lock:
+            copy = self.copies.get(name)
+            if copy is not None and copy[0] == copy_id and copy[1] == 'pending':
+                copy[1] = 'aborted'
+
+    def _finish_copy(self, copy):
+        # a copy fails if its source was modified while pending
+        if _etag(os.stat(copy[3])) != copy[5]:
+            copy[1] = 'failed'
+            return
+        _copy_file(copy[3], copy[4])
+        copy[1] = 'success'
+
+    def list_blobs(self, name_starts_with=None, results_per_page=None, **kwargs):
+        names = []
+        for dir_path, _, files in os.walk(self.root):
+            for file_name in files:
+                name = os.path.relpath(os.path.join(dir_path, file_name), self.root).replace(os.sep, '/')
+                if not name_starts_with or name.startswith(name_starts_with):
+                    names.append(name)
+        return LocalItemPaged(self, sorted(names), results_per_page or 5000)
+
+
+class LocalBlobServiceClient:
+    # BlobServiceClient - one LocalContainerClient (folder under root) per container name
+
+    def __init__(self, root, latency=0.0, **options):
+        # options: LocalContainerClient copy_polls/copy_failures/limit
+        self.root = root
+        self.latency = latency
+        self.options = options
+        self._containers = {}
+
+    def get_container_client(self, container):
+        name = getattr(container, 'name', container)
+        if name not in self._containers:
+            self._containers[name] = LocalContainerClient(os.path.join(self.root, name), self.latency, **self.options)
+        return self._containers[name]
+
+
+class LocalItemPaged:
+    # ItemPaged over a name-ordered listing - continuation token is the last name of the previous page
+
+    def __init__(self, container, names, page_size):
+        self._container = container
+        self._names = names
+        self._page_size = page_size
+        self.continuation_token = None
+
+    def __iter__(self):
+        for page in self.by_page():
+            yield from page
+
+    def by_page(self, continuation_token=None):
+        return LocalPageIterator(self._container, self._names, self._page_size, continuation_token)
+
+
+class LocalPageIterator:
+    # page iterator - continuation_token is the token of the next page once a page has been fetched
+
+    def __init__(self, container, names, page_size, continuation_token):
+        self._container = container
+        self._names = [n for n in names if continuation_token is None or n > continuation_token]
+        self._page_size = page_size
+        self._start = 0
+        self.continuation_token = continuation_token
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._start >= len(self._names):
+            raise StopIteration
+        # one list request per page - throttled before the iterator moves on, like the azure-core page iterator
+        _check_limit(self._container.limit)
+        page = self._names[self._start:self._start + self._page_size]
+        self._start += self._page_size
+        self.continuation_token = page[-1] if self._start < len(self._names) else None
+        return [self._container.get_blob_client(name).get_blob_properties() for name in page]
+
+
+class LocalEventDataBatch:
+    # size-limited batch - add() raises ValueError once max_size_in_bytes would be exceeded, like EventDataBatch
+
+    def __init__(self, max_size_in_bytes, partition_id=None, partition_key=None):
+        self.max_size_in_bytes = max_size_in_bytes
+        self.partition_id = partition_id
+        self.partition_key = partition_key
+        self.size_in_bytes = 0
+        self.events = []
+
+    def add(self, event_data):
+        size = len(event_data.body_as_str().encode('utf-8')) + 64
+        if self.size_in_bytes + size > self.max_size_in_bytes:
+            raise ValueError(f"EventDataBatch has reached its size limit: {self.max_size_in_bytes}")
+        self.events.append(event_data)
+        self.size_in_bytes += size
+
+    def __len__(self):
+        return len(self.events)
+
+
+class LocalEventHubProducer:
+    # in-memory EventHubProducerClient - keeps sent event bodies per partition (keep_sent), latency slept per send
+    # - limit (ServiceLimit): sends over it fail with the server-busy amqp error
+
+    def __init__(self, partitions=4, latency=0.0, max_size_in_bytes=1024 * 1024, keep_sent=True, limit=None):
+        self.partition_ids = [str(p) for p in range(partitions)]
+        self.latency = latency
+        self.limit = limit
+        self.max_size_in_bytes = max_size_in_bytes
+        self.keep_sent = keep_sent
+        self.events = 0
+        self.sent = {p: [] for p in self.partition_ids}
+        self.sent_keys = {p: [] for p in self.partition_ids}
+        self.batches = 0
+        self._lock = threading.Lock()
+
+    def get_partition_ids(self):
+        return list(self.partition_ids)
+
+    def create_batch(self, partition_id=None, partition_key=None, max_size_in_bytes=None):
+        return LocalEventDataBatch(max_size_in_bytes or self.max_size_in_bytes, partition_id, partition_key)
+
+    def send_batch(self, batch, **kwargs):
+        time.sleep(self.latency)
+        if self.limit is not None and not self.limit.admit():
+            raise EventHubError('com.microsoft:server-busy: The request was terminated because the namespace is '
+                                'being throttled. Please wait 4 seconds and try again.')
+        partition_id = batch.partition_id
+        if partition_id is None:
+            # service side routing - hash of the partition key, or round-robin
+            key = batch.partition_key if batch.partition_key is not None else str(self.batches)
+            partition_id = self.partition_ids[sum(key.encode('utf-8')) % len(self.partition_ids)]
+        with self._lock:
+            self.batches += 1
+            self.events += len(batch.events)
+            if self.keep_sent:
+                self.sent[partition_id].extend(e.body_as_str() for e in batch.events)
+                self.sent_keys[partition_id].extend(batch.partition_key for _ in batch.events)
+
+    def send_event(self, event_data, **kwargs):
+        batch = self.create_batch()
+        batch.add(event_data)
+        self.send_batch(batch)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,300 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import resource
+import subprocess
+import tempfile
+from types import SimpleNamespace
+from datetime import datetime, timezone
+# ---
+import numpy as np
+from benchmarks.common import HL7_CLIENT_CONFIG, INTERFACE_CONFIG
+from benchmarks.corpus import generate_corpus, corpus_manifest, write_corpus, DEFAULT_SEED
+
+# Benchmark suite - every scenario runs in a fresh interpreter on the same seeded corpus (peak memory per scenario,
+# no warm caches carried over) and the results are saved as JSON to compare between commits:
+#   python -m benchmarks.suite [--output results.json] [--compare baseline.json]
+
+# Default --output folder - one file per commit, kept out of git (.gitignore)
+RESULTS_FOLDER = os.path.join(os.path.dirname(__file__), 'results')
+DEFAULT_MESSAGES = 2000
+# hl7apy parses ~15 ms/message - the full parse scenario uses at most this many messages of the corpus
+FULL_PARSE_MESSAGES = 400
+CAPTURE_FILES = 4
+CENSUS_STAYS = 1000000
+CENSUS_POCS = 100
+# --compare flags throughput drops / p95 latency increases above this fraction
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+
+LATENCY_PERCENTILES = (50, 95, 99)
+
+
+def peak_rss():
+    # peak resident set size of this process in bytes (ru_maxrss is KiB on linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def latency_summary(latencies):
+    # per-item latencies (seconds) -> percentiles/max in ms
+    values = np.asarray(latencies) * 1e3
+    summary = {f"p{p}_ms": round(float(np.percentile(values, p)), 4) for p in LATENCY_PERCENTILES}
+    summary['max_ms'] = round(float(values.max()), 4)
+    return summary
+
+
+def scenario_get_message(corpus, parse_mode):
+    from function_app import get_message
+    from hl7_fields import get_extractor
+
+    ic = dict(INTERFACE_CONFIG, parse_mode=parse_mode)
+    extractor = get_extractor(HL7_CLIENT_CONFIG)
+    bodies = [body for *_, body in corpus]
+    errors = 0
+    latencies = []
+    for body in bodies:
+        start = time.perf_counter()
+        message = get_message(body, ic, HL7_CLIENT_CONFIG, 'bench', extractor)
+        latencies.append(time.perf_counter() - start)
+        errors += message['log_severity_cd'] == 'ERROR'
+    return latencies, {'errors': errors}
+
+
+def scenario_avro_handler(corpus):
+    # http_trigger_parsehl7 end to end per capture file - download, avro decode, parse, ndjson upload, archive
+    import azure.functions as func
+    import function_app
+    from azure_clients import register_blob_service_client
+    from benchmarks.standins import LocalBlobServiceClient
+
+    handler = function_app.http_trigger_parsehl7._function.get_user_function()
+    context = SimpleNamespace(function_name='bench')
+    ic = dict(INTERFACE_CONFIG, output_mode='ndjson', parse_mode='fast')
+
+    with tempfile.TemporaryDirectory() as root:
+        service_client = LocalBlobServiceClient(root)
+        register_blob_service_client(ic['from_source_host'], service_client)
+        capture_folder = os.path.join(root, ic['from_source_container'], ic['from_source_folder'])
+        names = write_corpus(capture_folder, corpus, CAPTURE_FILES)
+
+        latencies = []
+        for name in names:
+            req = func.HttpRequest(
+                method='POST', url='/api/http_trigger_parsehl7',
+                body=json.dumps({'from_source_file_avro': name, 'interface_config': ic,
+                                 'hl7_client_config': HL7_CLIENT_CONFIG}).encode('utf-8')
+            )
+            start = time.perf_counter()
+            response = handler(req, context)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise AssertionError(f"{name} - {response.status_code} {response.get_body().decode('utf-8')}")
+
+        container = service_client.get_container_client(ic['from_source_container'])
+        archived = len(list(container.list_blobs(name_starts_with=ic['from_source_archive_folder'])))
+        if archived != len(names):
+            raise AssertionError(f"{archived} of {len(names)} capture files archived")
+
+    # throughput in messages, latency per capture file
+    return latencies, {'files': len(names), 'items': len(corpus), 'latency_unit': 'file'}
+
+
+def scenario_census_stream(corpus):
+    # StreamingCensus over the parsed output of the corpus (parsed up front, not timed)
+    from function_app import get_message
+    from census_stream import StreamingCensus
+
+    ic = dict(INTERFACE_CONFIG, parse_mode='fast')
+    messages = [get_message(body, ic, HL7_CLIENT_CONFIG, 'bench') for *_, body in corpus]
+    census = StreamingCensus()
+    latencies = []
+    for message in messages:
+        start = time.perf_counter()
+        census.apply(message)
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    bins = sum(1 for _ in census.flush(until=census.bin_start(census.newest_bin + 1)))
+    flush = time.perf_counter() - start
+    return latencies, {'elapsed_s': sum(latencies) + flush, 'bins': bins, 'flush_ms': round(flush * 1e3, 3), **census.stats}
+
+
+def scenario_census_counts(corpus):
+    # sweep-line census (censusCount.census_counts) over synthetic stays, one call per POC
+    from censusCount import census_counts, BIN_HOURLY
+    from benchmarks.bench_census import synthetic_stays
+
+    starts, ends, pocs = synthetic_stays(CENSUS_STAYS)
+    latencies = []
+    for poc in range(CENSUS_POCS):
+        mask = pocs == poc
+        start = time.perf_counter()
+        census_counts(starts[mask], ends[mask], BIN_HOURLY)
+        latencies.append(time.perf_counter() - start)
+    return latencies, {'items': CENSUS_STAYS, 'latency_unit': 'poc'}
+
+
+def scenario_census_store(corpus):
+    # CensusStore range queries (sum/max/mean over a random span, 90-day daily rollup) per POC - store built
+    # from the sweep-line census of the synthetic stays (not timed)
+    import numpy as np
+    from datetime import timedelta
+    from censusCount import census_counts, BIN_HOURLY
+    from census_store import CensusStore, hour_start
+    from benchmarks.bench_census import synthetic_stays
+
+    starts, ends, pocs = synthetic_stays(CENSUS_STAYS)
+    census = {}
+    for poc in range(CENSUS_POCS):
+        mask = pocs == poc
+        census[poc] = census_counts(starts[mask], ends[mask], BIN_HOURLY)[:2]
+    store = CensusStore.from_census(census)
+    rng = np.random.default_rng(7)
+    latencies = []
+    for poc in store.pocs:
+        a = int(rng.integers(0, store.length))
+        b = int(rng.integers(a, store.length + 1))
+        start = time.perf_counter()
+        store.range_stats(poc, hour_start(store.origin + a), hour_start(store.origin + b))
+        store.rollup(poc, 'day', store.end - timedelta(days=90), store.end)
+        latencies.append(time.perf_counter() - start)
+    return latencies, {'items': len(store.pocs), 'hours': store.length, 'latency_unit': 'poc'}
+
+
+# name -> (unit, function(corpus), messages of the corpus used)
+SCENARIOS = {
+    'get_message_full': ('message', lambda corpus: scenario_get_message(corpus, 'full'), FULL_PARSE_MESSAGES),
+    'get_message_fast': ('message', lambda corpus: scenario_get_message(corpus, 'fast'), None),
+    'avro_handler': ('message', scenario_avro_handler, None),
+    'census_stream': ('message', scenario_census_stream, None),
+    'census_counts': ('stay', scenario_census_counts, 0),
+    'census_store': ('lookup', scenario_census_store, 0)
+}
+
+
+def run_scenario(name, messages, seed):
+    # in the child interpreter - prints the scenario result as JSON
+    logging.disable(logging.ERROR)
+    unit, fn, limit = SCENARIOS[name]
+    corpus = generate_corpus(messages, seed)
+    if limit is not None:
+        corpus = corpus[:limit]
+
+    # elapsed - the timed work only (scenario setup such as writing capture files or parsing up front excluded)
+    baseline = peak_rss()
+    latencies, extra = fn(corpus)
+    elapsed = extra.pop('elapsed_s', sum(latencies))
+
+    items = extra.pop('items', len(latencies))
+    result = {
+        'unit': unit,
+        'items': items,
+        'elapsed_s': round(elapsed, 4),
+        f"{unit}s_per_sec": round(items / elapsed, 2),
+        'latency_unit': extra.pop('latency_unit', unit),
+        'latency': latency_summary(latencies),
+        'peak_rss_mb': round(peak_rss() / 2 ** 20, 1),
+        'rss_growth_mb': round((peak_rss() - baseline) / 2 ** 20, 1)
+    }
+    result.update(extra)
+    print(json.dumps(result))
+
+
+def git_revision():
+    # (commit, dirty) of the working tree - (None, None) outside a git checkout
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root, check=True,
+                                capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root, check=True,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def run_suite(names, messages, seed):
+    commit, dirty = git_revision()
+    results = {
+        'created_utc': datetime.now(timezone.utc).isoformat(),
+        'git_commit': commit,
+        'git_dirty': dirty,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'corpus': corpus_manifest(generate_corpus(messages, seed), seed),
+        'scenarios': {}
+    }
+    env = dict(os.environ, PYTHONHASHSEED='0')
+    for name in names:
+        out = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.suite', '--run-scenario', name, '--messages', str(messages),
+             '--seed', str(seed)],
+            check=True, capture_output=True, text=True, env=env
+        ).stdout
+        results['scenarios'][name] = result = json.loads(out.splitlines()[-1])
+        rate = result[f"{result['unit']}s_per_sec"]
+        latency = result['latency']
+        print(f"{name:18s} {rate:12.1f} {result['unit']}s/sec   p50 {latency['p50_ms']:9.3f} ms   "
+              f"p95 {latency['p95_ms']:9.3f} ms   p99 {latency['p99_ms']:9.3f} ms (per {result['latency_unit']})   "
+              f"peak rss {result['peak_rss_mb']:7.1f} MB")
+    return results
+
+
+def compare(results, baseline, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    # print throughput/p95 change per scenario against baseline results - returns the regressed scenario names
+    print(f"compared to {baseline.get('git_commit')}{' (dirty)' if baseline.get('git_dirty') else ''}:")
+    regressions = []
+    for name, result in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            print(f"  {name:18s} (not in baseline)")
+            continue
+        rate_key = f"{result['unit']}s_per_sec"
+        rate_change = result[rate_key] / previous[rate_key] - 1
+        p95_change = result['latency']['p95_ms'] / previous['latency']['p95_ms'] - 1
+        regressed = rate_change < -threshold or p95_change > threshold
+        if regressed:
+            regressions.append(name)
+        print(f"  {name:18s} throughput {rate_change * 100:+7.1f}%   p95 {p95_change * 100:+7.1f}%   "
+              f"peak rss {result['peak_rss_mb'] - previous['peak_rss_mb']:+7.1f} MB"
+              f"{'   REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the HL7 pipeline benchmark suite')
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--messages', type=int, default=DEFAULT_MESSAGES)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--output', help='results JSON path (default benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', help='baseline results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD)
+    parser.add_argument('--run-scenario', choices=list(SCENARIOS), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_scenario:
+        run_scenario(args.run_scenario, args.messages, args.seed)
+        return 0
+
+    results = run_suite(args.scenarios, args.messages, args.seed)
+    output = args.output
+    if output is None:
+        commit = results['git_commit'] or 'unversioned'
+        output = os.path.join(RESULTS_FOLDER, f"{commit}{'-dirty' if results['git_dirty'] else ''}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"results saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(results, json.load(f), args.threshold):
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
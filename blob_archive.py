@@ -0,0 +1,120 @@
+import time
+import random
+import logging
+# ---
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError, ResourceModifiedError, ResourceNotFoundError
+
+# Copy status polling - first poll after DEFAULT_POLL_INTERVAL, doubling up to MAX_POLL_INTERVAL (with jitter)
+DEFAULT_POLL_INTERVAL = 0.2
+MAX_POLL_INTERVAL = 5.0
+# Seconds one copy attempt may stay pending before it is aborted and retried
+DEFAULT_COPY_TIMEOUT = 120.0
+# Copy attempts (start + poll) before archiving the file is given up
+DEFAULT_COPY_ATTEMPTS = 3
+
+COPY_STATUS_SUCCESS = 'success'
+COPY_STATUS_PENDING = 'pending'
+
+
+class ArchiveError(Exception):
+    # the archive copy did not complete - the capture file is left in place (and will be processed again)
+    pass
+
+
+class ArchiveCopy:
+    # archive of one capture file - server-side async copy to the archive blob, then a conditional delete
+    # - started before the file is processed, so the copy runs in parallel with parse/upload
+    # - the copy and the delete are pinned to the ETag the file had when archiving started - a capture file
+    #   rewritten meanwhile is neither archived in its old state nor deleted
+    # - failed/aborted/timed out copies are restarted, at most `attempts` times; complete() raises ArchiveError
+    #   when no attempt succeeds
+    # - lease: lease held on the source (folder drain) - needed for the delete
+
+    def __init__(self, source_client, archive_client, poll_interval=DEFAULT_POLL_INTERVAL,
+                 timeout=DEFAULT_COPY_TIMEOUT, attempts=DEFAULT_COPY_ATTEMPTS, lease=None):
+        self._source_client = source_client
+        self._lease = lease
+        self._archive_client = archive_client
+        self._poll_interval = poll_interval
+        self._timeout = timeout
+        self._attempts = attempts
+        self.etag = source_client.get_blob_properties().etag
+        self.attempt = 0
+        self.copy_id = None
+        self.status = None
+        self._started = None
+
+    @classmethod
+    def start(cls, source_client, archive_client, **kwargs):
+        archive = cls(source_client, archive_client, **kwargs)
+        archive._start_copy()
+        return archive
+
+    def complete(self):
+        # wait for the copy (restarting it on failure), then delete the source if unchanged since the copy started
+        # - returns True once the source is deleted, False if it changed/disappeared meanwhile (left in place)
+        while self._wait() != COPY_STATUS_SUCCESS:
+            if self.attempt >= self._attempts:
+                raise ArchiveError(
+                    f"archive copy of {self._source_client.blob_name} did not complete after {self.attempt} attempts "
+                    f"- last status {self.status}"
+                )
+            self._start_copy()
+
+        try:
+            self._source_client.delete_blob(
+                etag=self.etag, match_condition=MatchConditions.IfNotModified, lease=self._lease
+            )
+            return True
+        except ResourceModifiedError:
+            logging.warning(f"{self._source_client.blob_name} - modified since the archive copy started, not deleted")
+        except ResourceNotFoundError:
+            logging.warning(f"{self._source_client.blob_name} - already deleted")
+        return False
+
+    def abort(self):
+        # stop a pending copy (processing failed - the file stays in place) - best effort
+        if self.copy_id is None or self.status not in (None, COPY_STATUS_PENDING):
+            return
+        try:
+            self._archive_client.abort_copy(self.copy_id)
+        except HttpResponseError as e:
+            logging.warning(f"{self._archive_client.blob_name} - abort copy failed - {type(e).__name__} - {str(e)}")
+
+    def _start_copy(self):
+        self.attempt += 1
+        self._started = time.monotonic()
+        try:
+            result = self._archive_client.start_copy_from_url(
+                self._source_client.url, requires_sync=False,
+                source_etag=self.etag, source_match_condition=MatchConditions.IfNotModified
+            )
+        except ResourceModifiedError:
+            # the source changed since processing started - nothing to archive for this ETag
+            raise ArchiveError(f"{self._source_client.blob_name} - modified since processing started, not archived")
+        except HttpResponseError as e:
+            logging.warning(f"{self._archive_client.blob_name} - start copy attempt {self.attempt} failed - "
+                            f"{type(e).__name__} - {str(e)}")
+            self.copy_id, self.status = None, 'failed'
+            return
+        self.copy_id = result.get('copy_id')
+        self.status = result.get('copy_status')
+
+    def _wait(self):
+        # poll the pending copy until it leaves pending or times out (aborted) - returns the final status
+        interval = self._poll_interval
+        while self.status == COPY_STATUS_PENDING:
+            if time.monotonic() - self._started > self._timeout:
+                self.abort()
+                self.status = 'timed_out'
+                break
+            time.sleep(interval * random.uniform(0.8, 1.2))
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+            copy = self._archive_client.get_blob_properties().copy
+            if copy.id == self.copy_id:
+                self.status = copy.status
+        if self.status != COPY_STATUS_SUCCESS:
+            logging.warning(f"{self._archive_client.blob_name} - archive copy attempt {self.attempt} {self.status}")
+        return self.status
@@ -9,13 +9,26 @@ import json
 from datetime import datetime, timezone
 # from dateutil.relativedelta import relativedelta
 import os
+import threading
+from requests.adapters import HTTPAdapter
 from azure.storage.blob import BlobServiceClient
+from replay_checkpoint import ReplayCheckpoint, iter_replay_blobs, content_md5_hash, hl7_message_hash
+from pipeline import BoundedExecutor
+from io_throttle import THROTTLE_STATUS_CODES, DeadLetterError, ThrottledError, get_controller, retry_after_of
+
+# SAS token lifetime, and how long before expiry the sender generates a new one (seconds)
+SAS_TOKEN_TTL = 3600*12
+SAS_TOKEN_REFRESH_MARGIN = 300
+
+# Event Hubs REST batch send - content type, max request body size (standard tier limit is 1 MB)
+BATCH_CONTENT_TYPE = 'application/vnd.microsoft.servicebus.json'
+MAX_BATCH_BYTES = 1000000
 
 # Function to generate SAS token for Event Hubs
-def get_auth_token(sb_name, eh_name, sas_name, sas_value):
+def get_auth_token(sb_name, eh_name, sas_name, sas_value, ttl=SAS_TOKEN_TTL):
     uri = urllib.parse.quote_plus("https://{}.servicebus.windows.net/{}".format(sb_name, eh_name))
     sas = sas_value.encode('utf-8')
-    expiry = str(int(time.time() + 3600*12))  # Token valid for 12 hours
+    expiry = str(int(time.time() + ttl))  # Token valid for 12 hours by default
     string_to_sign = (uri + '\n' + expiry).encode('utf-8')
     signed_hmac_sha256 = hmac.HMAC(sas, string_to_sign, hashlib.sha256)
     signature = urllib.parse.quote(base64.b64encode(signed_hmac_sha256.digest()))
@@ -23,12 +36,26 @@ def get_auth_token(sb_name, eh_name, sas_name, sas_value):
     sas_token = "SharedAccessSignature sr={}&sig={}&se={}&skn={}".format(uri, signature, expiry, sas_name)
     return sas_token
 
+def check_throttled(response):
+    # raise ThrottledError for a 429/503 answer (retried by the IOController, after its Retry-After)
+    if response.status_code in THROTTLE_STATUS_CODES:
+        raise ThrottledError(f"Status code: {response.status_code}, Error: {response.text}",
+                             retry_after_of(response.headers))
+    return response
+
 # Function to send message to Event Hubs
+# (throttled requests are retried through the namespace's shared IOController)
 def send_message(payload, sas_token, namespace, event_hub):
     url = f"https://{namespace}.servicebus.windows.net/{event_hub}/messages"
     hdrs = {'Content-Type': 'text/plain', 'Authorization': sas_token}
 
-    response = requests.post(url, headers=hdrs, data=payload)
+    def post():
+        return check_throttled(requests.post(url, headers=hdrs, data=payload))
+
+    try:
+        response = get_controller(f"eventhubs:{namespace}/{event_hub}").call(post)
+    except DeadLetterError as e:
+        return f"Failed to send message. Throttled - {str(e.error)}"
     if response.status_code == 201:
         status = "Message sent successfully."
     else:
@@ -36,6 +63,127 @@ def send_message(payload, sas_token, namespace, event_hub):
 
     return status
 
+# Pooled, batching sender for the Event Hubs REST API
+class EventHubsHttpSender:
+    # - one keep-alive requests.Session (connection pool sized to max_in_flight) for all requests
+    # - SAS token generated once and reused until SAS_TOKEN_REFRESH_MARGIN seconds before it expires
+    # - add() packs messages into batch-send requests (BATCH_CONTENT_TYPE, up to max_batch_bytes), with up to
+    #   max_in_flight requests on the wire; on_result(contexts, ok, status) is called per request
+    #   with the contexts passed to add()
+    # - requests go through controller (IOController, shared per event hub by default): 429/503 answers lower
+    #   its concurrency/rate and are retried after their Retry-After; a request still throttled after the
+    #   retries is reported to on_result as failed (ok False) and counted as dead_lettered
+
+    def __init__(self, namespace, event_hub, sas_name, sas_value, max_in_flight=4,
+                 max_batch_bytes=MAX_BATCH_BYTES, on_result=None, base_url=None, controller=None):
+        self.namespace = namespace
+        self.event_hub = event_hub
+        self.url = f"{base_url or f'https://{namespace}.servicebus.windows.net'}/{event_hub}/messages"
+        self.max_batch_bytes = max_batch_bytes
+        self.on_result = on_result
+        self.sent = 0
+        self.failed = 0
+        self.dead_lettered = 0
+        self.requests = 0
+        self.controller = controller or get_controller(f"eventhubs:{namespace}/{event_hub}")
+
+        self._sas_name = sas_name
+        self._sas_value = sas_value
+        self._token = None
+        self._token_expiry = 0
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._executor = BoundedExecutor(max_in_flight, max_in_flight * 2)
+
+        self._batch = []
+        self._contexts = []
+        self._batch_bytes = 2
+
+    def get_token(self):
+        with self._lock:
+            if self._token is None or self._token_expiry - time.time() < SAS_TOKEN_REFRESH_MARGIN:
+                self._token_expiry = time.time() + SAS_TOKEN_TTL
+                self._token = get_auth_token(self.namespace, self.event_hub, self._sas_name, self._sas_value)
+            return self._token
+
+    def send(self, payload):
+        # single message, sent now - same status strings as send_message
+        try:
+            response = self._post(payload, 'text/plain')
+        except DeadLetterError as e:
+            return f"Failed to send message. Throttled - {str(e.error)}"
+        if response.status_code == 201:
+            return "Message sent successfully."
+        return f"Failed to send message. Status code: {response.status_code}, Error: {response.text}"
+
+    def add(self, payload, context=None):
+        # queue payload (str) for a batch-send request - sends the current batch first if payload doesn't fit
+        entry = json.dumps({'Body': payload})
+        if self._batch and self._batch_bytes + len(entry) + 1 > self.max_batch_bytes:
+            self.flush()
+
+        self._batch.append(entry)
+        self._contexts.append(context)
+        self._batch_bytes += len(entry) + 1
+
+    def flush(self):
+        # submit the current batch (returns immediately unless max_in_flight requests are queued)
+        if not self._batch:
+            return
+        body = '[' + ','.join(self._batch) + ']'
+        contexts = self._contexts
+        self._batch, self._contexts, self._batch_bytes = [], [], 2
+        self._executor.submit(self._send_batch, body, contexts)
+
+    def close(self):
+        # send what's left, wait for all requests in flight and release the connection pool
+        try:
+            self.flush()
+            self._executor.wait()
+        finally:
+            self._executor.shutdown()
+            self.session.close()
+
+    def _post(self, body, content_type):
+        # DeadLetterError if still throttled after the controller's retries
+        data = body.encode('utf-8')
+
+        def post():
+            hdrs = {'Content-Type': content_type, 'Authorization': self.get_token()}
+            response = self.session.post(self.url, headers=hdrs, data=data)
+            with self._lock:
+                self.requests += 1
+            return check_throttled(response)
+
+        return self.controller.call(post)
+
+    def _send_batch(self, body, contexts):
+        dead_lettered = False
+        try:
+            response = self._post(body, BATCH_CONTENT_TYPE)
+            ok = response.status_code == 201
+        except DeadLetterError as e:
+            ok, dead_lettered = False, True
+            status = f"Failed to send {len(contexts)} messages. Throttled - {str(e.error)}"
+        if ok:
+            status = f"{len(contexts)} messages sent successfully."
+        elif not dead_lettered:
+            status = f"Failed to send {len(contexts)} messages. Status code: {response.status_code}, Error: {response.text}"
+
+        with self._lock:
+            if ok:
+                self.sent += len(contexts)
+            else:
+                self.failed += len(contexts)
+                if dead_lettered:
+                    self.dead_lettered += len(contexts)
+        if self.on_result is not None:
+            self.on_result(contexts, ok, status)
+
 # Function to extract the HL7 data from the blob content
 def extract_hl7(content):
     try:
@@ -65,21 +213,40 @@ def main():
     SAS_NAME = "receivingtestdata"
     SAS_PRIMARY_KEY = ""
 
-    # Generate SAS token for Event Hubs
-    sas_token = get_auth_token(NAMESPACE, EVENT_HUB, SAS_NAME, SAS_PRIMARY_KEY)
+    # Concurrent batch-send requests to Event Hubs
+    MAX_IN_FLIGHT = 4
+
+    # Time range setup (None = unbounded) - e.g. datetime.now(timezone.utc) - relativedelta(months=2)
+    modified_after = None
+    modified_before = None
+
+    # Replay progress/sent content hashes - rerunning the same prefix resumes where the last run stopped
+    checkpoint = ReplayCheckpoint('replay_checkpoint.sqlite', f"{storage_account_name}/{container_name}/{prefix}")
 
-    # # Time range setup
-    # current_time = datetime.now(timezone.utc)
-    # two_months_ago = current_time - relativedelta(months=2)
+    # Blobs are completed once the batch request carrying their HL7 succeeded - failed ones are retried next run
+    def on_result(contexts, ok, status):
+        print(f"Blobs {contexts[0][0]}..{contexts[-1][0]}: {status}")
+        if ok:
+            checkpoint.complete([seq for _, seq, _ in contexts], [h for _, _, hashes in contexts for h in hashes])
 
-    # List blobs under the specified prefix
-    blob_list = container_client.list_blobs(name_starts_with=prefix)
+    # Pooled sender - cached SAS token, batch-send requests, MAX_IN_FLIGHT requests at a time
+    sender = EventHubsHttpSender(NAMESPACE, EVENT_HUB, SAS_NAME, SAS_PRIMARY_KEY, MAX_IN_FLIGHT, on_result=on_result)
 
-    for blob in blob_list:
-        # Check if the blob was modified within the last two months
-        # if blob.last_modified >= two_months_ago:
-            # Filter for text/plain files
-            if blob.content_settings.content_type == 'text/plain' or blob.name.endswith('.txt'):
+    # List blobs under the specified prefix (after the last completed blob), filtered on listed properties
+    try:
+        for page_token, blob, selected in iter_replay_blobs(
+            container_client, prefix, checkpoint, modified_after, modified_before
+        ):
+            seq = checkpoint.track(blob.name, page_token)
+            md5_hash = content_md5_hash(blob)
+            md5_hashes = [(md5_hash, blob.name)] if md5_hash is not None else []
+            content_hashes = []
+
+            if not selected:
+                print(f"Skipping blob {blob.name} as it is not a text/plain file in the time range.")
+            elif md5_hash is not None and not checkpoint.claim(md5_hash):
+                print(f"Skipping blob {blob.name} as its content was already sent.")
+            else:
                 blob_client = container_client.get_blob_client(blob)
 
                 # Read the blob content
@@ -88,17 +255,24 @@ def main():
 
                 # Extract the HL7 data
                 hl7_message = extract_hl7(content)
+                hl7_hash = hl7_message_hash(hl7_message)
+                content_hashes = md5_hashes
 
-                if hl7_message:
-                    # Send the HL7 message to Event Hubs
-                    status = send_message(hl7_message, sas_token, NAMESPACE, EVENT_HUB)
-                    print(f"Blob {blob.name}: {status}")
-                else:
+                if not hl7_message:
                     print(f"No HL7 data found in blob: {blob.name}")
-            else:
-                print(f"Skipping blob {blob.name} as it is not a text/plain file.")
-        # else:
-        #     print(f"Skipping blob {blob.name} as it is older than two months.")
+                elif not checkpoint.claim(hl7_hash):
+                    print(f"Skipping blob {blob.name} as its HL7 data was already sent.")
+                else:
+                    # Queue the HL7 message for Event Hubs - the blob completes in on_result
+                    sender.add(hl7_message, (blob.name, seq, [(hl7_hash, blob.name)] + md5_hashes))
+                    continue
+
+            checkpoint.complete([seq], content_hashes)
+    finally:
+        try:
+            sender.close()
+        finally:
+            checkpoint.close()
 
 if __name__ == '__main__':
     main()
@@ -2,6 +2,14 @@ from azure.storage.blob import BlobServiceClient
 from azure.eventhub import EventHubProducerClient, EventData
 from azure.identity import ManagedIdentityCredential
 import json
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from hl7_fields import routing_key, routing_path
+from io_throttle import IOController, DeadLetterError, SDK_RETRY_TOTAL
+from pipeline import OrderedLanes, partition_for_key
+from replay_checkpoint import ReplayCheckpoint, iter_replay_blobs, content_md5_hash, hl7_message_hash
 # from datetime import datetime, timezone
 # from dateutil.relativedelta import relativedelta
 
@@ -13,77 +21,263 @@ container_name = ''
 event_hub_namespace = ''
 event_hub_name = ''
 
-# Authenticate using ManagedIdentityCredential
-credential = ManagedIdentityCredential()
-
 # Use standard service URLs or private endpoint URLs based on your setup
 use_privatelink = True  # Set to True if using private endpoints
 
-if use_privatelink:
-    # Use private endpoint URLs
-    blob_account_url = f"https://{storage_account_name}.privatelink.blob.core.windows.net"
-    event_hub_namespace_url = f"{event_hub_namespace}.privatelink.servicebus.windows.net"
-else:
-    # Use standard service URLs
-    blob_account_url = f"https://{storage_account_name}.blob.core.windows.net"
-    event_hub_namespace_url = f"{event_hub_namespace}.servicebus.windows.net"
-
-# Connect to Blob Storage
-blob_service_client = BlobServiceClient(
-    account_url=blob_account_url,
-    credential=credential
-)
-container_client = blob_service_client.get_container_client(container_name)
-
-# Connect to Event Hubs
-eventhub_producer_client = EventHubProducerClient(
-    fully_qualified_namespace=event_hub_namespace_url,
-    eventhub_name=event_hub_name,
-    credential=credential
-)
-
-# Define the prefix and time range
+# Define the prefix and time range (None = unbounded)
 prefix = f'AP/2024/7/'
-# current_time = datetime.now(timezone.utc)
-# two_months_ago = current_time - relativedelta(months=2)
+modified_after = None       # e.g. datetime.now(timezone.utc) - relativedelta(months=2)
+modified_before = None
+
+# Replay progress/sent content hashes - rerunning the same prefix resumes where the last run stopped
+checkpoint_path = 'replay_checkpoint.sqlite'
+
+# Blobs whose events were still throttled after the retries (one name per line) - not checkpointed, so the
+# next run of the same prefix sends them again
+dead_letter_path = 'replay_dead_letter.txt'
+
+# Replay concurrency - parallel blob downloads, parallel batch sends (one send at a time per partition)
+DOWNLOAD_WORKERS = 16
+SEND_WORKERS = 4
+
+# HL7 field routing messages to partitions (hl7cc-style path, e.g. 'pid.pid_3' for the patient) - messages
+# with the same value go to the same partition, in listing order; None or messages without it: round-robin
+routing_field = 'pv1.pv1_19'
+
+
+class ReplayStats:
+    # counters for one replay run
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.blobs = 0
+        self.skipped = 0
+        self.duplicates = 0
+        self.empty = 0
+        self.events = 0
+        self.bytes = 0
+        self.batches = 0
+        self.unrouted = 0
+        self.dead_lettered = 0
+
+    def summary(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return {
+            'blobs': self.blobs,
+            'skipped': self.skipped,
+            'duplicates': self.duplicates,
+            'empty': self.empty,
+            'events': self.events,
+            'batches': self.batches,
+            'unrouted': self.unrouted,
+            'dead_lettered': self.dead_lettered,
+            'megabytes': round(self.bytes / 2**20, 3),
+            'elapsed_sec': round(elapsed, 3),
+            'events_per_sec': round(self.events / elapsed, 1),
+            'mb_per_sec': round(self.bytes / 2**20 / elapsed, 3)
+        }
+
 
 # Function to extract the HL7 data from the blob content
 def extract_hl7(content):
     try:
         data = json.loads(content)
         hl7_message = data.get('payload', {}).get('eventData', {}).get('HL7', '')
-        print(hl7_message)
         return hl7_message
     except json.JSONDecodeError:
         # Handle case where content is not valid JSON
         return ''
 
-# List and read text/plain files from Blob Storage and send extracted HL7 data to Event Hubs
-with eventhub_producer_client:
-    # List blobs under the specified prefix
-    blob_list = container_client.list_blobs(name_starts_with=prefix)
-
-    for blob in blob_list:
-        # Check if the blob was modified within the last two months
-        # if blob.last_modified >= two_months_ago:
-            # Filter for text/plain files
-            if blob.content_settings.content_type == 'text/plain' or blob.name.endswith('.txt'):
-                blob_client = container_client.get_blob_client(blob)
-
-                # Read the blob content
-                downloader = blob_client.download_blob()
-                content = downloader.readall().decode('utf-8')  
-
-                # Extract the HL7 data
-                hl7_message = extract_hl7(content).encode('unicode_escape')
-
-                if hl7_message:
-                    # Create an EventData object with the HL7 message
-                    event_data = EventData(hl7_message)
-                   
-                    # Send the event data
-                    eventhub_producer_client.send_event(event_data)
-                else:
-                    print(f"No HL7 data found in blob: {blob.name}")
-        # else:
-        #     print(f"Skipping blob {blob.name} as it is older than two months.")
+
+def download_hl7(container_client, blob, plan, *context):
+    # Read the blob content and extract the HL7 data - returns (blob name, escaped hl7 bytes, routing key,
+    # content hash, *context)
+    # (routing key: value of the routing_path plan's field, read before escaping; None without a plan)
+    blob_client = container_client.get_blob_client(blob)
+    hl7_message = extract_hl7(blob_client.download_blob().readall().decode('utf-8'))
+    key = routing_key(hl7_message, plan) if plan is not None else None
+    return (blob.name, hl7_message.encode('unicode_escape'), key, hl7_message_hash(hl7_message)) + context
+
+
+def replay(container_client, producer, prefix, download_workers=DOWNLOAD_WORKERS, send_workers=SEND_WORKERS,
+           checkpoint=None, modified_after=None, modified_before=None, routing_field=routing_field,
+           controller=None, dead_letter=None):
+    # List blobs under prefix, download them concurrently and send the extracted HL7 to Event Hubs
+    # packed into EventDataBatches (up to the size limit), one open batch per partition, sent send_workers
+    # at a time - batches of a partition are sent one at a time, in order - returns ReplayStats.summary()
+    # - routing_field: messages are routed to the partition of their value of this field (partition_for_key),
+    #   so all events of a visit/patient reach one partition in listing order; round-robin without it (unrouted)
+    # - checkpoint (ReplayCheckpoint): resume after the last completed blob and skip content already sent
+    # - modified_after/modified_before: last_modified window, applied to the listing before any download
+    # - controller (IOController): sends adapt to server-busy throttling and are retried; a batch still throttled
+    #   after the retries is passed to dead_letter(blob names, error) and counted - its blobs are not completed
+    #   in the checkpoint, so the next run replays them instead of this one failing
+    stats = ReplayStats()
+    controller = controller or IOController('eventhubs')
+    plan = routing_path(routing_field) if routing_field else None
+    partition_ids = producer.get_partition_ids()
+    sender = OrderedLanes(send_workers, send_workers * 2)
+    batches = {}
+    next_partition = 0
+    stats_lock = threading.Lock()
+
+    def done(seqs, content_hashes=()):
+        if checkpoint is not None:
+            checkpoint.complete(seqs, content_hashes)
+
+    def send(batch, events, size, seqs, content_hashes):
+        try:
+            controller.call(producer.send_batch, batch)
+        except DeadLetterError as e:
+            names = sorted({name for _, name in content_hashes})
+            print(f"{events} events dead-lettered ({names[0]}..{names[-1]}): {str(e)}")
+            with stats_lock:
+                stats.dead_lettered += events
+            if dead_letter is not None:
+                dead_letter(names, e.error)
+            return
+        done(seqs, content_hashes)
+        with stats_lock:
+            stats.batches += 1
+            stats.events += events
+            stats.bytes += size
+
+    def new_batch(partition_id):
+        # [batch, events, bytes, blob seqs, (content hash, blob name) sent]
+        return [producer.create_batch(partition_id=partition_id), 0, 0, [], []]
+
+    def flush(partition_id):
+        batch, events, size, seqs, content_hashes = batches.pop(partition_id)
+        if events:
+            sender.submit(partition_id, send, batch, events, size, seqs, content_hashes)
+
+    def add(hl7_message, key, seq, content_hashes):
+        nonlocal next_partition
+        if key is not None:
+            partition_id = partition_for_key(key, partition_ids)
+        else:
+            stats.unrouted += 1
+            partition_id = partition_ids[next_partition]
+            next_partition = (next_partition + 1) % len(partition_ids)
+
+        if partition_id not in batches:
+            batches[partition_id] = new_batch(partition_id)
+        entry = batches[partition_id]
+        try:
+            entry[0].add(EventData(hl7_message))
+        except ValueError:
+            # batch is full - send it and start the partition's next one
+            flush(partition_id)
+            batches[partition_id] = entry = new_batch(partition_id)
+            entry[0].add(EventData(hl7_message))
+        entry[1] += 1
+        entry[2] += len(hl7_message)
+        if seq is not None:
+            entry[3].append(seq)
+        entry[4].extend(content_hashes)
+
+    def handle(name, hl7_message, key, hl7_hash, seq, md5_hash):
+        stats.blobs += 1
+        if not hl7_message:
+            stats.empty += 1
+            print(f"No HL7 data found in blob: {name}")
+            done([seq])
+            return
+
+        content_hashes = [(hl7_hash, name)]
+        if md5_hash is not None:
+            content_hashes.append((md5_hash, name))
+
+        if checkpoint is not None and not checkpoint.claim(content_hashes[0][0]):
+            stats.duplicates += 1
+            done([seq], content_hashes[1:])
+            return
+        add(hl7_message, key, seq, content_hashes)
+
+    try:
+        with ThreadPoolExecutor(max_workers=download_workers) as downloader:
+            # at most download_workers * 2 downloads in flight, results handled in listing order
+            pending = deque()
+            for page_token, blob, selected in iter_replay_blobs(
+                container_client, prefix, checkpoint, modified_after, modified_before
+            ):
+                seq = checkpoint.track(blob.name, page_token) if checkpoint is not None else None
+                if not selected:
+                    stats.skipped += 1
+                    done([seq])
+                    continue
+
+                # skip blobs whose listed Content-MD5 was already sent, before downloading them
+                md5_hash = content_md5_hash(blob) if checkpoint is not None else None
+                if md5_hash is not None and not checkpoint.claim(md5_hash):
+                    stats.duplicates += 1
+                    done([seq])
+                    continue
+
+                if len(pending) >= download_workers * 2:
+                    handle(*pending.popleft().result())
+                pending.append(downloader.submit(download_hl7, container_client, blob, plan, seq, md5_hash))
+
+            while pending:
+                handle(*pending.popleft().result())
+
+        for partition_id in list(batches):
+            flush(partition_id)
+        sender.wait()
+    finally:
+        sender.shutdown()
+
+    return stats.summary()
+
+
+def main():
+    # Authenticate using ManagedIdentityCredential
+    credential = ManagedIdentityCredential()
+
+    if use_privatelink:
+        # Use private endpoint URLs
+        blob_account_url = f"https://{storage_account_name}.privatelink.blob.core.windows.net"
+        event_hub_namespace_url = f"{event_hub_namespace}.privatelink.servicebus.windows.net"
+    else:
+        # Use standard service URLs
+        blob_account_url = f"https://{storage_account_name}.blob.core.windows.net"
+        event_hub_namespace_url = f"{event_hub_namespace}.servicebus.windows.net"
+
+    # Connect to Blob Storage
+    blob_service_client = BlobServiceClient(
+        account_url=blob_account_url,
+        credential=credential
+    )
+    container_client = blob_service_client.get_container_client(container_name)
+
+    # Connect to Event Hubs (sends go through an IOController - the SDK retries only once so the two do not stack)
+    eventhub_producer_client = EventHubProducerClient(
+        fully_qualified_namespace=event_hub_namespace_url,
+        eventhub_name=event_hub_name,
+        credential=credential,
+        retry_total=SDK_RETRY_TOTAL
+    )
+
+    # List and read text/plain files from Blob Storage and send extracted HL7 data to Event Hubs
+    checkpoint = ReplayCheckpoint(checkpoint_path, f"{storage_account_name}/{container_name}/{prefix}")
+    dead_letter_lock = threading.Lock()
+
+    def dead_letter(names, error):
+        with dead_letter_lock, open(dead_letter_path, 'a') as f:
+            f.writelines(name + '\n' for name in names)
+
+    try:
+        with eventhub_producer_client:
+            summary = replay(
+                container_client, eventhub_producer_client, prefix,
+                checkpoint=checkpoint, modified_after=modified_after, modified_before=modified_before,
+                dead_letter=dead_letter
+            )
+    finally:
+        checkpoint.close()
+
+    print(json.dumps(summary))
+
+
+if __name__ == '__main__':
+    main()
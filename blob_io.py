@@ -0,0 +1,108 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+# ---
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceModifiedError
+
+# Default size of each ranged blob download (bytes)
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Buffer in front of the range reader - fastavro issues many small reads
+READ_BUFFER_SIZE = 64 * 1024
+
+
+class BlobModifiedError(Exception):
+    # the blob was rewritten while it was read in ranges (412 on a range pinned to its first ETag) - the file
+    # fails as a whole instead of being decoded from ranges of two different versions
+    pass
+
+
+class BlobRangeReader(io.RawIOBase):
+    # read-only, forward-only file object over a blob, downloaded in chunk_size ranges
+    # - at most 1 + read_ahead chunks are held in memory (current chunk + chunks being prefetched)
+    # - every range is pinned to the ETag the blob had when the reader was opened (BlobModifiedError otherwise)
+
+    def __init__(self, blob_client, chunk_size=DEFAULT_CHUNK_SIZE, read_ahead=1):
+        super().__init__()
+        self._blob_client = blob_client
+        self._chunk_size = chunk_size
+        self._read_ahead = read_ahead
+        properties = blob_client.get_blob_properties()
+        self._blob_size = properties.size
+        self._etag = properties.etag
+
+        self._next_offset = 0
+        self._chunk = memoryview(b'')
+        self._chunk_pos = 0
+        self._pending = []
+        self._executor = ThreadPoolExecutor(max_workers=1) if read_ahead > 0 else None
+
+    @property
+    def size(self):
+        return self._blob_size
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._chunk_pos >= len(self._chunk):
+            self._chunk = memoryview(b'')
+            self._chunk = memoryview(self._next_chunk())
+            self._chunk_pos = 0
+            if not self._chunk:
+                return 0
+
+        n = min(len(b), len(self._chunk) - self._chunk_pos)
+        b[:n] = self._chunk[self._chunk_pos:self._chunk_pos + n]
+        self._chunk_pos += n
+        return n
+
+    def close(self):
+        if self._executor is not None:
+            for future in self._pending:
+                future.cancel()
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._pending = []
+        self._chunk = memoryview(b'')
+        super().close()
+
+    def _download_range(self, offset, length):
+        try:
+            return self._blob_client.download_blob(
+                offset=offset, length=length, etag=self._etag, match_condition=MatchConditions.IfNotModified
+            ).readall()
+        except ResourceModifiedError as e:
+            raise BlobModifiedError(
+                f"{self._blob_client.blob_name} changed while being read (range {offset}+{length}) - {e}"
+            ) from e
+
+    def _schedule(self):
+        # queue the next range (inline when read-ahead is off) - returns None once the blob is exhausted
+        if self._next_offset >= self._blob_size:
+            return None
+
+        offset, length = self._next_offset, min(self._chunk_size, self._blob_size - self._next_offset)
+        self._next_offset += length
+        if self._executor is None:
+            return self._download_range(offset, length)
+        return self._executor.submit(self._download_range, offset, length)
+
+    def _next_chunk(self):
+        if self._executor is None:
+            return self._schedule() or b''
+
+        while len(self._pending) < 1 + self._read_ahead:
+            future = self._schedule()
+            if future is None:
+                break
+            self._pending.append(future)
+
+        if not self._pending:
+            return b''
+        return self._pending.pop(0).result()
+
+
+def open_blob_stream(blob_client, chunk_size=DEFAULT_CHUNK_SIZE, read_ahead=1):
+    # buffered file object streaming blob_client's content in ranges (e.g. for fastavro.reader)
+    return io.BufferedReader(BlobRangeReader(blob_client, chunk_size, read_ahead), buffer_size=READ_BUFFER_SIZE)
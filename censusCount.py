@@ -1,6 +1,11 @@
-from collections import Counter
 from datetime import datetime, timedelta
 import csv
+import numpy as np
+
+# Census bin widths
+BIN_15_MINUTES = timedelta(minutes=15)
+BIN_HOURLY = timedelta(hours=1)
+BIN_DAILY = timedelta(days=1)
 
 # List of time ranges
 # time_ranges = {
@@ -78,28 +83,78 @@ def generate_hourly_timestamps(start, end):
         current_dt += timedelta(hours=1)
     return timestamps
 
-key_timestamp_counts = {}
+# Sweep-line census over integer bins - +1 at each stay's first bin, -1 after its last bin, cumulative sum
+# gives occupancy per bin (same bins as generate_hourly_timestamps: floor(start) .. last bin starting before end)
+# - starts/ends: datetime64 arrays; returns (bin start datetime64[m] array, counts int64 array, valid mask)
+# - ranges with end < start are not counted (valid mask False)
+def census_counts(starts, ends, bin_width=BIN_HOURLY):
+    width = int(bin_width.total_seconds() // 60)
+    start_min = np.asarray(starts, dtype='datetime64[m]').astype(np.int64)
+    end_min = np.asarray(ends, dtype='datetime64[m]').astype(np.int64)
+    valid = end_min >= start_min
+
+    first_bin = start_min[valid] // width
+    stop_bin = -(-end_min[valid] // width)
+    if first_bin.size == 0:
+        return np.array([], dtype='datetime64[m]'), np.array([], dtype=np.int64), valid
+
+    origin = first_bin.min()
+    size = int(stop_bin.max() - origin) + 1
+    diff = np.bincount(first_bin - origin, minlength=size) - np.bincount(stop_bin - origin, minlength=size)
+    counts = np.cumsum(diff)[:size - 1]
+
+    bin_starts = ((origin + np.arange(size - 1)) * width).astype('datetime64[m]')
+    return bin_starts, counts, valid
+
+# Census per POC from {poc: [(start, end), ...]} (strings in convert_to_datetime format or datetimes)
+# - returns ({poc: (bin starts, counts)}, {poc: [(start, end, reason), ...]}) - reason is 'unparseable' or 'reversed'
+def compute_census(time_ranges, bin_width=BIN_HOURLY):
+    census = {}
+    invalid = {}
+    for key, ranges in time_ranges.items():
+        starts, ends, parsed, rejected = [], [], [], []
+        for start, end in ranges:
+            try:
+                start_dt = convert_to_datetime(start) if isinstance(start, str) else start
+                end_dt = convert_to_datetime(end) if isinstance(end, str) else end
+            except ValueError:
+                rejected.append((start, end, 'unparseable'))
+                continue
+            starts.append(start_dt)
+            ends.append(end_dt)
+            parsed.append((start, end))
+
+        bin_starts, counts, valid = census_counts(
+            np.array(starts, dtype='datetime64[m]'), np.array(ends, dtype='datetime64[m]'), bin_width
+        )
+        for i in np.flatnonzero(~valid):
+            rejected.append(parsed[i] + ('reversed',))
 
-# Generate hourly timestamps for each range in each set
-for key, ranges in time_ranges.items():
-    all_timestamps = []
-    for start, end in ranges:
-        all_timestamps.extend(generate_hourly_timestamps(start, end))
-    
-    # Count the occurrences of each timestamp for the current key
-    key_timestamp_counts[key] = Counter(all_timestamps)
-print(key_timestamp_counts)
+        census[key] = (bin_starts, counts)
+        if rejected:
+            invalid[key] = rejected
+    return census, invalid
 
-with open('filtered_timestamp_counts.csv', 'w', newline='') as csvfile:
-    fieldnames = ['POC', 'Timestamp', 'Count']
-    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+def write_census_csv(census, file_name):
+    with open(file_name, 'w', newline='') as csvfile:
+        fieldnames = ['POC', 'Timestamp', 'Count']
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
 
-    writer.writeheader()
-    for key, counts in key_timestamp_counts.items():
-        for timestamp, count in counts.items():
-            formatted_timestamp = timestamp.strftime('%m/%d/%Y  %I:%M:%S %p')
-            writer.writerow({'POC': key, 'Timestamp': formatted_timestamp, 'Count': count})
+        writer.writeheader()
+        for key, (bin_starts, counts) in census.items():
+            nonzero = np.flatnonzero(counts)
+            for timestamp, count in zip(bin_starts[nonzero].astype(datetime), counts[nonzero]):
+                formatted_timestamp = timestamp.strftime('%m/%d/%Y  %I:%M:%S %p')
+                writer.writerow({'POC': key, 'Timestamp': formatted_timestamp, 'Count': int(count)})
 
-print("CSV file 'filtered_timestamp_counts_3.csv' has been created.")
+def main():
+    census, invalid = compute_census(time_ranges, BIN_HOURLY)
+    for key, rejected in invalid.items():
+        for start, end, reason in rejected:
+            print(f"Invalid range for {key}: {start} - {end} ({reason})")
 
+    write_census_csv(census, 'filtered_timestamp_counts.csv')
+    print("CSV file 'filtered_timestamp_counts.csv' has been created.")
 
+if __name__ == '__main__':
+    main()
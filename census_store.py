@@ -0,0 +1,447 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from datetime import datetime, timedelta
+# ---
+import numpy as np
+from censusCount import BIN_HOURLY
+from census_stream import EPOCH, StreamingCensus, iter_parsed_file
+
+# Rollup periods - hour -> period id (weeks start on Monday; 1970-01-01 was a Thursday)
+PERIOD_HOUR = 'hour'
+PERIOD_DAY = 'day'
+PERIOD_WEEK = 'week'
+PERIOD_MONTH = 'month'
+ROLLUP_PERIODS = (PERIOD_DAY, PERIOD_WEEK, PERIOD_MONTH)
+
+# Hour capacity of a new store - doubled as hours are appended (the max tree is rebuilt then)
+DEFAULT_CAPACITY = 1024
+
+# Same timestamp format as censusCount.write_census_csv
+CSV_TIMESTAMP_FORMAT = '%m/%d/%Y  %I:%M:%S %p'
+
+
+def hour_of(value):
+    # hours since EPOCH of a datetime / datetime64 / ISO string
+    if isinstance(value, datetime):
+        return (value.replace(tzinfo=None) - EPOCH) // BIN_HOURLY
+    return int(np.datetime64(value, 'h').astype(np.int64))
+
+
+def hour_start(hour):
+    return EPOCH + int(hour) * BIN_HOURLY
+
+
+def period_of(period, hours):
+    # period ids of an hours array
+    if period == PERIOD_DAY:
+        return hours // 24
+    if period == PERIOD_WEEK:
+        return (hours // 24 + 3) // 7
+    if period == PERIOD_MONTH:
+        return hours.astype('datetime64[h]').astype('datetime64[M]').astype(np.int64)
+    raise ValueError(f"unknown period {period} - one of {', '.join(ROLLUP_PERIODS)}")
+
+
+def period_start(period, ids):
+    # first hour of period ids
+    if period == PERIOD_DAY:
+        return ids * 24
+    if period == PERIOD_WEEK:
+        return (ids * 7 - 3) * 24
+    return ids.astype('datetime64[M]').astype('datetime64[h]').astype(np.int64)
+
+
+class CensusStore:
+    # persisted per-POC hourly census - one row per POC of dense arrays over hours origin .. origin + length:
+    # - counts (int32), prefix sums (int64, prefix[:, i] = sum of counts[:, :i]) for O(1) range sums
+    # - max tree (segment tree over counts, rebuilt on load) for O(log n) range peaks
+    # - day/week/month rollups - per period: hours covered, sum and max per POC (mean = sum / hours)
+    # hours are appended in time order only (extend/append) - the last, partial period of each rollup is
+    # recomputed on append; time bounds are located by binary search, so queries do not touch the history
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.pocs = []
+        self._rows = {}
+        self.origin = None
+        self.length = 0
+        self._capacity = _pow2(capacity)
+        self._counts = np.zeros((0, self._capacity), dtype=np.int32)
+        self._prefix = np.zeros((0, self._capacity + 1), dtype=np.int64)
+        self._tree = np.zeros((0, 2 * self._capacity), dtype=np.int32)
+        self.rollups = {period: _empty_rollup(0) for period in ROLLUP_PERIODS}
+
+    @property
+    def start(self):
+        return None if self.origin is None else hour_start(self.origin)
+
+    @property
+    def end(self):
+        # first hour not in the store (exclusive end)
+        return None if self.origin is None else hour_start(self.origin + self.length)
+
+    # --- appends
+
+    def extend(self, start, counts_by_poc):
+        # append hourly counts from hour start - {poc: 1-D counts}; shorter arrays and POCs not given count 0,
+        # hours between the store end and start as well
+        start = hour_of(start)
+        hours = max((len(counts) for counts in counts_by_poc.values()), default=0)
+        if self.origin is None:
+            self.origin = start
+        elif start < self.origin + self.length:
+            raise ValueError(f"{hour_start(start)} is before the store end {self.end} - stored hours are final")
+        for poc in counts_by_poc:
+            self._row(poc)
+
+        old = self.length
+        new = start - self.origin + hours
+        if new <= old:
+            return
+        self._reserve(new)
+        for poc, counts in counts_by_poc.items():
+            offset = start - self.origin
+            self._counts[self._rows[poc], offset:offset + len(counts)] = counts
+        self.length = new
+
+        self._prefix[:, old + 1:new + 1] = self._prefix[:, old:old + 1] + np.cumsum(self._counts[:, old:new], axis=1)
+        self._update_tree(old, new)
+        for period in ROLLUP_PERIODS:
+            self._update_rollup(period, old)
+
+    def append(self, rows, until=None):
+        # append (poc, hour start, count) rows - StreamingCensus.flush() output - for the hours from the store end
+        # to until (default: the hour after the last row); hours without a row count 0
+        by_poc = {}
+        for poc, timestamp, count in rows:
+            by_poc.setdefault(poc, {})[hour_of(timestamp)] = count
+        if not by_poc and until is None:
+            return
+        first = min((min(hours) for hours in by_poc.values()), default=None)
+        start = self.origin + self.length if self.origin is not None else first
+        if start is None:
+            if until is None:
+                return
+            start = hour_of(until)
+        if first is not None and first < start:
+            raise ValueError(f"{hour_start(first)} is before the store end {self.end} - stored hours are final")
+        stop = hour_of(until) if until is not None else max(max(hours) for hours in by_poc.values()) + 1
+
+        counts_by_poc = {}
+        for poc, hours in by_poc.items():
+            counts = np.zeros(stop - start, dtype=np.int32)
+            index = np.fromiter(hours.keys(), dtype=np.int64, count=len(hours)) - start
+            keep = index < len(counts)
+            counts[index[keep]] = np.fromiter(hours.values(), dtype=np.int64, count=len(hours))[keep]
+            counts_by_poc[poc] = counts
+        if not counts_by_poc and self.pocs:
+            counts_by_poc = {self.pocs[0]: np.zeros(stop - start, dtype=np.int32)}
+        self.extend(hour_start(start), counts_by_poc)
+
+    @classmethod
+    def from_census(cls, census):
+        # store of an hourly compute_census() result - {poc: (bin starts, counts)}
+        store = cls()
+        starts = [hour_of(bin_starts[0]) for bin_starts, _ in census.values() if len(bin_starts)]
+        if not starts:
+            return store
+        origin = min(starts)
+        counts_by_poc = {}
+        for poc, (bin_starts, counts) in census.items():
+            padded = np.zeros(hour_of(bin_starts[0]) - origin + len(counts) if len(counts) else 0, dtype=np.int32)
+            if len(counts):
+                padded[hour_of(bin_starts[0]) - origin:] = counts
+            counts_by_poc[poc] = padded
+        store.extend(hour_start(origin), counts_by_poc)
+        return store
+
+    # --- queries
+
+    def range_stats(self, poc, start=None, end=None):
+        # hours, sum (patient hours), max and mean occupancy of poc over [start, end)
+        row = self._rows[poc]
+        a, b = self._span(start, end)
+        hours = b - a
+        total = int(self._prefix[row, b] - self._prefix[row, a])
+        return {
+            'poc': poc,
+            'start': hour_start(self.origin + a) if self.origin is not None else None,
+            'end': hour_start(self.origin + b) if self.origin is not None else None,
+            'hours': hours,
+            'sum': total,
+            'max': self._range_max(row, a, b),
+            'mean': total / hours if hours else None
+        }
+
+    def rollup(self, poc, period, start=None, end=None):
+        # per-period (start, hours, sum, max, mean) of poc for the periods starting in [start, end) - arrays
+        row = self._rows[poc]
+        if period == PERIOD_HOUR:
+            a, b = self._span(start, end)
+            counts = self._counts[row, a:b].astype(np.int64)
+            return {
+                'start': (self.origin + np.arange(a, b) if self.origin is not None else np.arange(0)).astype('datetime64[h]'),
+                'hours': np.ones(b - a, dtype=np.int32), 'sum': counts, 'max': counts, 'mean': counts.astype(float)
+            }
+        rollup = self.rollups[period]
+        starts = period_start(period, rollup['ids'])
+        i = 0 if start is None else int(np.searchsorted(starts, hour_of(start), 'left'))
+        j = len(starts) if end is None else int(np.searchsorted(starts, hour_of(end), 'left'))
+        hours = rollup['hours'][i:j]
+        sums = rollup['sums'][row, i:j]
+        return {
+            'start': starts[i:j].astype('datetime64[h]'),
+            'hours': hours,
+            'sum': sums,
+            'max': rollup['maxes'][row, i:j],
+            'mean': sums / np.maximum(hours, 1)
+        }
+
+    def hourly(self, poc, start=None, end=None):
+        # (hour starts datetime64[h], counts) of poc over [start, end)
+        rollup = self.rollup(poc, PERIOD_HOUR, start, end)
+        return rollup['start'], rollup['sum']
+
+    # --- persistence / export
+
+    def save(self, path):
+        # npz of the stored arrays (the max tree is rebuilt on load) - replaced atomically
+        arrays = {
+            'pocs': np.array(self.pocs, dtype=str),
+            'origin': np.array(-1 if self.origin is None else self.origin, dtype=np.int64),
+            'counts': self._counts[:, :self.length],
+            'prefix': self._prefix[:, :self.length + 1]
+        }
+        for period, rollup in self.rollups.items():
+            for name, values in rollup.items():
+                arrays[f"{period}_{name}"] = values
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            length = data['counts'].shape[1]
+            store = cls(max(DEFAULT_CAPACITY, length))
+            store.pocs = [str(poc) for poc in data['pocs']]
+            store._rows = {poc: i for i, poc in enumerate(store.pocs)}
+            origin = int(data['origin'])
+            store.origin = None if origin < 0 else origin
+            store.length = length
+            store._counts = np.zeros((len(store.pocs), store._capacity), dtype=np.int32)
+            store._counts[:, :length] = data['counts']
+            store._prefix = np.zeros((len(store.pocs), store._capacity + 1), dtype=np.int64)
+            store._prefix[:, :length + 1] = data['prefix']
+            for period in ROLLUP_PERIODS:
+                store.rollups[period] = {name: data[f"{period}_{name}"] for name in _empty_rollup(0)}
+        store._build_tree()
+        return store
+
+    def export_csv(self, path, pocs=None, period=PERIOD_HOUR, start=None, end=None):
+        # on-demand csv - hourly: POC, Timestamp, Count (non-zero hours, as censusCount wrote it); rollups:
+        # POC, Period, Hours, Sum, Max, Mean - returns rows written
+        rows = 0
+        with open(path, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            if period == PERIOD_HOUR:
+                writer.writerow(['POC', 'Timestamp', 'Count'])
+            else:
+                writer.writerow(['POC', 'Period', 'Hours', 'Sum', 'Max', 'Mean'])
+            for poc in pocs or self.pocs:
+                rollup = self.rollup(poc, period, start, end)
+                if period == PERIOD_HOUR:
+                    nonzero = np.flatnonzero(rollup['sum'])
+                    writer.writerows(
+                        (poc, timestamp.strftime(CSV_TIMESTAMP_FORMAT), int(count))
+                        for timestamp, count in zip(rollup['start'][nonzero].astype(datetime), rollup['sum'][nonzero])
+                    )
+                    rows += len(nonzero)
+                else:
+                    writer.writerows(
+                        (poc, str(period_start_), int(hours), int(total), int(peak), round(float(mean), 3))
+                        for period_start_, hours, total, peak, mean in zip(
+                            rollup['start'], rollup['hours'], rollup['sum'], rollup['max'], rollup['mean'])
+                    )
+                    rows += len(rollup['start'])
+        return rows
+
+    # --- internals
+
+    def _row(self, poc):
+        row = self._rows.get(poc)
+        if row is None:
+            # new POC - zero history
+            row = len(self.pocs)
+            self.pocs.append(poc)
+            self._rows[poc] = row
+            self._counts = np.vstack([self._counts, np.zeros((1, self._counts.shape[1]), dtype=np.int32)])
+            self._prefix = np.vstack([self._prefix, np.zeros((1, self._prefix.shape[1]), dtype=np.int64)])
+            self._tree = np.vstack([self._tree, np.zeros((1, self._tree.shape[1]), dtype=np.int32)])
+            for rollup in self.rollups.values():
+                rollup['sums'] = np.vstack([rollup['sums'], np.zeros((1, rollup['sums'].shape[1]), dtype=np.int64)])
+                rollup['maxes'] = np.vstack([rollup['maxes'], np.zeros((1, rollup['maxes'].shape[1]), dtype=np.int32)])
+        return row
+
+    def _reserve(self, hours):
+        if hours <= self._capacity:
+            return
+        capacity = _pow2(max(hours, 2 * self._capacity))
+        counts = np.zeros((len(self.pocs), capacity), dtype=np.int32)
+        counts[:, :self.length] = self._counts[:, :self.length]
+        prefix = np.zeros((len(self.pocs), capacity + 1), dtype=np.int64)
+        prefix[:, :self.length + 1] = self._prefix[:, :self.length + 1]
+        self._capacity, self._counts, self._prefix = capacity, counts, prefix
+        self._build_tree()
+
+    def _build_tree(self):
+        # max segment tree per row - leaves at capacity + hour, node i = max(node 2i, node 2i + 1)
+        capacity = self._capacity
+        self._tree = np.zeros((len(self.pocs), 2 * capacity), dtype=np.int32)
+        self._tree[:, capacity:capacity + self.length] = self._counts[:, :self.length]
+        size = capacity // 2
+        while size >= 1:
+            self._tree[:, size:2 * size] = np.maximum(self._tree[:, 2 * size:4 * size:2],
+                                                      self._tree[:, 2 * size + 1:4 * size:2])
+            size //= 2
+
+    def _update_tree(self, old, new):
+        if old >= new:
+            return
+        tree, capacity = self._tree, self._capacity
+        tree[:, capacity + old:capacity + new] = self._counts[:, old:new]
+        lo, hi = capacity + old, capacity + new - 1
+        while lo > 1:
+            lo, hi = lo // 2, hi // 2
+            tree[:, lo:hi + 1] = np.maximum(tree[:, 2 * lo:2 * hi + 2:2], tree[:, 2 * lo + 1:2 * hi + 2:2])
+
+    def _range_max(self, row, a, b):
+        if a >= b:
+            return None
+        tree = self._tree[row]
+        lo, hi = a + self._capacity, b + self._capacity
+        peak = None
+        while lo < hi:
+            if lo & 1:
+                peak = tree[lo] if peak is None else max(peak, tree[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                peak = tree[hi] if peak is None else max(peak, tree[hi])
+            lo //= 2
+            hi //= 2
+        return int(peak)
+
+    def _update_rollup(self, period, old):
+        # recompute the periods from the one holding hour old (the last, possibly partial period) to the end
+        rollup = self.rollups[period]
+        if old > 0:
+            first = period_of(period, np.array([self.origin + old], dtype=np.int64))[0]
+            keep = int(np.searchsorted(rollup['ids'], first, 'left'))
+            old = max(0, int(period_start(period, np.array([first], dtype=np.int64))[0]) - self.origin)
+        else:
+            keep = 0
+        ids = period_of(period, self.origin + np.arange(old, self.length, dtype=np.int64))
+        bounds = np.concatenate([[0], np.flatnonzero(np.diff(ids)) + 1])
+        counts = self._counts[:, old:self.length]
+        rollup['ids'] = np.concatenate([rollup['ids'][:keep], ids[bounds]])
+        rollup['hours'] = np.concatenate([rollup['hours'][:keep], np.diff(np.append(bounds, len(ids))).astype(np.int32)])
+        rollup['sums'] = np.concatenate(
+            [rollup['sums'][:, :keep], np.add.reduceat(counts, bounds, axis=1, dtype=np.int64)], axis=1
+        )
+        rollup['maxes'] = np.concatenate(
+            [rollup['maxes'][:, :keep], np.maximum.reduceat(counts, bounds, axis=1)], axis=1
+        )
+
+    def _span(self, start, end):
+        # [start, end) as offsets clamped to the stored hours
+        if self.origin is None:
+            return 0, 0
+        a = 0 if start is None else min(max(hour_of(start) - self.origin, 0), self.length)
+        b = self.length if end is None else min(max(hour_of(end) - self.origin, 0), self.length)
+        return a, max(a, b)
+
+
+def _pow2(n):
+    return 1 << max(0, int(n) - 1).bit_length()
+
+
+def _empty_rollup(pocs):
+    return {
+        'ids': np.zeros(0, dtype=np.int64),
+        'hours': np.zeros(0, dtype=np.int32),
+        'sums': np.zeros((pocs, 0), dtype=np.int64),
+        'maxes': np.zeros((pocs, 0), dtype=np.int32)
+    }
+
+
+def append_parsed_files(store_path, state_path, paths):
+    # one incremental run - StreamingCensus state and the store are loaded, the parsed output files applied,
+    # the finished hours appended and both saved again - returns (census, store)
+    census = StreamingCensus.load(state_path) if os.path.exists(state_path) else StreamingCensus()
+    store = CensusStore.load(store_path) if os.path.exists(store_path) else CensusStore()
+    for path in sorted(paths):
+        census.process(os.path.basename(path), iter_parsed_file(path))
+    rows = list(census.flush())
+    if census.flushed_bin is not None:
+        store.append(rows, until=census.bin_start(census.flushed_bin))
+    store.save(store_path)
+    census.save(state_path)
+    return census, store
+
+
+def main():
+    # python census_store.py append <store.npz> <state.json> <parsed .json/.ndjson files...>
+    # python census_store.py query <store.npz> --poc ICU --period day --last-days 90
+    # python census_store.py export <store.npz> <out.csv> [--poc ...] [--period ...] [--start ...] [--end ...]
+    parser = argparse.ArgumentParser(description='Per-POC hourly census store')
+    commands = parser.add_subparsers(dest='command', required=True)
+    append = commands.add_parser('append', help='apply parsed output files, append the finished hours')
+    append.add_argument('store')
+    append.add_argument('state', help='StreamingCensus state (open visits, unfinished hours)')
+    append.add_argument('paths', nargs='+')
+    for name in ('query', 'export'):
+        command = commands.add_parser(name)
+        command.add_argument('store')
+        if name == 'export':
+            command.add_argument('csv')
+        command.add_argument('--poc', action='append', help='repeatable (export default: all POCs)')
+        command.add_argument('--period', default=PERIOD_HOUR if name == 'export' else PERIOD_DAY,
+                             choices=(PERIOD_HOUR,) + ROLLUP_PERIODS)
+        command.add_argument('--start', help='ISO hour, inclusive')
+        command.add_argument('--end', help='ISO hour, exclusive')
+        command.add_argument('--last-days', type=int, help='instead of --start: days before the store end')
+    args = parser.parse_args()
+
+    if args.command == 'append':
+        census, store = append_parsed_files(args.store, args.state, args.paths)
+        print(json.dumps(dict(census.stats, hours_stored=store.length, store_end=str(store.end))))
+        return
+
+    store = CensusStore.load(args.store)
+    start = args.start
+    if args.last_days is not None and store.end is not None:
+        start = store.end - timedelta(days=args.last_days)
+
+    if args.command == 'export':
+        rows = store.export_csv(args.csv, args.poc, args.period, start, args.end)
+        print(f"{rows} rows written to {args.csv}", file=sys.stderr)
+        return
+
+    for poc in args.poc or store.pocs:
+        started = time.perf_counter()
+        stats = store.range_stats(poc, start, args.end)
+        rollup = store.rollup(poc, args.period, start, args.end)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        print(json.dumps(dict(stats, start=str(stats['start']), end=str(stats['end']), period=args.period, periods=[
+            {'start': str(s), 'hours': int(h), 'sum': int(t), 'max': int(m), 'mean': round(float(a), 3)}
+            for s, h, t, m, a in zip(rollup['start'], rollup['hours'], rollup['sum'], rollup['max'], rollup['mean'])
+        ])))
+        print(f"{poc} - {elapsed_ms:.2f} ms", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
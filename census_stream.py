@@ -0,0 +1,247 @@
+import os
+import sys
+import csv
+import json
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+# ---
+from hl7_fields import parse_hl7_dtm
+from censusCount import BIN_HOURLY
+
+# ADT trigger events - admit/register open a stay, transfer moves it, discharge closes it, cancel admit drops it
+ADMIT_EVENTS = ('A01', 'A04')
+TRANSFER_EVENTS = ('A02',)
+DISCHARGE_EVENTS = ('A03',)
+CANCEL_ADMIT_EVENTS = ('A11',)
+UPDATE_EVENTS = ('A08',)
+
+# Bounds on in-memory state - open visits tracked, and how far behind the newest event hours are kept open
+MAX_OPEN_VISITS = 200000
+DEFAULT_LATENESS = timedelta(hours=24)
+
+# Sources (file/blob names) are remembered for this long behind the flushed watermark - a source seen again within
+# it is skipped; older ones are forgotten, so the state does not grow with the history
+DEFAULT_SOURCE_RETENTION = timedelta(days=7)
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def iter_parsed_file(path):
+    # parsed output messages from a local .json (one message) or .ndjson (one message per line) file
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith('.ndjson'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield json.load(f)
+
+
+def iter_parsed_blobs(container_client, names):
+    # parsed output messages from .json/.ndjson output blobs, one blob in memory at a time
+    for name in names:
+        content = container_client.get_blob_client(name).download_blob().readall().decode('utf-8')
+        if name.endswith('.ndjson'):
+            for line in content.splitlines():
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield json.loads(content)
+
+
+class StreamingCensus:
+    # incremental per-POC census from parsed ADT messages (get_message output)
+    # - visits are paired by visit_number: +1 at the stay's first bin, -1 after its last bin (sweep-line deltas)
+    # - only deltas for bins not yet flushed are kept; flush() folds them into a running count per POC and
+    #   emits the finished bins, so memory depends on the open visits and the lateness window, not on history
+    # - events older than the flushed watermark are clamped to it (counted as late_events)
+    # - at most max_open_visits visits are held - the least recently updated is closed at the newest event time
+
+    def __init__(self, bin_width=BIN_HOURLY, max_open_visits=MAX_OPEN_VISITS):
+        self.bin_width = bin_width
+        self.max_open_visits = max_open_visits
+        self.open_visits = OrderedDict()        # visit_number -> [poc, first bin]
+        self.deltas = defaultdict(dict)         # poc -> {bin: delta} for bins >= flushed_bin
+        self.base = defaultdict(int)            # poc -> occupancy at flushed_bin
+        self.flushed_bin = None
+        self.newest_bin = None
+        self.processed = {}                     # source -> newest bin when it was processed
+        self.stats = defaultdict(int)
+
+    def bin_of(self, dt):
+        return (dt - EPOCH) // self.bin_width
+
+    def bin_start(self, b):
+        return EPOCH + b * self.bin_width
+
+    def apply(self, message):
+        # apply one parsed output message - error/non-ADT messages are counted and ignored
+        hl7_parsed = message.get('hl7_parsed') or {}
+        event = hl7_parsed.get('trigger_event_type_cd')
+        visit = hl7_parsed.get('visit_number')
+        poc = hl7_parsed.get('point_of_care_cd')
+        event_dt = parse_hl7_dtm(hl7_parsed.get('recorded_dttm')) or parse_hl7_dtm(hl7_parsed.get('message_dttm'))
+
+        if not visit or event_dt is None or hl7_parsed.get('message_type_cd', 'ADT') != 'ADT':
+            self.stats['ignored'] += 1
+            return
+        self.stats['events'] += 1
+
+        if event in ADMIT_EVENTS:
+            start_dt = parse_hl7_dtm(hl7_parsed.get('admit_dttm')) or event_dt
+            current = self.open_visits.get(visit)
+            if current is not None and current == [poc, self._clamp(self.bin_of(start_dt))]:
+                self.stats['duplicate_events'] += 1
+                return
+            if current is not None:
+                self._close(visit, start_dt)
+            self._open(visit, poc, start_dt)
+        elif event in TRANSFER_EVENTS or (event in UPDATE_EVENTS and visit in self.open_visits):
+            current = self.open_visits.get(visit)
+            if current is not None and current[0] == poc:
+                return
+            if current is not None:
+                self._close(visit, event_dt)
+            self._open(visit, poc, event_dt)
+        elif event in DISCHARGE_EVENTS:
+            if visit not in self.open_visits:
+                self.stats['unpaired_discharges'] += 1
+                return
+            self._close(visit, parse_hl7_dtm(hl7_parsed.get('discharge_dttm')) or event_dt)
+        elif event in CANCEL_ADMIT_EVENTS:
+            current = self.open_visits.pop(visit, None)
+            if current is not None:
+                self._add(current[0], current[1], -1)
+        else:
+            self.stats['ignored_events'] += 1
+
+    def process(self, source, messages):
+        # apply all messages of one source (file/blob name) once - sources seen before are skipped
+        if source in self.processed:
+            self.stats['skipped_sources'] += 1
+            return False
+        for message in messages:
+            self.apply(message)
+        self.processed[source] = self.newest_bin
+        return True
+
+    def flush(self, until=None, lateness=DEFAULT_LATENESS, source_retention=DEFAULT_SOURCE_RETENTION):
+        # yield (poc, bin start, count) for every bin before until (default: newest event - lateness)
+        # with occupancy > 0, and drop their deltas - flushed bins are final
+        # - POCs with open stays but no deltas left (base > 0) are emitted too
+        # - sources processed before flushed watermark - source_retention are forgotten
+        if self.newest_bin is None:
+            return
+        until_bin = self.bin_of(until) if until is not None else self.newest_bin - lateness // self.bin_width
+        if self.flushed_bin is None:
+            self.flushed_bin = min(min(d) for d in self.deltas.values() if d) if any(self.deltas.values()) else until_bin
+        if until_bin <= self.flushed_bin:
+            return
+
+        for poc in sorted(set(self.deltas) | set(self.base)):
+            deltas = self.deltas[poc]
+            count = self.base[poc]
+            if not deltas and not count:
+                continue
+            for b in range(self.flushed_bin, until_bin):
+                count += deltas.pop(b, 0)
+                if count:
+                    yield poc, self.bin_start(b), count
+            self.base[poc] = count
+        self.flushed_bin = until_bin
+
+        retained = until_bin - source_retention // self.bin_width
+        self.processed = {source: b for source, b in self.processed.items() if b is not None and b >= retained}
+
+    def save(self, path):
+        state = {
+            'bin_width_minutes': self.bin_width // timedelta(minutes=1),
+            'flushed_bin': self.flushed_bin,
+            'newest_bin': self.newest_bin,
+            'open_visits': list(self.open_visits.items()),
+            'deltas': {poc: list(d.items()) for poc, d in self.deltas.items() if d},
+            'base': dict(self.base),
+            'processed': list(self.processed.items()),
+            'stats': dict(self.stats)
+        }
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path, max_open_visits=MAX_OPEN_VISITS):
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        census = cls(timedelta(minutes=state['bin_width_minutes']), max_open_visits)
+        census.flushed_bin = state['flushed_bin']
+        census.newest_bin = state['newest_bin']
+        census.open_visits = OrderedDict((visit, value) for visit, value in state['open_visits'])
+        for poc, items in state['deltas'].items():
+            census.deltas[poc] = {int(b): delta for b, delta in items}
+        census.base.update(state['base'])
+        for item in state['processed']:
+            # older states hold source names only - kept until the next flush's retention check
+            source, b = (item, census.newest_bin) if isinstance(item, str) else item
+            census.processed[source] = b
+        census.stats.update(state['stats'])
+        return census
+
+    def _clamp(self, b):
+        if self.flushed_bin is not None and b < self.flushed_bin:
+            self.stats['late_events'] += 1
+            return self.flushed_bin
+        return b
+
+    def _add(self, poc, b, delta):
+        deltas = self.deltas[poc]
+        deltas[b] = deltas.get(b, 0) + delta
+        if deltas[b] == 0:
+            del deltas[b]
+
+    def _open(self, visit, poc, start_dt):
+        first_bin = self._clamp(self.bin_of(start_dt))
+        self.newest_bin = first_bin if self.newest_bin is None else max(self.newest_bin, first_bin)
+        self._add(poc, first_bin, 1)
+        self.open_visits[visit] = [poc, first_bin]
+        self.open_visits.move_to_end(visit)
+
+        if len(self.open_visits) > self.max_open_visits:
+            evicted, (evicted_poc, evicted_bin) = self.open_visits.popitem(last=False)
+            self._add(evicted_poc, max(self.newest_bin + 1, evicted_bin), -1)
+            self.stats['evicted_visits'] += 1
+
+    def _close(self, visit, end_dt):
+        poc, first_bin = self.open_visits.pop(visit)
+        end_min = (end_dt - EPOCH) // timedelta(minutes=1)
+        width = self.bin_width // timedelta(minutes=1)
+        stop_bin = self._clamp(-(-end_min // width))
+        if stop_bin < first_bin:
+            self.stats['reversed_stays'] += 1
+            stop_bin = first_bin
+        self.newest_bin = max(self.newest_bin, stop_bin - 1)
+        self._add(poc, stop_bin, -1)
+
+
+def main():
+    # python census_stream.py <state.json> <counts.csv> <parsed .json/.ndjson files...>
+    # - new files add their deltas to the saved state, finished hours are appended to counts.csv
+    state_path, csv_path, paths = sys.argv[1], sys.argv[2], sys.argv[3:]
+    census = StreamingCensus.load(state_path) if os.path.exists(state_path) else StreamingCensus()
+
+    for path in sorted(paths):
+        census.process(os.path.basename(path), iter_parsed_file(path))
+
+    write_header = not os.path.exists(csv_path)
+    with open(csv_path, 'a', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=['POC', 'Timestamp', 'Count'])
+        if write_header:
+            writer.writeheader()
+        for poc, timestamp, count in census.flush():
+            writer.writerow({'POC': poc, 'Timestamp': timestamp.strftime('%m/%d/%Y  %I:%M:%S %p'), 'Count': count})
+
+    census.save(state_path)
+    print(json.dumps(dict(census.stats)))
+
+
+if __name__ == '__main__':
+    main()
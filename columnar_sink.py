@@ -0,0 +1,228 @@
+import json
+from datetime import datetime
+# ---
+import pyarrow as pa
+import pyarrow.parquet as pq
+from azure.storage.blob import BlobBlock, ContentSettings
+# ---
+from hl7_fields import parse_hl7_dtm
+from output_sinks import DEFAULT_BLOCK_SIZE, _submit, _wait
+from pipeline_metrics import NULL_METRICS, STAGE_ENCODE, STAGE_UPLOAD
+
+# hl7_raw placement - interface_config output_raw_mode
+RAW_MODE_FILE = 'file'          # separate <stem>.raw.parquet (message_uid, hl7_raw) next to each fields file
+RAW_MODE_COLUMN = 'column'      # hl7_raw as the last column of the fields file
+
+# Rows buffered per parquet row group
+DEFAULT_ROW_GROUP_SIZE = 50000
+
+# hl7cc labels with this suffix are HL7 DTM/TS values - written as timestamp columns
+DTTM_SUFFIX = '_dttm'
+
+PARQUET_SUFFIX = '.parquet'
+RAW_SUFFIX = '.raw.parquet'
+
+# Output message fields (get_message) written as columns, before the hl7_parsed fields
+MESSAGE_COLUMNS = [
+    ('message_uid', pa.string()),
+    ('processed_dttm', pa.timestamp('us', tz='UTC')),
+    ('interface_id', pa.string()),
+    ('interface_short_name', pa.string()),
+    ('from_source_id', pa.string()),
+    ('from_source_short_name', pa.string()),
+    ('to_source_id', pa.string()),
+    ('to_source_short_name', pa.string()),
+    ('logged_by', pa.string()),
+    ('log_severity_cd', pa.string()),
+    ('log_message_cd', pa.string()),
+    ('more_info', pa.string()),
+    ('original_version_id', pa.string())
+]
+
+# Of those, the ones read from hl7_parsed rather than the top level of the output message
+PARSED_MESSAGE_COLUMNS = ('original_version_id',)
+
+RAW_SCHEMA = pa.schema([('message_uid', pa.string()), ('hl7_raw', pa.string())])
+
+
+def parquet_schema(hl7cc, raw_mode=RAW_MODE_FILE):
+    # columns - output message fields, then one per hl7_client_config label (in config order);
+    # *_dttm labels are naive timestamps (HL7 wall clock), all other labels strings
+    columns = dict(MESSAGE_COLUMNS)
+    for label in hl7cc.values():
+        if label not in columns:
+            columns[label] = pa.timestamp('us') if label.endswith(DTTM_SUFFIX) else pa.string()
+    if raw_mode == RAW_MODE_COLUMN:
+        columns['hl7_raw'] = pa.string()
+    return pa.schema(list(columns.items()))
+
+
+def _column_value(source, name, data_type):
+    if name == 'processed_dttm':
+        return datetime.fromisoformat(source['processed_dttm'])
+    if name == 'more_info':
+        return json.dumps(source['more_info']) if source.get('more_info') is not None else None
+
+    value = source.get(name)
+    if value is None or value == '':
+        return None
+    if pa.types.is_timestamp(data_type):
+        return parse_hl7_dtm(value)
+    return str(value)
+
+
+class StagedBlobWriter:
+    # write-only file object over a block blob - data is staged in blocks of ~block_size bytes
+    # (on the sink's upload pool) and committed on close
+
+    def __init__(self, blob_client, block_size=DEFAULT_BLOCK_SIZE, uploader=None, metrics=NULL_METRICS):
+        self.blob_client = blob_client
+        self.block_size = block_size
+        self.uploader = uploader
+        self.metrics = metrics
+        self.closed = False
+        self._buffer = bytearray()
+        self._blocks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        if len(self._buffer) >= self.block_size:
+            self._stage()
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        self._stage()
+        _wait(self.uploader)
+        with self.metrics.timer(STAGE_UPLOAD):
+            self.blob_client.commit_block_list(
+                self._blocks, content_settings=ContentSettings(content_type='application/vnd.apache.parquet')
+            )
+        self.closed = True
+
+    def _stage(self):
+        if not self._buffer:
+            return
+        block_id = f"{len(self._blocks):06d}"
+        stage_block = self.metrics.timed(STAGE_UPLOAD, self.blob_client.stage_block)
+        _submit(self.uploader, stage_block, block_id, bytes(self._buffer))
+        self._blocks.append(BlobBlock(block_id=block_id))
+        self._buffer = bytearray()
+
+
+class _ParquetPart:
+    # one parquet blob - rows buffered per column and written as row groups of row_group_size
+
+    def __init__(self, container_client, blob_name, schema, block_size, row_group_size, uploader, metrics):
+        self.blob_name = blob_name
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.metrics = metrics
+        self.rows = 0
+        self._columns = {name: [] for name in schema.names}
+        self._file = StagedBlobWriter(container_client.get_blob_client(blob_name), block_size, uploader, metrics)
+        self._writer = pq.ParquetWriter(self._file, schema, compression='zstd')
+
+    def append(self, values):
+        for name, value in zip(self.schema.names, values):
+            self._columns[name].append(value)
+        self.rows += 1
+        if len(self._columns[self.schema.names[0]]) >= self.row_group_size:
+            self._write_row_group()
+
+    def close(self):
+        self._write_row_group()
+        self._writer.close()
+        self._file.close()
+        return self.blob_name
+
+    def _write_row_group(self):
+        if not self._columns[self.schema.names[0]]:
+            return
+        with self.metrics.timer(STAGE_ENCODE):
+            self._writer.write_table(pa.table(self._columns, schema=self.schema))
+        self._columns = {name: [] for name in self.schema.names}
+
+
+class ParquetSink:
+    # columnar output - hl7_parsed fields as typed columns (schema from the hl7_client_config labels),
+    # one parquet blob per processing hour, hive-partitioned by interface and hour:
+    #   <folder>/interface_id=<id>/processed_hour=<YYYYMMDDHH>/<stem>.parquet
+    # - hl7_raw goes to <stem>.raw.parquet next to it (raw_mode 'file') so field scans never read it,
+    #   or into an hl7_raw column (raw_mode 'column')
+    # - like NdjsonBlockSink, blocks are committed on close only
+
+    def __init__(self, container_client, folder, stem, hl7cc, raw_mode=RAW_MODE_FILE,
+                 block_size=DEFAULT_BLOCK_SIZE, row_group_size=DEFAULT_ROW_GROUP_SIZE):
+        if raw_mode not in (RAW_MODE_FILE, RAW_MODE_COLUMN):
+            raise ValueError(f"Unknown output_raw_mode - {raw_mode}")
+
+        self.container_client = container_client
+        self.folder = folder
+        self.stem = stem
+        self.raw_mode = raw_mode
+        self.block_size = block_size
+        self.row_group_size = row_group_size
+        self.schema = parquet_schema(hl7cc, raw_mode)
+        self.uploader = None
+        self.metrics = NULL_METRICS
+        self.last_location = None
+
+        self.messages = 0
+        message_columns = {name for name, _ in MESSAGE_COLUMNS if name not in PARSED_MESSAGE_COLUMNS}
+        self._columns = [
+            (name in message_columns, name, data_type) for name, data_type in zip(self.schema.names, self.schema.types)
+        ]
+        self._parts = {}
+
+    def write(self, message):
+        hl7_parsed = message.get('hl7_parsed') or {}
+        with self.metrics.timer(STAGE_ENCODE):
+            values = [
+                _column_value(message if top_level else hl7_parsed, name, data_type)
+                for top_level, name, data_type in self._columns
+            ]
+        if self.raw_mode == RAW_MODE_COLUMN:
+            values[-1] = message.get('hl7_raw')
+
+        fields_part, raw_part = self._get_parts(message.get('interface_id'), values[1])
+        fields_part.append(values)
+        self.last_location = {'blob': fields_part.blob_name, 'row': fields_part.rows - 1}
+        if raw_part is not None:
+            raw_part.append([message.get('message_uid'), message.get('hl7_raw')])
+        self.messages += 1
+
+    def close(self):
+        # write the remaining row groups and commit every part - returns the blob names written
+        written = []
+        for parts in self._parts.values():
+            written.extend(part.close() for part in parts if part is not None)
+        self._parts = {}
+        return written
+
+    def _get_parts(self, interface_id, processed_dttm):
+        key = (interface_id, processed_dttm.strftime('%Y%m%d%H'))
+        parts = self._parts.get(key)
+        if parts is None:
+            prefix = f"{self.folder}/interface_id={key[0]}/processed_hour={key[1]}/{self.stem}"
+            parts = (
+                _ParquetPart(self.container_client, prefix + PARQUET_SUFFIX, self.schema,
+                             self.block_size, self.row_group_size, self.uploader, self.metrics),
+                _ParquetPart(self.container_client, prefix + RAW_SUFFIX, RAW_SCHEMA,
+                             self.block_size, self.row_group_size, self.uploader, self.metrics)
+                if self.raw_mode == RAW_MODE_FILE else None
+            )
+            self._parts[key] = parts
+        return parts
@@ -0,0 +1,156 @@
+import os
+import json
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+from hashlib import sha256
+from datetime import datetime, timezone
+# ---
+from hl7_fields import config_hash
+
+# Dedup modes - interface_config dedup_mode
+DEDUP_MODE_MEMORY = 'memory'    # per-worker LRU only
+DEDUP_MODE_SQLITE = 'sqlite'    # LRU in front of a local sqlite file (survives restarts, shared by workers)
+
+# Defaults - message keys kept in the LRU, sqlite file
+DEFAULT_MAX_ENTRIES = 200000
+DEFAULT_DEDUP_PATH = os.path.join(tempfile.gettempdir(), 'hl7_dedup.sqlite')
+
+# interface_config keys that change the output of a message - part of the dedup key: its fields, where and how it
+# is written (output is written to from_source_host/from_source_container - the account/container the capture is
+# read from; parse_mode, output format/raw layout, lookup index entries); file rolling/batching keys
+# (output_max_*, output_block_size, output_row_group_size, *_workers) only change which file a message lands in
+DEDUP_CONFIG_KEYS = (
+    'interface_id', 'short_name', 'from_source_id', 'from_source_short_name', 'from_source_host',
+    'from_source_container', 'to_source_id', 'to_source_short_name', 'to_source_folder', 'output_mode',
+    'parse_mode', 'output_raw_mode', 'output_index', 'output_index_folder'
+)
+
+# Caches kept warm across invocations - key: (mode, path)
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def dedup_config_hash(ic, hl7cc):
+    # hash of the output-relevant interface_config keys + hl7_client_config
+    ic_items = [(key, ic.get(key)) for key in DEDUP_CONFIG_KEYS]
+    return sha256(json.dumps([ic_items, config_hash(hl7cc)], default=str).encode('utf-8')).hexdigest()
+
+
+class DedupCache:
+    # set of processed message keys - LRU of max_entries keys, optionally backed by a sqlite file
+    # - keys are 32 byte digests of (config hash, message_uid)
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+
+        if path is not None:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS processed_messages (
+                    message_key BLOB PRIMARY KEY,
+                    processed_at TEXT
+                ) WITHOUT ROWID
+            """)
+            self._conn.commit()
+
+    def contains(self, key):
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return True
+            if self._conn is not None and self._conn.execute(
+                'SELECT 1 FROM processed_messages WHERE message_key = ?', (key,)
+            ).fetchone():
+                self._remember(key)
+                self.store_hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def add_many(self, keys):
+        now = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            for key in keys:
+                self._remember(key)
+            if self._conn is not None:
+                self._conn.executemany(
+                    'INSERT OR IGNORE INTO processed_messages (message_key, processed_at) VALUES (?, ?)',
+                    [(key, now) for key in keys]
+                )
+                self._conn.commit()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+
+    def _remember(self, key):
+        self._lru[key] = None
+        self._lru.move_to_end(key)
+        if len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+
+def get_dedup_cache(mode, path=None, max_entries=DEFAULT_MAX_ENTRIES):
+    # shared DedupCache per (mode, path) - stays warm across invocations
+    if mode not in (DEDUP_MODE_MEMORY, DEDUP_MODE_SQLITE):
+        raise ValueError(f"Unknown dedup_mode - {mode}")
+    path = (path or DEFAULT_DEDUP_PATH) if mode == DEDUP_MODE_SQLITE else None
+
+    with _caches_lock:
+        cache = _caches.get((mode, path))
+        if cache is None:
+            cache = DedupCache(max_entries, path)
+            _caches[(mode, path)] = cache
+        return cache
+
+
+class DedupFilter:
+    # per-run view of a DedupCache - drops records whose message_uid was already processed under the same
+    # config (or seen earlier in this run); keys are only added to the cache by commit(), once the output
+    # was written, so a failed run is processed again on retry
+
+    def __init__(self, cache, ic, hl7cc):
+        self.cache = cache
+        self.config_hash = bytes.fromhex(dedup_config_hash(ic, hl7cc))
+        self.skipped = 0
+        self._pending = []
+        self._pending_keys = set()
+
+    def message_key(self, body):
+        # body -> cache key, from the same digest get_message uses as message_uid
+        return sha256(self.config_hash + sha256(body).digest()).digest()
+
+    def filter(self, records):
+        # avro records -> records not processed before
+        for record in records:
+            key = self.message_key(record.get('Body'))
+            if key in self._pending_keys or self.cache.contains(key):
+                self.skipped += 1
+                continue
+            self._pending_keys.add(key)
+            self._pending.append(key)
+            yield record
+
+    def commit(self):
+        self.cache.add_many(self._pending)
+        self._pending = []
+        self._pending_keys = set()
+
+
+def create_dedup_filter(ic, hl7cc):
+    # DedupFilter per interface_config dedup_mode/dedup_path/dedup_max_entries, None when dedup is off
+    mode = ic.get('dedup_mode')
+    if not mode:
+        return None
+    cache = get_dedup_cache(mode, ic.get('dedup_path'), ic.get('dedup_max_entries', DEFAULT_MAX_ENTRIES))
+    return DedupFilter(cache, ic, hl7cc)
@@ -1,77 +1,245 @@
 import csv
-import pandas as pd
-from azure.eventhub import EventHubProducerClient, EventData, EventHubConsumerClient
+import json
+import time
+import logging
+import threading
+from azure.eventhub import EventHubProducerClient, EventData
+from hl7_fields import routing_key, routing_path
+from io_throttle import IOController, DeadLetterError, SDK_RETRY_TOTAL
+from pipeline import OrderedLanes, partition_for_key
 
 connection_str = ""
 
 consumer_group = '$Default'
 eventhub_name = 'test-adf-1'
 
+# CSV read buffer and the largest field accepted (exported hl7 messages can exceed csv's 128 KiB default)
+READ_BUFFER_SIZE = 1024 * 1024
+MAX_FIELD_SIZE = 64 * 1024 * 1024
+
+# Batches sent concurrently (one send at a time per partition) - at most SEND_WORKERS * 2 batches queued
+SEND_WORKERS = 4
+
+# Messages still throttled after the retries - written next to the csv, loadable with the same column name
+DEAD_LETTER_SUFFIX = '.deadletter.csv'
+
+# HL7 field routing messages to partitions (hl7cc-style path, e.g. 'pid.pid_3' for the patient) - messages
+# with the same value go to the same partition, in csv order; None or messages without it: round-robin
+ROUTING_FIELD = 'pv1.pv1_19'
+
+
+class LoadStats:
+    # counters for one csv load
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.rows = 0
+        self.bad_lines = 0
+        self.empty = 0
+        self.events = 0
+        self.bytes = 0
+        self.batches = 0
+        self.unrouted = 0
+        self.dead_lettered = 0
+
+    def summary(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return {
+            'rows': self.rows,
+            'bad_lines': self.bad_lines,
+            'empty': self.empty,
+            'events': self.events,
+            'batches': self.batches,
+            'unrouted': self.unrouted,
+            'dead_lettered': self.dead_lettered,
+            'megabytes': round(self.bytes / 2**20, 3),
+            'elapsed_sec': round(elapsed, 3),
+            'rows_per_sec': round(self.rows / elapsed, 1),
+            'mb_per_sec': round(self.bytes / 2**20 / elapsed, 3)
+        }
 
-# with capture feature on to automatically write messages to blob
-def read_messages_from_csv(file_path, column_name):
-    df = pd.read_csv(file_path, delimiter=',', error_bad_lines=False)
-    messages = df[column_name]
-    return messages
-
-def encode_decode_message(message):
-    # Replace `\r` with space to format as required
-    # formatted_message = message.replace(r'\r', '\n')
-    # Replace escaped characters like `\\` with their single counterparts
-    # formatted_message = formatted_message.replace(r'\\', '\\')
-    formatted_message = message.encode('utf-8').decode('unicode_escape')
-
-    return formatted_message
 
+# with capture feature on to automatically write messages to blob
+def read_messages_from_csv(file_path, column_name, stats=None):
+    # yield column_name of each csv row, one row in memory at a time
+    # - rows with a different field count than the header (or unparseable) are skipped, counted as bad_lines
+    #   (what pandas' removed error_bad_lines=False did)
+    csv.field_size_limit(MAX_FIELD_SIZE)
+    with open(file_path, 'r', newline='', encoding='utf-8', buffering=READ_BUFFER_SIZE) as f:
+        reader = csv.reader(f, delimiter=',')
+        header = next(reader, None)
+        if header is None:
+            return
+        index = header.index(column_name)
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error:
+                if stats is not None:
+                    stats.bad_lines += 1
+                continue
+            if stats is not None:
+                stats.rows += 1
+            if len(row) != len(header):
+                if stats is not None:
+                    stats.bad_lines += 1
+                continue
+            yield row[index]
+
+class DeadLetterFile:
+    # csv of the messages that could not be sent (column_name only) - created on the first write
+
+    def __init__(self, path, column_name):
+        self.path = path
+        self.column_name = column_name
+        self._file = None
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def write(self, messages, error=None):
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'w', newline='', encoding='utf-8')
+                self._writer = csv.writer(self._file)
+                self._writer.writerow([self.column_name])
+            self._writer.writerows([message] for message in messages)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
 
-def send_messages_from_csv(file_path):
-    # Create a producer client to send messages to the Event Hub
-    producer = EventHubProducerClient.from_connection_string(
-        connection_str,
-        eventhub_name=eventhub_name
-    )
-
-    # Read messages from the CSV file
-    messages = read_messages_from_csv(file_path,column_name)
 
-    # Create a batch to hold messages
-    event_data_batch = producer.create_batch()
+def encode_decode_message(message):
+    # Decode the export's escapes (`\r` segment separators, `\\`) - messages without a backslash are returned
+    # as-is; non-latin-1 characters pass through as \u escapes so they are not mangled by unicode_escape
+    if '\\' not in message:
+        return message
+    return message.encode('latin-1', 'backslashreplace').decode('unicode_escape')
+
+
+def send_messages(producer, messages, send_workers=SEND_WORKERS, stats=None, routing_field=ROUTING_FIELD,
+                  controller=None, dead_letter=None):
+    # pack messages into EventDataBatches (up to the size limit), one open batch per partition, and send them
+    # send_workers at a time - batches of a partition are sent one at a time, in order - returns stats (LoadStats)
+    # - routing_field: messages are routed to the partition of their value of this field (partition_for_key),
+    #   so all events of a visit/patient reach one partition in csv order; round-robin without it (unrouted)
+    # - controller (IOController): sends adapt to server-busy throttling and are retried; a batch still throttled
+    #   after the retries is passed to dead_letter(messages, error) (as read from the csv) and counted, instead
+    #   of failing the load - as is a message too large for a batch of its own
+    stats = stats or LoadStats()
+    controller = controller or IOController('eventhubs')
+    plan = routing_path(routing_field) if routing_field else None
+    partition_ids = producer.get_partition_ids()
+    sender = OrderedLanes(send_workers, send_workers * 2)
+    stats_lock = threading.Lock()
+    batches = {}
+    next_partition = 0
+
+    def send(batch, events, size, raw_messages):
+        try:
+            controller.call(producer.send_batch, batch)
+        except DeadLetterError as e:
+            logging.error(f"{events} events dead-lettered - {str(e)}")
+            with stats_lock:
+                stats.dead_lettered += events
+            if dead_letter is not None:
+                dead_letter(raw_messages, e.error)
+            return
+        with stats_lock:
+            stats.batches += 1
+            stats.events += events
+            stats.bytes += size
+
+    def flush(partition_id):
+        batch, events, size, raw_messages = batches.pop(partition_id)
+        if events:
+            sender.submit(partition_id, send, batch, events, size, raw_messages)
+
+    def route(message):
+        nonlocal next_partition
+        key = routing_key(message, plan) if plan is not None else None
+        if key is not None:
+            return partition_for_key(key, partition_ids)
+        stats.unrouted += 1
+        partition_id = partition_ids[next_partition]
+        next_partition = (next_partition + 1) % len(partition_ids)
+        return partition_id
 
     try:
-        # Add messages to the batch
         for message in messages:
             formatted_message = encode_decode_message(message)
-            print(formatted_message)
-
+            if not formatted_message:
+                stats.empty += 1
+                continue
+            event = EventData(formatted_message)
+            event.content_type = 'text/plain'
+
+            partition_id = route(formatted_message)
+            if partition_id not in batches:
+                # [batch, events, bytes, messages as read]
+                batches[partition_id] = [producer.create_batch(partition_id=partition_id), 0, 0, []]
+            entry = batches[partition_id]
             # If adding the message exceeds the batch size, send the batch and start a new one
             try:
-                event_data_batch.add(EventData(formatted_message))
-                event_data_batch.properties = {'Content-Type': 'text/plain'}
-
+                entry[0].add(event)
             except ValueError:
-                producer.send_batch(event_data_batch)
-                event_data_batch = producer.create_batch()
-                event_data_batch.add(EventData(formatted_message))
-                
-        
-        # Send the last batch if it has any messages
-        if len(event_data_batch) > 0:
-            producer.send_batch(event_data_batch)
-        
-        print("Messages sent successfully.")
-    except Exception as e:
-        print(f"An error occurred: {e}")
+                if entry[1]:
+                    flush(partition_id)
+                    batches[partition_id] = entry = [producer.create_batch(partition_id=partition_id), 0, 0, []]
+                try:
+                    entry[0].add(event)
+                except ValueError as e:
+                    # larger than an empty batch - no send can take it, dead-lettered instead of failing the load
+                    logging.error(f"event of {len(formatted_message)} characters dead-lettered - {str(e)}")
+                    with stats_lock:
+                        stats.dead_lettered += 1
+                    if dead_letter is not None:
+                        dead_letter([message], e)
+                    continue
+            entry[1] += 1
+            entry[2] += len(formatted_message)
+            entry[3].append(message)
+
+        # Send the last batch of each partition
+        for partition_id in list(batches):
+            flush(partition_id)
+        sender.wait()
+    finally:
+        sender.shutdown()
+    return stats
+
+
+def send_messages_from_csv(file_path, column_name, producer=None, send_workers=SEND_WORKERS,
+                           routing_field=ROUTING_FIELD, dead_letter_path=None):
+    # stream column_name of the csv to the event hub - returns LoadStats.summary()
+    # (producer: EventHubProducerClient to use, created from connection_str/eventhub_name if not given)
+    # - messages still throttled after the retries (or larger than a batch) are written to dead_letter_path
+    #   (default <file_path>.deadletter.csv, same column) - load that file again to resend them
+    own_producer = producer is None
+    if own_producer:
+        # sends go through an IOController - the SDK retries only once so its retries do not stack with it
+        producer = EventHubProducerClient.from_connection_string(
+            connection_str,
+            eventhub_name=eventhub_name,
+            retry_total=SDK_RETRY_TOTAL
+        )
+
+    stats = LoadStats()
+    dead_letters = DeadLetterFile(dead_letter_path or f"{file_path}{DEAD_LETTER_SUFFIX}", column_name)
+    try:
+        messages = read_messages_from_csv(file_path, column_name, stats)
+        send_messages(producer, messages, send_workers, stats, routing_field, dead_letter=dead_letters.write)
     finally:
+        dead_letters.close()
         # Close the producer
-        producer.close()
-
-
-
+        if own_producer:
+            producer.close()
+    return stats.summary()
 
 
 if __name__ == "__main__":
     column_name = 'dataset'
     file_path = './test-adf-1.csv'  # Replace with the path to CSV file
-    read_messages_from_csv(file_path,column_name)
-    send_messages_from_csv(file_path)
- 
+    print(json.dumps(send_messages_from_csv(file_path, column_name)))
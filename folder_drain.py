@@ -0,0 +1,160 @@
+import time
+import logging
+import threading
+from hashlib import sha256
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+# ---
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceNotFoundError
+# ---
+from io_throttle import DeadLetterError
+
+# Capture files picked up by a drain
+CAPTURE_FILE_SUFFIX = '.avro'
+
+# Blob lease held on a capture file while it is processed - renewed every LEASE_RENEW_FRACTION of its duration
+DEFAULT_LEASE_DURATION = 60
+LEASE_RENEW_FRACTION = 0.5
+
+DEFAULT_DRAIN_WORKERS = 4
+
+DRAIN_DONE = 'done'
+DRAIN_FAILED = 'failed'
+DRAIN_LEASED = 'leased'
+
+
+def shard_of(name, shard_count):
+    # stable shard of a blob name (sha256 - the same on every instance, unlike hash())
+    return int.from_bytes(sha256(name.encode('utf-8')).digest()[:8], 'big') % shard_count
+
+
+def list_capture_files(container_client, folder, prefix='', shard_index=0, shard_count=1):
+    # capture file names (relative to folder) under folder/prefix that fall in shard shard_index of shard_count
+    # - oldest first (capture names sort by time)
+    start = f"{folder}/{prefix}" if prefix else f"{folder}/"
+    names = []
+    for blob in container_client.list_blobs(name_starts_with=start):
+        name = blob.name[len(folder) + 1:]
+        if name.endswith(CAPTURE_FILE_SUFFIX) and shard_of(name, shard_count) == shard_index:
+            names.append(name)
+    return sorted(names)
+
+
+class LeaseLostError(Exception):
+    # the blob lease could not be renewed - another instance may hold the file now, it is left in place
+    pass
+
+
+class HeldLease:
+    # blob lease on a capture file, renewed in the background until released
+    # - pass .lease to calls on the blob that need it (delete)
+    # - controller: IOController the renewals go through (a throttled renewal is retried, not given up)
+    # - lost: error of the renewal that failed - check() raises LeaseLostError once it is set
+
+    def __init__(self, lease, duration=DEFAULT_LEASE_DURATION, controller=None):
+        self.lease = lease
+        self.lost = None
+        self._controller = controller
+        self._stopped = threading.Event()
+        self._renewer = threading.Thread(
+            target=self._renew, args=(max(1.0, duration * LEASE_RENEW_FRACTION),), name='blob-lease', daemon=True
+        )
+        self._renewer.start()
+
+    @classmethod
+    def acquire(cls, blob_client, duration=DEFAULT_LEASE_DURATION, controller=None):
+        # HeldLease, or None if another instance holds a lease on the blob (or it is gone - already archived)
+        try:
+            return cls(blob_client.acquire_lease(lease_duration=duration), duration, controller)
+        except (ResourceExistsError, ResourceNotFoundError):
+            return None
+
+    def release(self):
+        # stop renewing and release - the blob may already be deleted (archived), which also ends the lease
+        self._stopped.set()
+        self._renewer.join()
+        try:
+            self.lease.release()
+        except HttpResponseError:
+            pass
+
+    def check(self):
+        # LeaseLostError if a renewal failed - whatever the lease protects must not be committed (archived)
+        if self.lost is not None:
+            raise LeaseLostError(f"blob lease lost - {self.lost}")
+
+    def _renew(self, interval):
+        while not self._stopped.wait(interval):
+            try:
+                if self._controller is not None:
+                    self._controller.call(self.lease.renew)
+                else:
+                    self.lease.renew()
+            except (HttpResponseError, DeadLetterError) as e:
+                logging.warning(f"lease renewal failed - {type(e).__name__} - {str(e)}")
+                self.lost = f"{type(e).__name__} - {str(e)}"
+                return
+
+
+def drain_folder(container_client, names, process_file, workers=DEFAULT_DRAIN_WORKERS, time_budget=None,
+                 lease_duration=DEFAULT_LEASE_DURATION, folder='', controller=None):
+    # process capture files names (relative to folder) with `workers` threads, each file under a blob lease
+    # - process_file(name, held) -> result dict, held the file's HeldLease (check() it before archiving the file);
+    #   raised errors are reported per file, as is a lease lost while the file was processed
+    # - files leased by another instance (or already archived by it) are skipped
+    # - controller: IOController the lease renewals go through
+    # - time_budget (seconds): no file is started once the budget would be exceeded by the average file time
+    #   seen so far - the ones not started are returned as remaining, for the next call
+    # returns {'done': {name: result}, 'failed': {name: error}, 'leased': [names], 'remaining': [names]}
+    start = time.monotonic()
+    queue = deque(names)
+    lock = threading.Lock()
+    durations = []
+    summary = {DRAIN_DONE: {}, DRAIN_FAILED: {}, DRAIN_LEASED: [], 'remaining': []}
+
+    def out_of_time():
+        if time_budget is None:
+            return False
+        average = sum(durations) / len(durations) if durations else 0.0
+        return time.monotonic() - start + average > time_budget
+
+    def worker():
+        while True:
+            with lock:
+                if not queue:
+                    return
+                if out_of_time():
+                    summary['remaining'].extend(queue)
+                    queue.clear()
+                    return
+                name = queue.popleft()
+
+            blob_client = container_client.get_blob_client(f"{folder}/{name}" if folder else name)
+            held = HeldLease.acquire(blob_client, lease_duration, controller)
+            if held is None:
+                with lock:
+                    summary[DRAIN_LEASED].append(name)
+                continue
+
+            file_start = time.monotonic()
+            try:
+                result = process_file(name, held)
+                held.check()
+                outcome = DRAIN_DONE
+            except Exception as e:
+                logging.error(f"{name} - {type(e).__name__} - {str(e)}")
+                result = {'summary': type(e).__name__, 'detail': str(e)}
+                outcome = DRAIN_FAILED
+            finally:
+                held.release()
+            with lock:
+                durations.append(time.monotonic() - file_start)
+                summary[outcome][name] = result
+
+    workers = max(1, min(workers, len(names)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='drain') as executor:
+        for future in [executor.submit(worker) for _ in range(workers)]:
+            future.result()
+
+    summary['remaining'].sort()
+    return summary
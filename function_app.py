@@ -1,17 +1,26 @@
 import logging
-import json
 import os
+import json
+import time
+import threading
 from io import BytesIO
+from typing import List
 from datetime import datetime, timezone
 from hashlib import sha256
 # ---
 import azure.functions as func
-from azure.identity import ManagedIdentityCredential
-from azure.storage.blob import BlobServiceClient
 # ---
-from fastavro import reader
-from hl7parser.hl7 import HL7Message
-from hl7apy.parser import parse_message
+# fastavro, hl7apy and the storage/identity SDKs are imported by the first request that needs them (or by
+# warm_up) - module load stays cheap for the host's function indexing on cold start
+from hl7_fields import get_extractor, override_version
+from blob_io import open_blob_stream, DEFAULT_CHUNK_SIZE
+from pipeline import process_records
+from dedup_cache import create_dedup_filter
+from pipeline_metrics import (
+    PipelineMetrics, NULL_METRICS, record_worker_metrics, worker_metrics,
+    STAGE_DOWNLOAD, STAGE_AVRO_DECODE, STAGE_VERSION_OVERRIDE, STAGE_HL7_PARSE, STAGE_EXTRACT, STAGE_FAST_EXTRACT,
+    STAGE_ARCHIVE
+)
 
 # Map of Unsupported HL7 Version to Supported Version
 INVALID_VERSION_MAP = {
@@ -26,9 +35,70 @@ INVALID_VERSION_MAP = {
 ARG_FROM_SOURCE_FILE_AVRO = 'from_source_file_avro'
 ARG_INTERFACE_CONFIG = 'interface_config'
 ARG_HL7_CLIENT_CONFIG = 'hl7_client_config'
+# folder drain (instead of from_source_file_avro) - {'prefix', 'shard_index', 'shard_count', 'time_budget_seconds'}
+ARG_FROM_SOURCE_DRAIN = 'from_source_drain'
 
 # Globals/Constants
 LOG_MESSAGE_CD_OK = 'COMPLETED'
+PARSE_MODE_FAST = 'fast'
+AVRO_READ_MODE_STREAM = 'stream'
+
+# Avro files processed concurrently when a request lists several or drains a folder (interface_config file_workers)
+DEFAULT_FILE_WORKERS = 4
+
+# Folder drain time budget - stays under the ~230s http response limit of the front end load balancer
+DEFAULT_DRAIN_TIME_BUDGET = 200
+
+# Storage I/O throttling - blob calls go through an IOController shared per storage account (adaptive concurrency
+# and rate, throttled calls retried after Retry-After); interface_config io_max_concurrency / io_retries /
+# io_max_delay apply when the account's controller is first created
+DEFAULT_IO_MAX_CONCURRENCY = 32
+
+# Event Hubs trigger (streaming path) - app settings; the trigger is only registered when the event hub is set
+# - HL7_INTERFACE_CONFIG / HL7_CLIENT_CONFIG hold the interface_config / hl7_client_config json
+ENV_EVENT_HUB_NAME = 'HL7_EVENT_HUB_NAME'
+ENV_EVENT_HUB_CONNECTION = 'HL7_EVENT_HUB_CONNECTION'
+ENV_EVENT_HUB_CONSUMER_GROUP = 'HL7_EVENT_HUB_CONSUMER_GROUP'
+ENV_INTERFACE_CONFIG = 'HL7_INTERFACE_CONFIG'
+ENV_HL7_CLIENT_CONFIG = 'HL7_CLIENT_CONFIG'
+EVENT_HUB_STEM_PREFIX = 'eventhub'
+# Event Hubs trigger retry policy - a failed batch is re-run in place (exponential backoff) before the host
+# checkpoints past it; the batch's outputs are overwritten, so a re-run writes the same blobs
+EVENT_HUB_RETRY_STRATEGY = 'exponential_backoff'
+EVENT_HUB_MAX_RETRIES = '5'
+EVENT_HUB_RETRY_MIN_INTERVAL = '00:00:04'
+EVENT_HUB_RETRY_MAX_INTERVAL = '00:05:00'
+_eventhub_config = None
+
+# Metrics exporter (optional) - app setting HL7_METRICS_EXPORTER='prometheus' registers a GET metrics route
+ENV_METRICS_EXPORTER = 'HL7_METRICS_EXPORTER'
+METRICS_EXPORTER_PROMETHEUS = 'prometheus'
+
+# Cold-start warm-up (optional) - app setting HL7_WARMUP:
+#   'background' - deferred imports + hl7apy structure preload on a daemon thread at worker start
+#   'sync'       - same, before the worker finishes loading this module
+ENV_WARMUP = 'HL7_WARMUP'
+WARMUP_BACKGROUND = 'background'
+WARMUP_SYNC = 'sync'
+
+def warm_up(preload=True):
+    # import the modules deferred to the first request and (preload) load hl7apy structures - returns seconds spent
+    start = time.perf_counter()
+    import fastavro
+    import output_sinks
+    import azure_clients
+    import blob_archive
+    import hl7_structures
+    if preload:
+        hl7_structures.preload_structures()
+    elapsed = time.perf_counter() - start
+    logging.info(f"warm-up completed in {elapsed:.3f}s")
+    return elapsed
+
+if os.environ.get(ENV_WARMUP) == WARMUP_SYNC:
+    warm_up()
+elif os.environ.get(ENV_WARMUP) == WARMUP_BACKGROUND:
+    threading.Thread(target=warm_up, name='hl7-warm-up', daemon=True).start()
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
 
@@ -40,35 +110,29 @@ def http_trigger_parsehl7(req: func.HttpRequest, context: func.Context) -> func.
         # 1. read body and inputs from the request
         req_body = req.get_json()
         fsfavro = req_body.get(ARG_FROM_SOURCE_FILE_AVRO)
+        drain = req_body.get(ARG_FROM_SOURCE_DRAIN)
         ic = req_body.get(ARG_INTERFACE_CONFIG)
         hl7cc = req_body.get(ARG_HL7_CLIENT_CONFIG)
 
         # 2. check if inputs are null, raise attributeerror if so
-        if not all([fsfavro, ic, hl7cc]):
+        if not all([fsfavro or drain is not None, ic, hl7cc]):
             raise AttributeError(f"NULL_INPUT - Input Parameter/Value is Null - {ARG_INTERFACE_CONFIG}, {ARG_HL7_CLIENT_CONFIG}")
 
-        # 3. read avro file speficied in interface_config & parse each hl7 message (using managed identity)
-        blob_service_client = BlobServiceClient(account_url=ic.get('from_source_host'), credential=ManagedIdentityCredential())
-        container_client = blob_service_client.get_container_client(ic.get('from_source_container'))
-        avro_file = container_client.get_blob_client(f"{ic.get('from_source_folder')}/{fsfavro}")
-        avro_data = BytesIO(avro_file.download_blob().readall())
-
-        # 4. read avro and process each hl7 message in body
-        avro_reader = reader(avro_data)
-        for record in avro_reader:
-            message = get_message(record.get('Body'), ic, hl7cc, context.function_name)
-
-            # write message/output to parsed/error location
-            out_file_stem = os.path.splitext(os.path.basename(fsfavro))[0]
-            out_file_name = out_file_stem + '_' + message.get('message_uid') + '.json'
-            out_file = container_client.get_blob_client(f"{ic.get('to_source_folder')}/{out_file_name}")          
-            out_file.upload_blob(json.dumps(message), overwrite=True)
-        
-        # 5. move processed avro to capture archive folder
-        archive_avro_file = container_client.get_blob_client(f"{ic.get('from_source_archive_folder')}/{fsfavro}")
-        copy_opr = archive_avro_file.start_copy_from_url(source_url=avro_file.url, requires_sync=True)
-        if copy_opr.get('copy_status') == 'success':
-            avro_file.delete_blob()
+        # 3. read each avro file specified (one name or a list) & parse each hl7 message (using managed identity)
+        # (clients/credentials are cached per account url across invocations; a list of files is processed
+        #  file_workers at a time - one invocation drains a folder instead of one orchestrator call per file)
+        from azure_clients import get_blob_service_client, client_cache_stats
+
+        blob_service_client = get_blob_service_client(ic.get('from_source_host'))
+        container_client = throttled_container_client(blob_service_client, ic)
+        if drain is not None:
+            summary = drain_avro_folder(container_client, drain, ic, hl7cc, context.function_name)
+        elif isinstance(fsfavro, list):
+            results = process_avro_files(container_client, fsfavro, ic, hl7cc, context.function_name)
+        else:
+            results = {fsfavro: process_avro_file(container_client, fsfavro, ic, hl7cc, context.function_name)}
+        logging.info(f"client cache - {client_cache_stats()}")
+        logging.info(f"storage io - {get_io_controller(ic).stats()}")
 
     except (ValueError, AttributeError, TypeError)  as e:
         err_msg = f"INVALID_INPUT - Input Parameter/Value is Invalid - {type(e).__name__} - {str(e)}"
@@ -79,10 +143,276 @@ def http_trigger_parsehl7(req: func.HttpRequest, context: func.Context) -> func.
         logging.error(err_msg)
         return func.HttpResponse(err_msg, status_code=500)
 
+    if drain is not None:
+        # files done/failed/remaining in this shard - callers call again (or scale out shards) while files remain
+        return func.HttpResponse(json.dumps(summary), status_code=500 if summary['files_failed'] else 200,
+                                 mimetype='application/json')
+    if isinstance(fsfavro, list):
+        # per file status - 500 if any file failed (failed files stay in place for the next run)
+        failed = [name for name, result in results.items() if result['status'] != LOG_MESSAGE_CD_OK]
+        if not ic.get('metrics_in_response'):
+            for result in results.values():
+                result.pop('metrics', None)
+        status = f"{LOG_MESSAGE_CD_OK} - Process/Routine/Function Completed Successfully" if not failed else \
+            f"UNKNOWN - Unknown/Undefined Error - {len(failed)} of {len(results)} files failed"
+        return func.HttpResponse(
+            json.dumps({'status': status, 'files': results}), status_code=500 if failed else 200, mimetype='application/json'
+        )
+    if ic.get('metrics_in_response'):
+        return func.HttpResponse(
+            json.dumps({'status': f"{LOG_MESSAGE_CD_OK} - Process/Routine/Function Completed Successfully",
+                        'metrics': results[fsfavro]['metrics']}),
+            status_code=200, mimetype='application/json'
+        )
     return func.HttpResponse(f"{LOG_MESSAGE_CD_OK} - Process/Routine/Function Completed Successfully", status_code=200)
 
-def get_message(hl7_message, ic, hl7cc, function_name):
+def process_avro_file(container_client, fsfavro, ic, hl7cc, function_name, lease=None):
+    # one capture file - archive copy started, read/parse/write every message, archive completed
+    # returns {'status', 'messages', 'blobs', 'archived', 'metrics'}; errors are raised (file stays in place)
+    # - lease: HeldLease on the file (folder drain) - its lease is used for the delete, and the file is not
+    #   archived once the lease was lost (another instance may be processing it)
+    from fastavro import reader
+    from output_sinks import create_sink
+    from blob_archive import ArchiveCopy, DEFAULT_POLL_INTERVAL, DEFAULT_COPY_TIMEOUT, DEFAULT_COPY_ATTEMPTS
+
+    # (per-stage timings/counters collected throughout, logged as a structured summary at the end)
+    metrics = PipelineMetrics()
+    avro_file = container_client.get_blob_client(f"{ic.get('from_source_folder')}/{fsfavro}")
+    archive_avro_file = container_client.get_blob_client(f"{ic.get('from_source_archive_folder')}/{fsfavro}")
+
+    # a. archive - server-side async copy to the archive folder, started now so it runs while the file is
+    #    processed (pinned to the file's current etag, polled to completion/retried in step d)
+    with metrics.timer(STAGE_ARCHIVE):
+        archive = ArchiveCopy.start(
+            avro_file, archive_avro_file, poll_interval=ic.get('archive_poll_interval', DEFAULT_POLL_INTERVAL),
+            timeout=ic.get('archive_copy_timeout', DEFAULT_COPY_TIMEOUT),
+            attempts=ic.get('archive_copy_attempts', DEFAULT_COPY_ATTEMPTS),
+            lease=lease.lease if lease is not None else None
+        )
+
+    try:
+        # b. streaming mode (opt-in via interface_config avro_read_mode) - read avro in chunked blob ranges
+        #    with bounded read-ahead instead of downloading the whole capture file first
+        #    (chunk downloads then happen during avro decode and are timed as part of it)
+        with metrics.timer(STAGE_DOWNLOAD):
+            if ic.get('avro_read_mode') == AVRO_READ_MODE_STREAM:
+                avro_data = open_blob_stream(avro_file, ic.get('avro_chunk_size', DEFAULT_CHUNK_SIZE))
+            else:
+                avro_data = BytesIO(avro_file.download_blob().readall())
+
+        # c. read avro and process each hl7 message in body, write message/output to parsed/error location
+        #    (sink per interface_config output_mode - legacy json file per message, aggregated ndjson, parquet;
+        #     parse_workers/upload_workers run the parse and upload stages concurrently - the parse pool only with
+        #     2+ cores and the full hl7apy parse, see pipeline.process_records)
+        #    (dedup_mode - messages already processed under this config are skipped before parse/upload)
+        extractor = get_extractor(hl7cc)
+        dedup = create_dedup_filter(ic, hl7cc)
+        out_file_stem = os.path.splitext(os.path.basename(fsfavro))[0]
+        sink = create_sink(container_client, ic, out_file_stem, hl7cc)
+        try:
+            avro_reader = metrics.timed_iter(STAGE_AVRO_DECODE, reader(avro_data))
+            written = process_records(
+                avro_reader, get_message, ic, hl7cc, function_name, sink, extractor, dedup, metrics
+            )
+        finally:
+            avro_data.close()
+        if lease is not None:
+            # lease lost while processing - left in place (not archived) for the instance that may hold it now
+            lease.check()
+    except Exception:
+        archive.abort()
+        raise
+    logging.info(f"{fsfavro} - {sink.messages} messages written - {len(written)} aggregated output blobs")
+    if dedup is not None:
+        logging.info(f"{fsfavro} - {dedup.skipped} duplicate messages skipped")
+
+    # d. wait for the archive copy, then delete the processed avro if unchanged (ArchiveError if the copy
+    #    never completes - the file then stays in place and is reprocessed, never silently dropped)
+    with metrics.timer(STAGE_ARCHIVE):
+        archived = archive.complete()
+
+    # e. stage summary - logged, kept in the worker totals and (metrics_in_response) returned to the caller
+    summary = metrics.summary()
+    record_worker_metrics(metrics)
+    logging.info(f"{fsfavro} - metrics - {json.dumps(summary)}")
+    return {
+        'status': LOG_MESSAGE_CD_OK, 'messages': sink.messages, 'blobs': len(written), 'archived': archived,
+        'metrics': summary
+    }
+
+def process_avro_files(container_client, fsfavros, ic, hl7cc, function_name):
+    # several capture files, file_workers at a time (parse pool/upload threads per interface_config are shared
+    # by the files in flight) - {file: result}, a failed file's result is its error instead of raising
+    from concurrent.futures import ThreadPoolExecutor
+
+    def process(fsfavro):
+        try:
+            return process_avro_file(container_client, fsfavro, ic, hl7cc, function_name)
+        except Exception as e:
+            logging.error(f"{fsfavro} - {type(e).__name__} - {str(e)}")
+            return {'status': 'ERROR', 'more_info': {'summary': type(e).__name__, 'detail': str(e)}}
+
+    workers = max(1, min(ic.get('file_workers', DEFAULT_FILE_WORKERS), len(fsfavros)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='avro-file') as executor:
+        return dict(zip(fsfavros, executor.map(process, fsfavros)))
+
+def drain_avro_folder(container_client, drain, ic, hl7cc, function_name):
+    # capture files under from_source_folder/prefix in this shard (sha256 of the name % shard_count), each under a
+    # blob lease (files leased by another instance are skipped), file_workers at a time, no file started past
+    # time_budget_seconds - summary of files done/failed/leased/remaining for the caller to continue or scale out
+    from folder_drain import list_capture_files, drain_folder
+
+    start = time.perf_counter()
+    shard_index, shard_count = drain.get('shard_index', 0), drain.get('shard_count', 1)
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"shard_index {shard_index} not in 0..{shard_count - 1}")
+    folder = ic.get('from_source_folder')
+    names = list_capture_files(container_client, folder, drain.get('prefix', ''), shard_index, shard_count)
+
+    def process(fsfavro, held):
+        result = process_avro_file(container_client, fsfavro, ic, hl7cc, function_name, held)
+        if not ic.get('metrics_in_response'):
+            result.pop('metrics', None)
+        return result
+
+    drained = drain_folder(
+        container_client, names, process, workers=ic.get('file_workers', DEFAULT_FILE_WORKERS),
+        time_budget=drain.get('time_budget_seconds', DEFAULT_DRAIN_TIME_BUDGET), folder=folder,
+        controller=get_io_controller(ic)
+    )
+    compaction = None
+    if ic.get('output_index'):
+        # merge the l0 index segments this drain (and earlier ones) wrote - skipped below the threshold, or
+        # when another instance holds the compaction lease
+        from output_index import compact, index_folder, DEFAULT_COMPACT_MIN_SEGMENTS
+        try:
+            compaction = compact(container_client, index_folder(ic),
+                                 ic.get('output_index_compact_min_segments', DEFAULT_COMPACT_MIN_SEGMENTS))
+        except Exception as e:
+            logging.error(f"{index_folder(ic)} - compaction - {type(e).__name__} - {str(e)}")
+            compaction = {'status': 'ERROR', 'detail': f"{type(e).__name__} - {str(e)}"}
+    summary = {
+        'status': LOG_MESSAGE_CD_OK if not drained['failed'] else 'ERROR',
+        'shard': f"{shard_index}/{shard_count}",
+        'files_listed': len(names),
+        'files_done': len(drained['done']),
+        'files_failed': len(drained['failed']),
+        'files_leased': len(drained['leased']),
+        'files_remaining': len(drained['remaining']),
+        'messages': sum(result['messages'] for result in drained['done'].values()),
+        'elapsed_s': round(time.perf_counter() - start, 3),
+        'files': drained
+    }
+    if compaction is not None:
+        summary['index_compaction'] = compaction
+    totals = {key: value for key, value in summary.items() if key != 'files'}
+    logging.info(f"drain {folder}/{drain.get('prefix', '')} - {json.dumps(totals)}")
+    return summary
+
+if os.environ.get(ENV_METRICS_EXPORTER) == METRICS_EXPORTER_PROMETHEUS:
+    @app.route(route='metrics', methods=['GET'])
+    def http_trigger_metrics(req: func.HttpRequest) -> func.HttpResponse:
+        # prometheus text exposition of this worker's stage timings/counters since start
+        return func.HttpResponse(worker_metrics().to_prometheus(), status_code=200, mimetype='text/plain; version=0.0.4')
+
+if os.environ.get(ENV_EVENT_HUB_NAME):
+    @app.retry(
+        strategy=EVENT_HUB_RETRY_STRATEGY, max_retry_count=EVENT_HUB_MAX_RETRIES,
+        minimum_interval=EVENT_HUB_RETRY_MIN_INTERVAL, maximum_interval=EVENT_HUB_RETRY_MAX_INTERVAL
+    )
+    @app.event_hub_message_trigger(
+        arg_name='events', event_hub_name=f"%{ENV_EVENT_HUB_NAME}%", connection=ENV_EVENT_HUB_CONNECTION,
+        cardinality=func.Cardinality.MANY,
+        consumer_group=f"%{ENV_EVENT_HUB_CONSUMER_GROUP}%" if os.environ.get(ENV_EVENT_HUB_CONSUMER_GROUP) else '$Default'
+    )
+    def eventhub_trigger_parsehl7(events: List[func.EventHubEvent], context: func.Context):
+        # streaming path - parse event batches as they arrive (the http/avro path stays for backfill)
+        # errors are raised so the batch is retried per the retry policy above (EVENT_HUB_MAX_RETRIES); once
+        # the retries are exhausted the host checkpoints past the batch - the error is logged with its offsets
+        from azure_clients import get_blob_service_client
+
+        ic, hl7cc = get_eventhub_config()
+        blob_service_client = get_blob_service_client(ic.get('from_source_host'))
+        container_client = throttled_container_client(blob_service_client, ic)
+        try:
+            process_event_batch(events, ic, hl7cc, context.function_name, container_client)
+        except Exception as e:
+            retry_count = getattr(getattr(context, 'retry_context', None), 'retry_count', 0)
+            logging.error(f"{event_batch_stem(events)} - {len(events)} events failed (retry {retry_count} of "
+                          f"{EVENT_HUB_MAX_RETRIES}) - {type(e).__name__} - {e}")
+            raise
+
+def get_io_controller(ic):
+    # shared IOController for the interface's storage account
+    from io_throttle import get_controller, DEFAULT_RETRIES, DEFAULT_MAX_DELAY
+
+    return get_controller(
+        f"blob:{ic.get('from_source_host')}", max_concurrency=ic.get('io_max_concurrency', DEFAULT_IO_MAX_CONCURRENCY),
+        retries=ic.get('io_retries', DEFAULT_RETRIES), max_delay=ic.get('io_max_delay', DEFAULT_MAX_DELAY)
+    )
+
+def throttled_container_client(blob_service_client, ic):
+    # the interface's container client, with every blob call going through the account's IOController
+    # (ServerBusy/429/503 are retried instead of failing the avro file or event batch)
+    from io_throttle import ThrottledClient
+
+    container_client = blob_service_client.get_container_client(ic.get('from_source_container'))
+    return ThrottledClient(container_client, get_io_controller(ic))
+
+def get_eventhub_config():
+    # (interface_config, hl7_client_config) for the event hubs trigger, from app settings (parsed once)
+    global _eventhub_config
+    if _eventhub_config is None:
+        ic = json.loads(os.environ.get(ENV_INTERFACE_CONFIG) or 'null')
+        hl7cc = json.loads(os.environ.get(ENV_HL7_CLIENT_CONFIG) or 'null')
+        if not all([ic, hl7cc]):
+            raise AttributeError(f"NULL_INPUT - App Setting/Value is Null - {ENV_INTERFACE_CONFIG}, {ENV_HL7_CLIENT_CONFIG}")
+        _eventhub_config = (ic, hl7cc)
+    return _eventhub_config
+
+def event_batch_stem(events):
+    # output stem for a batch - partition + first sequence number, so a redelivered batch overwrites its own output
+    first = events[0]
+    partition_id = None
+    try:
+        partition_context = (first.metadata or {}).get('PartitionContext') or {}
+        if isinstance(partition_context, str):
+            partition_context = json.loads(partition_context)
+        partition_id = partition_context.get('PartitionId')
+    except (AttributeError, TypeError, ValueError):
+        pass
+    if partition_id is None:
+        partition_id = sha256(first.get_body()).hexdigest()[:12]
+    return f"{EVENT_HUB_STEM_PREFIX}_{partition_id}_{first.sequence_number or 0:012d}"
+
+def process_event_batch(events, ic, hl7cc, function_name, container_client):
+    # event batch -> get_message -> output sink, same processing/output as the avro path
+    # (event bodies are the bytes capture stores as avro Body) - returns (sink, blob names written)
+    from output_sinks import create_sink
+
+    if not events:
+        return None, []
+
+    metrics = PipelineMetrics()
+    extractor = get_extractor(hl7cc)
+    dedup = create_dedup_filter(ic, hl7cc)
+    stem = event_batch_stem(events)
+    sink = create_sink(container_client, ic, stem, hl7cc)
+    records = ({'Body': event.get_body()} for event in events)
+    written = process_records(records, get_message, ic, hl7cc, function_name, sink, extractor, dedup, metrics)
+
+    logging.info(f"{stem} - {len(events)} events - {sink.messages} messages written - {len(written)} aggregated output blobs")
+    if dedup is not None:
+        logging.info(f"{stem} - {dedup.skipped} duplicate messages skipped")
+    record_worker_metrics(metrics)
+    logging.info(f"{stem} - metrics - {json.dumps(metrics.summary())}")
+    return sink, written
+
+def get_message(hl7_message, ic, hl7cc, function_name, extractor=None, metrics=None):
     # process each hl7_message and return json with parsed values OR error
+    # - extractor: compiled hl7cc field extractor, looked up by config hash if not given
+    # - metrics: PipelineMetrics receiving the version override/parse/extract stage timings
+    metrics = metrics or NULL_METRICS
 
     message_uid = sha256(hl7_message).hexdigest()
     orig_hl7_message = hl7_message.decode('utf-8')
@@ -106,35 +436,33 @@ def get_message(hl7_message, ic, hl7cc, function_name):
     }
 
     try:
-        # check version and override unsupported - use hl7parser
-        pm1 = HL7Message(orig_hl7_message)
-        vid = pm1.msh.version_id
-        str_vid = str(vid[0])
-
-        if str_vid in INVALID_VERSION_MAP:
-            vid.set_attributes(vid.field_map, [INVALID_VERSION_MAP.get(str_vid)])
-            ovrd_hl7_message = '\r'.join(str(pm1).splitlines())
+        if extractor is None:
+            extractor = get_extractor(hl7cc)
+
+        # fast parse mode (opt-in via interface_config parse_mode) - tokenize referenced segments only,
+        # falls back to the full hl7apy parse if any hl7cc path needs structure awareness, or the message
+        # structure puts a referenced segment in a group
+        fast = None
+        if ic.get('parse_mode') == PARSE_MODE_FAST and extractor.fast_plan is not None:
+            with metrics.timer(STAGE_FAST_EXTRACT):
+                fast = extractor.fast_extract(orig_hl7_message, INVALID_VERSION_MAP)
+        if fast is not None:
+            str_vid, fields = fast
         else:
-            ovrd_hl7_message = orig_hl7_message
+            # check version and override unsupported - MSH-12 rewritten in the er7 text
+            with metrics.timer(STAGE_VERSION_OVERRIDE):
+                str_vid, ovrd_hl7_message = override_version(orig_hl7_message, INVALID_VERSION_MAP)
+
+            # parse message using hl7apy, resolve all hl7cc fields in one pass (missing elements resolve to "")
+            from hl7_structures import parse_message
+            with metrics.timer(STAGE_HL7_PARSE):
+                pm2 = parse_message(ovrd_hl7_message)
+            with metrics.timer(STAGE_EXTRACT):
+                fields = extractor.extract(pm2)
 
-        # parse message using hl7apy
-        pm2 = parse_message(ovrd_hl7_message)
         hl7_parsed = {'message_uid': message_uid, 'original_version_id': str_vid}
+        hl7_parsed.update(fields)
 
-        for hl7_key, label in hl7cc.items():
-            hl7_key_parts = hl7_key.split('.')
-            hl7_object = pm2
-            value = ""
-
-            for part in hl7_key_parts:
-                hl7_object = getattr(hl7_object, part, None)
-                if hl7_object is None:
-                    break
-                else:
-                    value = hl7_object.value.strip()
-            
-            hl7_parsed.update({label: value})
-            
         # update return message
         message['hl7_parsed'] = hl7_parsed
 
@@ -0,0 +1,277 @@
+import json
+import re
+from hashlib import sha256
+from datetime import datetime
+
+# Max number of compiled hl7_client_config extractors kept per worker
+MAX_CACHED_EXTRACTORS = 64
+
+# Cache of compiled extractors - key: config hash, value: FieldExtractor
+_extractors = {}
+
+# hl7cc path part naming a segment (msh, pv1, zpv, ...)
+_SEGMENT_PART = re.compile(r'^[a-z][a-z0-9]{2}$')
+
+# HL7 DTM/TS value - YYYY[MM[DD[HH[MM[SS[.S...]]]]]][+/-ZZZZ]
+_HL7_DTM = re.compile(r'^(\d{4})(\d{2})?(\d{2})?(\d{2})?(\d{2})?(\d{2})?(?:\.(\d{1,4}))?(?:[+-]\d{4})?$')
+
+
+def config_hash(hl7cc):
+    # stable hash of an hl7_client_config - key order matters (output label order follows it)
+    return sha256(json.dumps(list(hl7cc.items()), separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+class FieldExtractor:
+    # compiled form of an hl7_client_config ({'pv1.pv1_3.pv1_3_1': 'point_of_care_cd', ...})
+    # - key paths are split once and merged into a tree keyed by segment/field/component,
+    #   so each hl7apy element is looked up once per message no matter how many labels share it
+
+    def __init__(self, hl7cc):
+        self.config_hash = config_hash(hl7cc)
+        self.labels = tuple(hl7cc.values())
+        self.paths = tuple(tuple(hl7_key.split('.')) for hl7_key in hl7cc)
+
+        # tree node: [children {part: node}, label slots resolved at this node]
+        self._tree = [{}, []]
+        for slot, parts in enumerate(self.paths):
+            node = self._tree
+            for part in parts:
+                node = node[0].setdefault(part, [{}, []])
+            node[1].append(slot)
+
+        # fast plan: (segment id, field no, component no or None) per label - None if any path
+        # needs hl7apy structure awareness (groups, datatype names, ...) and can't be resolved positionally
+        fast_plan = [_positional_path(parts) for parts in self.paths]
+        self.fast_plan = None if None in fast_plan else tuple(fast_plan)
+        self.fast_segments = None if self.fast_plan is None else tuple({p[0] for p in self.fast_plan} | {'MSH'})
+        # per (message structure, version): whether every planned segment is top-level there - a segment the
+        # full parse assigns to a group (e.g. PV1 in ORU_R01) does not resolve from the message root
+        self._fast_structures = {}
+
+    def extract(self, hl7_object):
+        # resolve all labels for a parsed hl7apy message - missing elements resolve to ""
+        values = [''] * len(self.labels)
+        self._walk(hl7_object, self._tree[0], values)
+
+        hl7_parsed = {}
+        for label, value in zip(self.labels, values):
+            hl7_parsed[label] = value
+        return hl7_parsed
+
+    def _walk(self, hl7_object, children, values):
+        for part, (sub_children, slots) in children.items():
+            child = getattr(hl7_object, part, None)
+            if child is None:
+                continue
+
+            if slots:
+                value = child.value.strip()
+                for slot in slots:
+                    values[slot] = value
+
+            if sub_children:
+                self._walk(child, sub_children, values)
+
+    def fast_extract(self, hl7_message, version_map):
+        # resolve all labels straight from the er7 text - only segments referenced by the config are tokenized
+        # - rewrites an MSH-12 version found in version_map in place (value of msh_12 reflects the override)
+        # - returns (original version id, {label: value}); segments resolve to their first occurrence
+        # - returns None when the message structure (MSH-9) puts a planned segment in a group, or the message is
+        #   one the full parse may reject (\n segment separators, other than 4 distinct encoding chars) - the
+        #   caller falls back to the full parse so both modes give the same values and errors
+        if not hl7_message.startswith('MSH') or len(hl7_message) < 8:
+            raise ValueError('Invalid message - message must begin with an MSH segment')
+        if '\n' in hl7_message:
+            return None
+
+        field_sep = hl7_message[3]
+        comp_sep, rep_sep = hl7_message[4], hl7_message[5]
+
+        segments = {}
+        for seg_id in self.fast_segments:
+            fields = _find_segment(hl7_message, seg_id, field_sep)
+            if fields is not None and seg_id == 'MSH':
+                # MSH-1 is the field separator itself - shift so fields[n] is MSH-n
+                fields.insert(1, field_sep)
+            segments[seg_id] = fields
+
+        msh = segments['MSH']
+        if len(msh) < 3 or len(msh[2]) != 4 or len(set(msh[2])) != 4:
+            return None
+        vid_components = msh[12].split(comp_sep) if len(msh) > 12 else ['']
+        str_vid = vid_components[0]
+        if str_vid in version_map:
+            vid_components[0] = version_map[str_vid]
+            msh[12] = comp_sep.join(vid_components)
+
+        if not self._fast_structure(msh, comp_sep):
+            return None
+
+        hl7_parsed = {}
+        for label, (seg_id, field_no, comp_no) in zip(self.labels, self.fast_plan):
+            fields = segments[seg_id]
+            value = ''
+            if fields is not None and field_no < len(fields):
+                value = fields[field_no]
+                if field_no > 2 or seg_id != 'MSH':
+                    value = value.split(rep_sep, 1)[0]
+                if comp_no is not None:
+                    components = value.split(comp_sep)
+                    value = components[comp_no - 1] if comp_no <= len(components) else ''
+            hl7_parsed[label] = value.strip()
+
+        return str_vid, hl7_parsed
+
+
+    def _fast_structure(self, msh, comp_sep):
+        # message structure/version resolved as hl7apy's get_message_info does
+        message_type = msh[9].strip().split(comp_sep) if len(msh) > 9 else ['']
+        if len(message_type) > 2:
+            structure = message_type[2]
+        elif len(message_type) == 2:
+            structure = f"{message_type[0]}_{message_type[1]}"
+        else:
+            structure = None
+        version = msh[12].strip().split(comp_sep)[0] if len(msh) > 12 else None
+
+        key = (structure, version)
+        eligible = self._fast_structures.get(key)
+        if eligible is None:
+            # hl7apy is only loaded for the structure lookup, once per (structure, version)
+            from hl7_structures import top_level_segments
+            try:
+                top_level = top_level_segments(structure, version)
+                eligible = top_level is None or set(self.fast_segments) <= top_level | {'MSH'}
+            except Exception:
+                # unsupported version, ... - the full parse reports it
+                eligible = False
+            self._fast_structures[key] = eligible
+        return eligible
+
+
+def override_version(hl7_message, version_map):
+    # read MSH-12 straight from the er7 text and, if it is in version_map, rewrite its first component in place
+    # (no parse/re-serialize round trip) - returns (original version id, message to parse)
+    if not hl7_message.startswith('MSH') or len(hl7_message) < 8:
+        raise ValueError('Invalid message - message must begin with an MSH segment')
+
+    field_sep, comp_sep = hl7_message[3], hl7_message[4]
+    msh_end = len(hl7_message)
+    for terminator in ('\r', '\n'):
+        position = hl7_message.find(terminator)
+        if 0 <= position < msh_end:
+            msh_end = position
+
+    # fields[n] is MSH-(n+1) - MSH-1 is the separator itself
+    fields = hl7_message[:msh_end].split(field_sep)
+    if len(fields) < 12:
+        return '', hl7_message
+
+    components = fields[11].split(comp_sep)
+    str_vid = components[0]
+    if str_vid not in version_map:
+        return str_vid, hl7_message
+
+    components[0] = version_map[str_vid]
+    fields[11] = comp_sep.join(components)
+    ovrd_hl7_message = field_sep.join(fields) + hl7_message[msh_end:]
+    return str_vid, '\r'.join(ovrd_hl7_message.splitlines())
+
+
+def routing_path(path):
+    # hl7cc-style path of a routing field ('pv1.pv1_19', 'pid.pid_3.pid_3_1') -> plan for routing_key
+    plan = _positional_path(path.lower().split('.'))
+    if plan is None:
+        raise ValueError(f"Invalid routing field {path} - expected segment.field[.component], e.g. pv1.pv1_19")
+    return plan
+
+
+def routing_key(hl7_message, plan):
+    # value of the routing field straight from the er7 text - only its segment is tokenized
+    # - first repetition; the whole repetition (e.g. PID-3 id^^^authority) unless plan names a component
+    # - None if the message, segment or value is missing
+    if not hl7_message.startswith('MSH') or len(hl7_message) < 8:
+        return None
+    if '\n' in hl7_message:
+        hl7_message = hl7_message.replace('\r\n', '\r').replace('\n', '\r')
+
+    seg_id, field_no, comp_no = plan
+    field_sep, comp_sep, rep_sep = hl7_message[3], hl7_message[4], hl7_message[5]
+    fields = _find_segment(hl7_message, seg_id, field_sep)
+    if fields is None:
+        return None
+    if seg_id == 'MSH':
+        fields.insert(1, field_sep)
+    if field_no >= len(fields):
+        return None
+
+    value = fields[field_no].split(rep_sep, 1)[0]
+    if comp_no is not None:
+        components = value.split(comp_sep)
+        value = components[comp_no - 1] if comp_no <= len(components) else ''
+    return value.strip() or None
+
+
+def _positional_path(parts):
+    # ('pv1', 'pv1_3', 'pv1_3_1') -> ('PV1', 3, 1); ('msh', 'msh_7') -> ('MSH', 7, None); otherwise None
+    seg = parts[0]
+    if not _SEGMENT_PART.match(seg) or len(parts) not in (2, 3):
+        return None
+
+    positions = []
+    for depth, part in enumerate(parts[1:], 1):
+        pieces = part.split('_')
+        if len(pieces) != depth + 1 or pieces[0] != seg or not all(p.isdigit() for p in pieces[1:]):
+            return None
+        if [int(p) for p in pieces[1:-1]] != positions:
+            return None
+        positions.append(int(pieces[-1]))
+
+    if 0 in positions:
+        return None
+    return (seg.upper(), positions[0], positions[1] if len(positions) > 1 else None)
+
+
+def _find_segment(hl7_message, seg_id, field_sep):
+    # split the first seg_id segment into fields, None if the message has no such segment
+    marker = seg_id + field_sep
+    if hl7_message.startswith(marker):
+        start = 0
+    else:
+        start = hl7_message.find('\r' + marker)
+        if start < 0:
+            return None
+        start += 1
+
+    end = hl7_message.find('\r', start)
+    return hl7_message[start:end if end >= 0 else len(hl7_message)].split(field_sep)
+
+
+def get_extractor(hl7cc):
+    # return compiled extractor for hl7_client_config, memoized by config hash across invocations
+    key = config_hash(hl7cc)
+    extractor = _extractors.get(key)
+
+    if extractor is None:
+        if len(_extractors) >= MAX_CACHED_EXTRACTORS:
+            _extractors.pop(next(iter(_extractors)))
+        extractor = FieldExtractor(hl7cc)
+        _extractors[key] = extractor
+
+    return extractor
+
+
+def parse_hl7_dtm(value):
+    # HL7 DTM/TS string (first component) -> naive datetime (wall clock as sent, any UTC offset dropped), None if empty/invalid
+    match = _HL7_DTM.match(value.split('^')[0].strip()) if value else None
+    if match is None:
+        return None
+
+    year, month, day, hour, minute, second, fraction = match.groups()
+    try:
+        return datetime(
+            int(year), int(month or 1), int(day or 1), int(hour or 0), int(minute or 0), int(second or 0),
+            int((fraction or '0').ljust(6, '0'))
+        )
+    except ValueError:
+        return None
@@ -0,0 +1,101 @@
+import time
+import logging
+import threading
+# ---
+import hl7apy
+import hl7apy.core
+import hl7apy.factories
+from hl7apy.parser import parse_message
+from hl7apy.exceptions import InvalidName
+
+# hl7apy versions parsed by the function (after INVALID_VERSION_MAP overrides) and message types seen in our feeds
+PRELOAD_VERSIONS = ('2.3', '2.3.1', '2.4', '2.5', '2.5.1', '2.6', '2.7', '2.8')
+PRELOAD_MESSAGE_TYPES = (
+    'ADT^A01', 'ADT^A02', 'ADT^A03', 'ADT^A04', 'ADT^A08', 'ADT^A11', 'ORU^R01', 'ORM^O01', 'SIU^S12'
+)
+
+# Skeleton message parsed per (version, message type) - walks the same reference/factory paths as real messages
+_SKELETON = "MSH|^~\\&|PRELOAD|PRELOAD|PRELOAD|PRELOAD|20240101000000||{message_type}|PRELOAD|P|{version}\r"
+
+# Memoized hl7apy version libraries - key: version
+_libraries = {}
+_load_library = hl7apy.load_library
+
+# Preloaded (version, message type) - value: hl7apy message structure name, None for generic/unparseable
+_structures = {}
+_lock = threading.Lock()
+
+# Top-level segments per (message structure, version) - see top_level_segments
+_top_level = {}
+
+
+def load_library(version):
+    # hl7apy.load_library, memoized per version - hl7apy calls it for every element it creates
+    # (version check + importlib lookup each time); same return value and errors as the original
+    lib = _libraries.get(version)
+    if lib is None:
+        lib = _load_library(version)
+        _libraries[version] = lib
+    return lib
+
+
+def install_library_cache():
+    # route hl7apy's module-level load_library references (core, factories, reference lookups) to the memoized one
+    for module in (hl7apy, hl7apy.core, hl7apy.factories):
+        module.load_library = load_library
+
+
+# hl7apy is only reached through this module (parse_message is re-exported), so the cache is always in place
+install_library_cache()
+
+
+def preload_structures(versions=PRELOAD_VERSIONS, message_types=PRELOAD_MESSAGE_TYPES):
+    # load the hl7apy libraries and message structures for every (version, message type) once per worker,
+    # so no message pays for the first import/lookup - returns seconds spent
+    start = time.perf_counter()
+    with _lock:
+        for version in versions:
+            load_library(version)
+            for message_type in message_types:
+                if (version, message_type) in _structures:
+                    continue
+                try:
+                    message = parse_message(_SKELETON.format(message_type=message_type, version=version))
+                    _structures[(version, message_type)] = message.name
+                except Exception as e:
+                    logging.debug(f"no hl7apy structure for {message_type} {version} - {type(e).__name__}")
+                    _structures[(version, message_type)] = None
+
+    return time.perf_counter() - start
+
+
+def preloaded_structures():
+    # {(version, message type): message structure name} loaded so far
+    with _lock:
+        return dict(_structures)
+
+
+def top_level_segments(structure, version):
+    # segment ids parse_message puts at the top level of a message for structure (MSH-9.3, else MSH-9.1_MSH-9.2),
+    # the same way it resolves the structure - None for a generic message (no or unknown structure: every
+    # segment stays top-level); errors (unsupported version, ...) are raised as parse_message raises them
+    key = (structure, version)
+    if key in _top_level:
+        return _top_level[key]
+
+    segments = None
+    if structure is not None:
+        try:
+            message = hl7apy.core.Message(name=structure, version=version)
+        except InvalidName:
+            message = None
+        if message is not None:
+            try:
+                reference = message.reference
+            except AttributeError:
+                reference = None
+            if reference is not None:
+                # children: (name, reference, cardinality, 'SEG' | 'GRP')
+                segments = frozenset(child[0] for child in reference[1] if child[3] == 'SEG')
+    _top_level[key] = segments
+    return segments
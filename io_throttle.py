@@ -0,0 +1,351 @@
+import time
+import random
+import logging
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+# ---
+from azure.core.exceptions import HttpResponseError
+
+# Responses/errors that mean the service is throttling - http status codes, storage/event hubs error codes
+THROTTLE_STATUS_CODES = (429, 503)
+THROTTLE_ERROR_CODES = ('ServerBusy', 'OperationTimedOut', 'com.microsoft:server-busy')
+
+# Concurrency limit (AIMD) - calls in flight, +1 per limit unthrottled calls, * DECREASE_FACTOR on throttling
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_MIN_CONCURRENCY = 1
+DECREASE_FACTOR = 0.7
+
+# Rate limit (token bucket) - off until the first throttling, then DECREASE_FACTOR * the rate completed over the
+# last RATE_WINDOW seconds; regains RATE_RECOVERY of that rate per second while unthrottled and is lifted again
+# once it is RATE_HEADROOM times the completed rate (no longer the bottleneck)
+RATE_WINDOW = 1.0
+RATE_RECOVERY = 0.05
+RATE_HEADROOM = 2.0
+MIN_RATE = 1.0
+
+# Retries of a throttled call - delay per attempt: base * 2^attempt with jitter, at least the Retry-After asked for
+DEFAULT_RETRIES = 6
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 30.0
+
+# SDK retries of a client whose calls go through an IOController (blob service client, event hubs producer) -
+# throttling is retried by the controller; the SDK's own policy only covers a dropped connection / 5xx once,
+# quickly, instead of its default 3 retries from 15s (which stacked under every controller attempt)
+SDK_RETRY_TOTAL = 1
+SDK_RETRY_BACKOFF = 1
+
+# Process-wide controllers - key: service endpoint, so what was learned about its limit survives invocations
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+
+class ThrottledError(Exception):
+    # raise from a call to report throttling the service signals without an exception (e.g. a 429 response)
+    # - retry_after: seconds the service asked to wait, None if it did not say
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadLetterError(Exception):
+    # a call was still throttled after all retries - the caller captures its item(s) instead of losing them
+    # (error: the last throttling error)
+
+    def __init__(self, message, error):
+        super().__init__(message)
+        self.error = error
+
+
+def parse_retry_after(value):
+    # Retry-After header (delay seconds or an http date) / x-ms-retry-after-ms -> seconds, None if unparseable
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after_of(headers):
+    # seconds to wait per the response headers, None if none given
+    if not headers:
+        return None
+    retry_after_ms = headers.get('x-ms-retry-after-ms')
+    if retry_after_ms is not None:
+        delay = parse_retry_after(retry_after_ms)
+        return None if delay is None else delay / 1000
+    return parse_retry_after(headers.get('Retry-After'))
+
+
+def throttle_of(error):
+    # (throttled, retry_after seconds or None) for an exception raised by a blob/event hubs/http call
+    if isinstance(error, ThrottledError):
+        return True, error.retry_after
+    if isinstance(error, HttpResponseError):
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None)
+        error_code = getattr(error, 'error_code', None) or (headers or {}).get('x-ms-error-code')
+        if error.status_code in THROTTLE_STATUS_CODES or error_code in THROTTLE_ERROR_CODES:
+            return True, retry_after_of(headers)
+        return False, None
+    # azure.eventhub is only loaded here by callers that use it (not by the blob-only function app)
+    from azure.eventhub.exceptions import EventHubError
+    if isinstance(error, EventHubError):
+        # amqp errors carry the condition in the message (no retry-after)
+        message = str(error)
+        return any(code in message for code in THROTTLE_ERROR_CODES), None
+    return False, None
+
+
+class TokenBucket:
+    # rate limit - acquire() blocks until a token is available; rate None = unlimited
+    # - burst: tokens that can accumulate (default: one second's worth)
+
+    def __init__(self, rate=None, burst=None):
+        self._lock = threading.Lock()
+        self._burst = burst
+        self.rate = None
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self.rate = rate
+            if rate is not None:
+                self._tokens = min(self._tokens, self._capacity())
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                if self.rate is None:
+                    return
+                self._refill()
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def _capacity(self):
+        return self._burst or max(1.0, self.rate)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate is not None:
+            self._tokens = min(self._capacity(), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class IOController:
+    # adaptive limit for the calls to one service endpoint - share one controller between all its callers
+    # - concurrency: AIMD limit on calls in flight (additive increase per unthrottled window, multiplicative
+    #   decrease on throttling - once per throttling episode, not per throttled call in flight)
+    # - rate: token bucket, off until the service first throttles, then adjusted the same way
+    # - throttled calls are retried with jittered exponential backoff, waiting at least the Retry-After the
+    #   service asked for; DeadLetterError once the retries are exhausted. Other errors are raised as they are
+    #   and leave the limits unchanged (a failed call is no sign the service has capacity to spare)
+
+    def __init__(self, name, max_concurrency=DEFAULT_MAX_CONCURRENCY, min_concurrency=DEFAULT_MIN_CONCURRENCY,
+                 retries=DEFAULT_RETRIES, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.limit = float(max_concurrency)
+        self.bucket = TokenBucket()
+        self.in_flight = 0
+        self._rate_step = MIN_RATE
+        self._decreased = 0.0
+        self._completed = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.Condition(self._lock)
+
+        self.calls = 0
+        self.throttled = 0
+        self.dead_lettered = 0
+
+    def call(self, fn, *args, **kwargs):
+        # fn(*args, **kwargs) within the limits, retried while throttled
+        attempt = 0
+        while True:
+            started = self._acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                throttled, retry_after = throttle_of(e)
+                self._release(started, throttled, failed=not throttled)
+                if not throttled:
+                    raise
+                if attempt >= self.retries:
+                    with self._lock:
+                        self.dead_lettered += 1
+                    raise DeadLetterError(f"{self.name} - still throttled after {attempt + 1} attempts - {e}", e)
+                delay = self._delay(attempt, retry_after)
+                logging.warning(f"{self.name} - throttled ({type(e).__name__}), retry {attempt + 1} in {delay:.2f}s "
+                                f"- concurrency {self.limit:.1f}, rate {self.bucket.rate or 0:.1f}/s")
+                attempt += 1
+                time.sleep(delay)
+                continue
+            self._release(started, False)
+            return result
+
+    def wrap(self, fn):
+        # fn with every call going through call()
+        def throttled_fn(*args, **kwargs):
+            return self.call(fn, *args, **kwargs)
+        return throttled_fn
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'concurrency_limit': round(self.limit, 2),
+                'rate_limit': None if self.bucket.rate is None else round(self.bucket.rate, 2),
+                'calls': self.calls,
+                'throttled': self.throttled,
+                'dead_lettered': self.dead_lettered
+            }
+
+    def _acquire(self):
+        with self._slots:
+            self._slots.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        self.bucket.acquire()
+        return time.monotonic()
+
+    def _release(self, started, throttled, failed=False):
+        now = time.monotonic()
+        with self._slots:
+            self.in_flight -= 1
+            self.calls += 1
+            if failed:
+                self._slots.notify_all()
+                return
+            completed = self._completed
+            while completed and completed[0] < now - RATE_WINDOW:
+                completed.popleft()
+            rate = self.bucket.rate
+
+            if throttled:
+                self.throttled += 1
+                # calls started before the last decrease were sent at the old limits - not a new episode
+                if started >= self._decreased:
+                    self._decreased = now
+                    self.limit = max(float(self.min_concurrency), self.limit * DECREASE_FACTOR)
+                    observed = len(completed) / RATE_WINDOW or rate or MIN_RATE
+                    new_rate = max(MIN_RATE, min(observed, rate or observed) * DECREASE_FACTOR)
+                    self._rate_step = max(MIN_RATE, new_rate * RATE_RECOVERY)
+                    self.bucket.set_rate(new_rate)
+            else:
+                completed.append(now)
+                self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+                if rate is not None:
+                    # +_rate_step per second at the current rate; lifted when far above what completes
+                    if rate >= RATE_HEADROOM * len(completed) / RATE_WINDOW + self._rate_step:
+                        self.bucket.set_rate(None)
+                    else:
+                        self.bucket.set_rate(rate + self._rate_step / rate)
+            self._slots.notify_all()
+
+    def _delay(self, attempt, retry_after):
+        backoff = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+        if retry_after is not None:
+            # spread the callers told the same Retry-After so they do not all come back at once
+            return min(self.max_delay, max(backoff, retry_after * random.uniform(1.0, 1.2)))
+        return backoff
+
+
+def get_controller(name, **options):
+    # shared IOController for service endpoint name (options apply when it is first created)
+    with _controllers_lock:
+        controller = _controllers.get(name)
+        if controller is None:
+            controller = IOController(name, **options)
+            _controllers[name] = controller
+        return controller
+
+
+def controller_stats():
+    with _controllers_lock:
+        controllers = list(_controllers.values())
+    return [controller.stats() for controller in controllers]
+
+
+class ThrottledPager:
+    # ItemPaged proxy (list_blobs, ...) - each page request goes through controller.call instead of the first only
+    # (an azure-core page iterator keeps its continuation token until a page arrives, so a throttled page is
+    # requested again from the same token)
+
+    def __init__(self, pager, controller):
+        self._pager = pager
+        self._controller = controller
+
+    def __iter__(self):
+        for page in self.by_page():
+            yield from page
+
+    def by_page(self, continuation_token=None):
+        return ThrottledPageIterator(self._pager.by_page(continuation_token=continuation_token), self._controller)
+
+
+class ThrottledPageIterator:
+    # page iterator proxy - continuation_token passes through
+
+    def __init__(self, pages, controller):
+        self._pages = pages
+        self._controller = controller
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        page = self._controller.call(next, self._pages, None)
+        if page is None:
+            raise StopIteration
+        return page
+
+    def __getattr__(self, name):
+        return getattr(self._pages, name)
+
+
+class ThrottledClient:
+    # proxy of a blob service/container/blob client - its request methods go through controller.call
+    # (clients it hands out are proxied too; attributes - url, blob_name, ... - pass through)
+    # - pagers returned by a call (list_blobs, ...) are proxied so every page request is governed
+    # - download_blob is governed for its first GET (the blob/range up to the client's max_single_get_size,
+    #   32 MiB by default - BlobRangeReader's ranges are 4 MiB); the chunk GETs a StorageStreamDownloader makes
+    #   past that, in readall()/chunks(), are not (its chunk iterator cannot resume a chunk that failed) -
+    #   only the client's own retry policy (SDK_RETRY_TOTAL) covers them
+
+    _CLIENT_FACTORIES = ('get_container_client', 'get_blob_client')
+
+    def __init__(self, client, controller):
+        self._client = client
+        self._controller = controller
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name in self._CLIENT_FACTORIES:
+            return lambda *args, **kwargs: ThrottledClient(attr(*args, **kwargs), self._controller)
+        if callable(attr) and not name.startswith('_'):
+            return self._wrap(attr)
+        return attr
+
+    def _wrap(self, fn):
+        def throttled_fn(*args, **kwargs):
+            result = self._controller.call(fn, *args, **kwargs)
+            if hasattr(result, 'by_page'):
+                return ThrottledPager(result, self._controller)
+            return result
+        return throttled_fn
@@ -1,12 +1,13 @@
 import logging
 import os
 import azure.functions as func
-import requests
-from azure.storage.blob import BlobServiceClient
-from azure.core.exceptions import HttpResponseError
-from azure.identity import ManagedIdentityCredential
  
 def main(req: func.HttpRequest) -> func.HttpResponse:
+    # requests/storage SDK imported on first call, not at worker start (cold start)
+    import requests
+    from azure.core.exceptions import HttpResponseError
+    from azure_clients import get_blob_service_client, client_cache_stats
+ 
     logging.info('HTTP trigger function processed a request.')
  
     # Log the caller's IP address
@@ -26,10 +27,11 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
  
     # Try accessing a blob in Azure Blob Storage
     try:
-        blob_service_client = BlobServiceClient(account_url="https://abc.blob.core.windows.net/", credential=ManagedIdentityCredential())
+        blob_service_client = get_blob_service_client("https://abc.blob.core.windows.net/")
         blob_client = blob_service_client.get_blob_client(container="hl7", blob="abc/cap4527.avro")
         blob_data = blob_client.download_blob().readall()
         logging.info("Blob data read successfully")
+        logging.info(f"client cache - {client_cache_stats()}")
         return func.HttpResponse(f"Blob data read successfully. Function outbound IP: {outbound_ip_info}", status_code=200)
  
     except HttpResponseError as e:
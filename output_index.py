@@ -0,0 +1,405 @@
+import os
+import sys
+import json
+import time
+import heapq
+import logging
+import sqlite3
+import argparse
+import tempfile
+import threading
+from io import BytesIO
+from hashlib import sha256
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+# ---
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+# ---
+from hl7_fields import parse_hl7_dtm
+from folder_drain import HeldLease
+from pipeline_metrics import STAGE_UPLOAD
+
+# Lookup index over the parsed output - one entry per message written:
+#   message_dttm (ISO, so time ranges compare as strings), message_uid, visit_number, message_control_id,
+#   message_type_cd (hl7_client_config labels, read from hl7_parsed), log_message_cd and the output location -
+#   blob + offset/length (ndjson line) or row (parquet), blob alone for json files
+ENTRY_FIELDS = (
+    'message_dttm', 'message_uid', 'visit_number', 'message_control_id', 'message_type_cd', 'log_message_cd',
+    'blob', 'offset', 'length', 'row'
+)
+
+# Index folder (interface_config output_index_folder, default <to_source_folder>_index) - immutable segments,
+# ndjson entries sorted by (message_dttm, message_uid, blob, offset/row):
+#   l0/<output stem>.seg.ndjson         one per avro file/event batch written (rewritten if it is reprocessed)
+#   l1/<first dttm>_<hash>.seg.ndjson   compacted from l0 (and small l1) segments
+INDEX_FOLDER_SUFFIX = '_index'
+SEGMENT_SUFFIX = '.seg.ndjson'
+LEVEL_NEW = 'l0'
+LEVEL_COMPACTED = 'l1'
+COMPACTION_LOCK = 'compaction.lock'
+
+# Compaction - runs once this many l0 segments exist; compacted segments of up to segment_bytes, l1 segments under
+# half of it are merged again
+DEFAULT_COMPACT_MIN_SEGMENTS = 16
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+DEFAULT_COMPACT_WORKERS = 8
+
+# Local sqlite copy used for lookups - segments downloaded in parallel by sync()
+DEFAULT_SYNC_WORKERS = 8
+DEFAULT_LOOKUP_LIMIT = 1000
+
+
+def index_folder(ic):
+    return ic.get('output_index_folder') or f"{ic.get('to_source_folder')}{INDEX_FOLDER_SUFFIX}"
+
+
+def index_entry(message, location):
+    # index entry of a message written at location (sink.last_location)
+    hl7_parsed = message.get('hl7_parsed') or {}
+    message_dttm = parse_hl7_dtm(hl7_parsed.get('message_dttm', ''))
+    location = location or {}
+    return {
+        'message_dttm': message_dttm.isoformat() if message_dttm else '',
+        'message_uid': message.get('message_uid'),
+        'visit_number': hl7_parsed.get('visit_number', ''),
+        'message_control_id': hl7_parsed.get('message_control_id', ''),
+        'message_type_cd': hl7_parsed.get('message_type_cd', ''),
+        'log_message_cd': message.get('log_message_cd'),
+        'blob': location.get('blob'),
+        'offset': location.get('offset'),
+        'length': location.get('length'),
+        'row': location.get('row')
+    }
+
+
+def entry_key(entry):
+    # sort/identity of an entry - a message written twice to one blob (duplicate in the capture) is two entries
+    return (entry['message_dttm'], entry['message_uid'] or '', entry['blob'] or '',
+            entry['offset'] if entry['offset'] is not None else -1, entry['row'] if entry['row'] is not None else -1)
+
+
+def encode_segment(entries):
+    return ''.join(json.dumps(entry, separators=(',', ':')) + '\n' for entry in entries).encode('utf-8')
+
+
+def read_segment(container_client, name):
+    # (entries, etag) of a segment blob
+    blob_client = container_client.get_blob_client(name)
+    downloader = blob_client.download_blob()
+    content = downloader.readall().decode('utf-8')
+    etag = getattr(getattr(downloader, 'properties', None), 'etag', None)
+    return [json.loads(line) for line in content.splitlines() if line], etag
+
+
+def list_segments(container_client, folder, level=None):
+    # segment blobs (BlobProperties) under folder, all levels or one
+    start = f"{folder}/{level}/" if level else f"{folder}/"
+    return [blob for blob in container_client.list_blobs(name_starts_with=start) if blob.name.endswith(SEGMENT_SUFFIX)]
+
+
+class IndexedSink:
+    # output sink wrapper - the wrapped sink's messages are indexed by where it wrote them, and the entries written as
+    # the file's l0 segment once the sink has closed (so the index never points at uncommitted output)
+
+    def __init__(self, sink, container_client, folder, stem):
+        self.sink = sink
+        self.container_client = container_client
+        self.segment_name = f"{folder}/{LEVEL_NEW}/{stem}{SEGMENT_SUFFIX}"
+        self._entries = []
+
+    @property
+    def uploader(self):
+        return self.sink.uploader
+
+    @uploader.setter
+    def uploader(self, uploader):
+        self.sink.uploader = uploader
+
+    @property
+    def metrics(self):
+        return self.sink.metrics
+
+    @metrics.setter
+    def metrics(self, metrics):
+        self.sink.metrics = metrics
+
+    @property
+    def messages(self):
+        return self.sink.messages
+
+    @property
+    def last_location(self):
+        return self.sink.last_location
+
+    def write(self, message):
+        self.sink.write(message)
+        self._entries.append(index_entry(message, self.sink.last_location))
+
+    def close(self):
+        written = self.sink.close()
+        if not self._entries:
+            return written
+
+        # messages the sink moved after writing them (dead-lettered json uploads)
+        relocated = getattr(self.sink, 'relocated', None)
+        if relocated:
+            for entry in self._entries:
+                entry.update(relocated.get(entry['blob'], {}))
+
+        self._entries.sort(key=entry_key)
+        with self.metrics.timer(STAGE_UPLOAD):
+            self.container_client.get_blob_client(self.segment_name).upload_blob(
+                encode_segment(self._entries), overwrite=True
+            )
+        return written + [self.segment_name]
+
+
+def compact(container_client, folder, min_segments=DEFAULT_COMPACT_MIN_SEGMENTS, segment_bytes=DEFAULT_SEGMENT_BYTES,
+            workers=DEFAULT_COMPACT_WORKERS):
+    # merge the l0 segments (and l1 segments under half of segment_bytes) into sorted l1 segments of up to
+    # segment_bytes, then delete the inputs - one compaction per index folder at a time (blob lease on
+    # folder/compaction.lock); an input rewritten meanwhile (file reprocessed) is kept and its old entries are
+    # merged out of the l1 segments again (they point at output that was rewritten too) - returns a summary
+    start = time.perf_counter()
+    new = list_segments(container_client, folder, LEVEL_NEW)
+    if len(new) < min_segments:
+        return {'status': 'skipped', 'segments': len(new)}
+
+    lock_client = container_client.get_blob_client(f"{folder}/{COMPACTION_LOCK}")
+    try:
+        lock_client.upload_blob(b'', overwrite=False)
+    except ResourceExistsError:
+        pass
+    held = HeldLease.acquire(lock_client)
+    if held is None:
+        return {'status': 'locked', 'segments': len(new)}
+
+    try:
+        # newest level first - heapq.merge keeps input order for equal keys, so an l0 entry wins over its l1 copy
+        small = [blob for blob in list_segments(container_client, folder, LEVEL_COMPACTED) if blob.size < segment_bytes // 2]
+        inputs = sorted(new, key=lambda blob: blob.name) + sorted(small, key=lambda blob: blob.name)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            segments = list(executor.map(lambda blob: read_segment(container_client, blob.name), inputs))
+        written, entries = _write_merged(container_client, folder, [segment for segment, _ in segments], segment_bytes)
+
+        # the conditional delete decides which inputs the l1 segments may hold - an input rewritten since it was read
+        # fails it and is kept
+        rewritten = set()
+        for blob, (_, etag) in zip(inputs, segments):
+            if blob.name in written:
+                continue
+            try:
+                container_client.get_blob_client(blob.name).delete_blob(
+                    etag=etag or blob.etag, match_condition=MatchConditions.IfNotModified
+                )
+            except ResourceModifiedError:
+                logging.warning(f"{blob.name} - rewritten during compaction, kept")
+                rewritten.add(blob.name)
+            except ResourceNotFoundError:
+                pass
+
+        if rewritten:
+            # merge again without the rewritten inputs' old entries, then drop the l1 segments that held them
+            stale = written
+            written, entries = _write_merged(
+                container_client, folder,
+                [segment for blob, (segment, _) in zip(inputs, segments) if blob.name not in rewritten], segment_bytes
+            )
+            for name in set(stale) - set(written):
+                try:
+                    container_client.get_blob_client(name).delete_blob()
+                except ResourceNotFoundError:
+                    pass
+    finally:
+        held.release()
+
+    return {
+        'status': 'compacted', 'merged': len(inputs), 'kept': len(rewritten), 'written': written, 'entries': entries,
+        'elapsed_s': round(time.perf_counter() - start, 3)
+    }
+
+
+def _write_merged(container_client, folder, segments, segment_bytes):
+    # entries of segments (sorted entry lists) merged into l1 segments of up to segment_bytes, duplicates dropped -
+    # (names written, entries written)
+    written, entries, chunk, chunk_bytes, previous = [], 0, [], 0, None
+    for entry in heapq.merge(*segments, key=entry_key):
+        key = entry_key(entry)
+        if key == previous:
+            continue
+        previous = key
+        line = encode_segment([entry])
+        if chunk and chunk_bytes + len(line) > segment_bytes:
+            written.append(_write_compacted(container_client, folder, first, b''.join(chunk)))
+            entries += len(chunk)
+            chunk, chunk_bytes = [], 0
+        if not chunk:
+            first = entry['message_dttm']
+        chunk.append(line)
+        chunk_bytes += len(line)
+    if chunk:
+        written.append(_write_compacted(container_client, folder, first, b''.join(chunk)))
+        entries += len(chunk)
+    return written, entries
+
+
+def _write_compacted(container_client, folder, first, data):
+    # l1 segment named by its first message_dttm - content hash keeps a rerun from overwriting another segment
+    first = first.replace(':', '').replace('-', '') or 'undated'
+    name = f"{folder}/{LEVEL_COMPACTED}/{first}_{sha256(data).hexdigest()[:16]}{SEGMENT_SUFFIX}"
+    container_client.get_blob_client(name).upload_blob(data, overwrite=True)
+    return name
+
+
+def default_cache_path(container_client, folder):
+    # one local cache file per (container, index folder)
+    key = sha256(f"{getattr(container_client, 'url', '')}|{folder}".encode('utf-8')).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f"hl7_output_index_{key}.sqlite")
+
+
+class IndexReader:
+    # lookups over an index folder, answered from a local sqlite copy of its segments
+    # - sync() loads segments added/rewritten since the last sync and drops the ones compacted away
+    # - entries are (message_dttm, ...) rows with indexes per lookup key; duplicates (a segment and its
+    #   compacted copy, seen between two syncs) are collapsed in the results
+
+    def __init__(self, container_client, folder, path=None):
+        self.container_client = container_client
+        self.folder = folder
+        self.path = path or default_cache_path(container_client, folder)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS segments (
+                name TEXT PRIMARY KEY,
+                etag TEXT,
+                entries INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS entries (
+                segment TEXT,
+                {', '.join(f'"{field}"' for field in ENTRY_FIELDS)}
+            );
+            CREATE INDEX IF NOT EXISTS entries_segment ON entries (segment);
+            CREATE INDEX IF NOT EXISTS entries_visit ON entries (visit_number, message_dttm);
+            CREATE INDEX IF NOT EXISTS entries_control_id ON entries (message_control_id);
+            CREATE INDEX IF NOT EXISTS entries_type ON entries (message_type_cd, message_dttm);
+            CREATE INDEX IF NOT EXISTS entries_dttm ON entries (message_dttm);
+        """)
+        self._conn.commit()
+
+    def sync(self, workers=DEFAULT_SYNC_WORKERS):
+        # bring the local copy up to date with the index folder - returns counts
+        listed = {blob.name: blob.etag for blob in list_segments(self.container_client, self.folder)}
+        with self._lock:
+            known = dict(self._conn.execute('SELECT name, etag FROM segments'))
+        dropped = [name for name, etag in known.items() if listed.get(name) != etag]
+        added = [name for name, etag in listed.items() if known.get(name) != etag]
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            loaded = list(executor.map(lambda name: read_segment(self.container_client, name), added))
+
+        placeholders = ', '.join('?' for _ in range(len(ENTRY_FIELDS) + 1))
+        with self._lock:
+            for name in dropped:
+                self._conn.execute('DELETE FROM entries WHERE segment = ?', (name,))
+                self._conn.execute('DELETE FROM segments WHERE name = ?', (name,))
+            for name, (entries, etag) in zip(added, loaded):
+                self._conn.executemany(
+                    f"INSERT INTO entries VALUES ({placeholders})",
+                    [(name,) + tuple(entry.get(field) for field in ENTRY_FIELDS) for entry in entries]
+                )
+                self._conn.execute('INSERT INTO segments VALUES (?, ?, ?)', (name, etag or listed[name], len(entries)))
+            self._conn.commit()
+            total = self._conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        return {'segments': len(listed), 'loaded': len(added), 'dropped': len(dropped), 'entries': total}
+
+    def lookup(self, visit_number=None, message_control_id=None, message_type_cd=None, start=None, end=None,
+               limit=DEFAULT_LOOKUP_LIMIT):
+        # entries matching every key given, message_dttm in [start, end) (datetime or ISO string), oldest first
+        conditions, params = [], []
+        for field, value in (('visit_number', visit_number), ('message_control_id', message_control_id),
+                             ('message_type_cd', message_type_cd)):
+            if value is not None:
+                conditions.append(f"{field} = ?")
+                params.append(value)
+        if start is not None:
+            conditions.append('message_dttm >= ?')
+            params.append(start.isoformat() if isinstance(start, datetime) else start)
+        if end is not None:
+            conditions.append('message_dttm < ?')
+            params.append(end.isoformat() if isinstance(end, datetime) else end)
+
+        columns = ', '.join(f'"{field}"' for field in ENTRY_FIELDS)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT DISTINCT {columns} FROM entries {where} ORDER BY message_dttm, message_uid, blob, offset, row LIMIT ?",
+                params + [limit]
+            ).fetchall()
+        return [dict(zip(ENTRY_FIELDS, row)) for row in rows]
+
+    def fetch(self, entry):
+        # the parsed message an entry points at - one ranged read for ndjson lines
+        blob_client = self.container_client.get_blob_client(entry['blob'])
+        if entry.get('offset') is not None:
+            return json.loads(blob_client.download_blob(offset=entry['offset'], length=entry['length']).readall())
+        data = blob_client.download_blob().readall()
+        if entry.get('row') is not None:
+            # pyarrow only for parquet locations
+            import pyarrow.parquet as pq
+            return pq.read_table(BytesIO(data)).slice(entry['row'], 1).to_pylist()[0]
+        return json.loads(data)
+
+    def close(self):
+        self._conn.close()
+
+
+def main():
+    # python output_index.py --account-url <url> --container <name> --index-folder <folder> sync|lookup|compact
+    parser = argparse.ArgumentParser(description='Lookups over the parsed HL7 output index')
+    parser.add_argument('--account-url', required=True)
+    parser.add_argument('--container', required=True)
+    parser.add_argument('--index-folder', required=True)
+    parser.add_argument('--cache', help='local sqlite copy (default: per container/folder in the temp folder)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('sync', help='load new segments into the local copy')
+    lookup = commands.add_parser('lookup', help='sync, then print matching entries as ndjson')
+    lookup.add_argument('--visit-number')
+    lookup.add_argument('--control-id')
+    lookup.add_argument('--type', help='message_type_cd')
+    lookup.add_argument('--start', help='message_dttm from (ISO, inclusive)')
+    lookup.add_argument('--end', help='message_dttm to (ISO, exclusive)')
+    lookup.add_argument('--limit', type=int, default=DEFAULT_LOOKUP_LIMIT)
+    lookup.add_argument('--no-sync', action='store_true', help='query the local copy as it is')
+    lookup.add_argument('--fetch', action='store_true', help='print the parsed messages instead of their entries')
+    compaction = commands.add_parser('compact', help='merge l0 segments')
+    compaction.add_argument('--min-segments', type=int, default=1)
+    compaction.add_argument('--segment-mb', type=int, default=DEFAULT_SEGMENT_BYTES // 2**20)
+    args = parser.parse_args()
+
+    from azure_clients import get_blob_service_client
+    container_client = get_blob_service_client(args.account_url).get_container_client(args.container)
+
+    if args.command == 'compact':
+        print(json.dumps(compact(container_client, args.index_folder, args.min_segments, args.segment_mb * 2**20)))
+        return
+
+    reader = IndexReader(container_client, args.index_folder, args.cache)
+    try:
+        if args.command == 'sync' or not args.no_sync:
+            print(json.dumps(reader.sync()), file=sys.stderr)
+        if args.command == 'lookup':
+            start = time.perf_counter()
+            entries = reader.lookup(args.visit_number, args.control_id, args.type, args.start, args.end, args.limit)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            for entry in entries:
+                print(json.dumps(reader.fetch(entry) if args.fetch else entry, default=str))
+            print(f"{len(entries)} entries in {elapsed_ms:.1f} ms", file=sys.stderr)
+    finally:
+        reader.close()
+
+
+if __name__ == '__main__':
+    main()
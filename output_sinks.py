@@ -0,0 +1,288 @@
+import json
+import threading
+# ---
+from azure.storage.blob import BlobBlock, ContentSettings
+# ---
+from io_throttle import DeadLetterError
+from pipeline_metrics import NULL_METRICS, STAGE_ENCODE, STAGE_UPLOAD
+
+# Output modes - interface_config output_mode
+OUTPUT_MODE_JSON = 'json'                   # legacy - one <stem>_<message_uid>.json blob per message
+OUTPUT_MODE_NDJSON = 'ndjson'               # one <stem>.ndjson block blob per avro file
+OUTPUT_MODE_NDJSON_ROLLING = 'ndjson_rolling'   # <stem>_<part>.ndjson block blobs, rolled by size/count
+OUTPUT_MODE_PARQUET = 'parquet'             # columnar hl7_parsed fields, <stem>.parquet per interface/processing hour
+# several modes can be combined, comma separated (e.g. "ndjson,parquet") - every sink gets every message
+
+# Defaults - staged block size, rolling limits
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+DEFAULT_ROLL_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_ROLL_MAX_MESSAGES = 100000
+
+# Suffix of the sidecar index written next to each ndjson blob
+INDEX_SUFFIX = '.index.ndjson'
+
+# Suffix of the ndjson blob holding json messages whose own upload was still throttled after the retries
+DEAD_LETTER_SUFFIX = '.deadletter.ndjson'
+
+
+def _submit(uploader, fn, *args, **kwargs):
+    # run an upload inline, or on the pipeline's upload pool when the sink has one
+    if uploader is None:
+        fn(*args, **kwargs)
+    else:
+        uploader.submit(fn, *args, **kwargs)
+
+
+def _wait(uploader):
+    if uploader is not None:
+        uploader.wait()
+
+
+class JsonFileSink:
+    # legacy output - upload each message as its own json blob
+    # - a message whose upload is still throttled after the retries (DeadLetterError from a throttled
+    #   container client) is kept and written with the others to <stem>.deadletter.ndjson on close,
+    #   instead of failing the avro file - relocated maps its json blob name to its line there
+
+    def __init__(self, container_client, folder, stem):
+        self.container_client = container_client
+        self.folder = folder
+        self.stem = stem
+        self.messages = 0
+        self.uploader = None
+        self.metrics = NULL_METRICS
+        self.last_location = None
+        self.dead_letters = {}
+        self.relocated = {}
+        self._lock = threading.Lock()
+
+    def write(self, message):
+        out_file_name = self.stem + '_' + message.get('message_uid') + '.json'
+        out_file = self.container_client.get_blob_client(f"{self.folder}/{out_file_name}")
+        with self.metrics.timer(STAGE_ENCODE):
+            data = json.dumps(message)
+        upload = self.metrics.timed(STAGE_UPLOAD, out_file.upload_blob)
+        _submit(self.uploader, self._upload, upload, f"{self.folder}/{out_file_name}", data)
+        self.last_location = {'blob': f"{self.folder}/{out_file_name}"}
+        self.messages += 1
+
+    def close(self):
+        # returns the dead-letter blob name if one was written
+        _wait(self.uploader)
+        if not self.dead_letters:
+            return []
+        dead_letter_name = f"{self.folder}/{self.stem}{DEAD_LETTER_SUFFIX}"
+        lines = []
+        offset = 0
+        for name in sorted(self.dead_letters):
+            line = self.dead_letters[name].encode('utf-8') + b'\n'
+            self.relocated[name] = {'blob': dead_letter_name, 'offset': offset, 'length': len(line)}
+            lines.append(line)
+            offset += len(line)
+        with self.metrics.timer(STAGE_UPLOAD):
+            self.container_client.get_blob_client(dead_letter_name).upload_blob(b''.join(lines), overwrite=True)
+        return [dead_letter_name]
+
+    def _upload(self, upload, name, data):
+        try:
+            upload(data, overwrite=True)
+        except DeadLetterError:
+            with self._lock:
+                self.dead_letters[name] = data
+
+
+class NdjsonBlockSink:
+    # one ndjson block blob - messages are buffered and staged as blocks of ~block_size bytes,
+    # the block list is committed (with a sidecar message_uid index) on close
+    # - nothing is visible until close, so a failed avro file leaves no partial output
+
+    def __init__(self, container_client, folder, stem, block_size=DEFAULT_BLOCK_SIZE):
+        self.blob_name = f"{folder}/{stem}.ndjson"
+        self.index_name = self.blob_name + INDEX_SUFFIX
+        self.block_size = block_size
+        self.blob_client = container_client.get_blob_client(self.blob_name)
+        self.index_client = container_client.get_blob_client(self.index_name)
+        self.uploader = None
+        self.metrics = NULL_METRICS
+        self.last_location = None
+
+        self.messages = 0
+        self.size = 0
+        self._buffer = bytearray()
+        self._blocks = []
+        self._index = []
+
+    def write(self, message):
+        with self.metrics.timer(STAGE_ENCODE):
+            line = json.dumps(message).encode('utf-8') + b'\n'
+        self._index.append({
+            'message_uid': message.get('message_uid'),
+            'line': self.messages,
+            'offset': self.size,
+            'length': len(line)
+        })
+        self._buffer += line
+        self.last_location = {'blob': self.blob_name, 'offset': self.size, 'length': len(line)}
+        self.messages += 1
+        self.size += len(line)
+
+        if len(self._buffer) >= self.block_size:
+            self._stage()
+
+    def close(self):
+        # commit staged blocks and write the sidecar index - returns the blob names written
+        # (nothing is written without messages - e.g. all deduplicated - so earlier output is never replaced)
+        if not self.messages:
+            return []
+        self._stage()
+        _wait(self.uploader)
+        with self.metrics.timer(STAGE_UPLOAD):
+            self.blob_client.commit_block_list(
+                self._blocks, content_settings=ContentSettings(content_type='application/x-ndjson')
+            )
+
+        index = ''.join(json.dumps(dict(entry, blob=self.blob_name)) + '\n' for entry in self._index)
+        with self.metrics.timer(STAGE_UPLOAD):
+            self.index_client.upload_blob(index, overwrite=True)
+        return [self.blob_name, self.index_name]
+
+    def _stage(self):
+        if not self._buffer:
+            return
+        block_id = f"{len(self._blocks):06d}"
+        stage_block = self.metrics.timed(STAGE_UPLOAD, self.blob_client.stage_block)
+        _submit(self.uploader, stage_block, block_id, bytes(self._buffer))
+        self._blocks.append(BlobBlock(block_id=block_id))
+        self._buffer = bytearray()
+
+
+class RollingNdjsonSink:
+    # ndjson output split into parts - a new <stem>_<part>.ndjson is started once the current
+    # part reaches max_bytes or max_messages
+
+    def __init__(self, container_client, folder, stem, block_size=DEFAULT_BLOCK_SIZE,
+                 max_bytes=DEFAULT_ROLL_MAX_BYTES, max_messages=DEFAULT_ROLL_MAX_MESSAGES):
+        self.container_client = container_client
+        self.folder = folder
+        self.stem = stem
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+
+        self.messages = 0
+        self.uploader = None
+        self.metrics = NULL_METRICS
+        self.last_location = None
+        self._parts = 0
+        self._current = None
+        self._written = []
+
+    def write(self, message):
+        if self._current is None:
+            self._current = NdjsonBlockSink(
+                self.container_client, self.folder, f"{self.stem}_{self._parts:05d}", self.block_size
+            )
+            self._current.uploader = self.uploader
+            self._current.metrics = self.metrics
+            self._parts += 1
+
+        self._current.write(message)
+        self.last_location = self._current.last_location
+        self.messages += 1
+
+        if self._current.size >= self.max_bytes or self._current.messages >= self.max_messages:
+            self._written.extend(self._current.close())
+            self._current = None
+
+    def close(self):
+        if self._current is not None:
+            self._written.extend(self._current.close())
+            self._current = None
+        return self._written
+
+
+class TeeSink:
+    # the same messages written to several sinks (output_mode lists more than one mode)
+
+    def __init__(self, sinks):
+        self.sinks = sinks
+        self._uploader = None
+        self._metrics = NULL_METRICS
+
+    @property
+    def uploader(self):
+        return self._uploader
+
+    @uploader.setter
+    def uploader(self, uploader):
+        self._uploader = uploader
+        for sink in self.sinks:
+            sink.uploader = uploader
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @metrics.setter
+    def metrics(self, metrics):
+        self._metrics = metrics
+        for sink in self.sinks:
+            sink.metrics = metrics
+
+    @property
+    def messages(self):
+        return self.sinks[0].messages
+
+    @property
+    def last_location(self):
+        return self.sinks[0].last_location
+
+    def write(self, message):
+        for sink in self.sinks:
+            sink.write(message)
+
+    def close(self):
+        written = []
+        for sink in self.sinks:
+            written.extend(sink.close())
+        return written
+
+
+def _create_sink(container_client, ic, stem, hl7cc, output_mode):
+    folder = ic.get('to_source_folder')
+    block_size = ic.get('output_block_size', DEFAULT_BLOCK_SIZE)
+
+    if output_mode == OUTPUT_MODE_JSON:
+        return JsonFileSink(container_client, folder, stem)
+    if output_mode == OUTPUT_MODE_NDJSON:
+        return NdjsonBlockSink(container_client, folder, stem, block_size)
+    if output_mode == OUTPUT_MODE_NDJSON_ROLLING:
+        return RollingNdjsonSink(
+            container_client, folder, stem, block_size,
+            ic.get('output_max_bytes', DEFAULT_ROLL_MAX_BYTES),
+            ic.get('output_max_messages', DEFAULT_ROLL_MAX_MESSAGES)
+        )
+    if output_mode == OUTPUT_MODE_PARQUET:
+        if not hl7cc:
+            raise ValueError(f"output_mode {OUTPUT_MODE_PARQUET} needs the hl7_client_config for its schema")
+        # pyarrow is only loaded by interfaces that write columnar output
+        from columnar_sink import ParquetSink, RAW_MODE_FILE, DEFAULT_ROW_GROUP_SIZE
+        return ParquetSink(
+            container_client, folder, stem, hl7cc,
+            ic.get('output_raw_mode', RAW_MODE_FILE), block_size,
+            ic.get('output_row_group_size', DEFAULT_ROW_GROUP_SIZE)
+        )
+
+    raise ValueError(f"Unknown output_mode - {output_mode}")
+
+
+def create_sink(container_client, ic, stem, hl7cc=None):
+    # output sink for one avro file, selected by interface_config output_mode (default: legacy json)
+    output_modes = [mode.strip() for mode in ic.get('output_mode', OUTPUT_MODE_JSON).split(',')]
+    sinks = [_create_sink(container_client, ic, stem, hl7cc, mode) for mode in output_modes]
+    sink = sinks[0] if len(sinks) == 1 else TeeSink(sinks)
+    if ic.get('output_index'):
+        # lookup index of the messages by where the (first) sink wrote them
+        from output_index import IndexedSink, index_folder
+        sink = IndexedSink(sink, container_client, index_folder(ic), stem)
+    return sink
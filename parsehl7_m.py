@@ -2,6 +2,7 @@ import json
 from hl7parser.hl7 import HL7Message
 from hl7parser.hl7_data_types import HL7_VersionIdentifier
 from hl7apy.parser import parse_message
+from hl7_fields import get_extractor
 
 INVALID_VERSION_MAP = {'2.1': '2.5.1', '2.7.1': '2.8', '2.9': '2.8', '2.9.1': '2.8'}
 
@@ -58,19 +59,6 @@ if current_version_id in INVALID_VERSION_MAP:
 
 
 pm2 = parse_message(hl7_message)
-client_fields = {}
-
-for hl7key, label in client_config.items():
-  hl7key_parts = hl7key.split('.')  
-  hl7_object = pm2 
-
-  for item in hl7key_parts:
-    hl7_object = getattr(hl7_object, item, None) 
-    if hl7_object is None:
-      break
-    else:
-      value = hl7_object.value.strip()
-
-  client_fields.update({label: value})
+client_fields = get_extractor(client_config).extract(pm2)
 
 print(json.dumps(client_fields))
\ No newline at end of file
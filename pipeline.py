@@ -0,0 +1,296 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from hashlib import sha256
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+# ---
+from pipeline_metrics import PipelineMetrics
+
+# Defaults - messages per parse task, in-flight parse tasks per worker, pending uploads per upload worker
+DEFAULT_PARSE_BATCH_SIZE = 64
+DEFAULT_PARSE_PENDING_PER_WORKER = 2
+DEFAULT_UPLOAD_PENDING_PER_WORKER = 4
+
+# Parallel parse - only where it pays off: with more than one core available, and when the first batch, parsed
+# inline, took at least PARALLEL_PARSE_MIN_SECONDS per message (full hl7apy parse ~15 ms/message; fast mode's
+# ~0.05 ms is less than shipping the message to a pool process and back, so parse_workers then parses inline)
+PARALLEL_PARSE_MIN_SECONDS = 0.001
+
+# Parse pool processes are spawned, not forked - the function worker is threaded (upload threads, host channel)
+# and a forked child can inherit a lock held by another thread
+PARSE_POOL_START_METHOD = 'spawn'
+
+# Parse process pools kept warm across invocations - key: number of workers
+_parse_pools = {}
+_parse_pools_lock = threading.Lock()
+
+
+class BoundedExecutor:
+    # thread pool whose submit() blocks once max_pending tasks are queued/running (backpressure)
+    # - the first task error is re-raised by the next submit() or wait()
+
+    def __init__(self, max_workers, max_pending):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = set()
+        self._lock = threading.Lock()
+        self._error = None
+
+    def submit(self, fn, *args, **kwargs):
+        self._raise_error()
+        self._slots.acquire()
+        future = self._executor.submit(fn, *args, **kwargs)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def wait(self):
+        with self._lock:
+            futures = list(self._futures)
+        wait(futures)
+        self._raise_error()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def _done(self, future):
+        with self._lock:
+            self._futures.discard(future)
+            if self._error is None and not future.cancelled() and future.exception() is not None:
+                self._error = future.exception()
+        self._slots.release()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+
+class OrderedLanes:
+    # thread pool whose tasks are queued per lane - tasks of a lane run one at a time in submission order,
+    # different lanes run concurrently (e.g. batch sends, one lane per event hub partition)
+    # - submit() blocks once max_pending tasks are queued/running (backpressure)
+    # - the first task error is re-raised by the next submit() or wait(); tasks queued behind it are dropped,
+    #   so nothing is sent out of order past a failed send
+
+    def __init__(self, max_workers, max_pending):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lanes = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._error = None
+
+    def submit(self, lane, fn, *args, **kwargs):
+        self._raise_error()
+        self._slots.acquire()
+        with self._lock:
+            queue = self._lanes.get(lane)
+            if queue is not None:
+                # lane is being drained - its worker picks the task up
+                queue.append((fn, args, kwargs))
+                return
+            self._lanes[lane] = deque([(fn, args, kwargs)])
+        self._executor.submit(self._drain, lane)
+
+    def wait(self):
+        with self._idle:
+            self._idle.wait_for(lambda: not self._lanes)
+        self._raise_error()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def _drain(self, lane):
+        # run the lane's tasks until its queue is empty - the running task stays queued until it is done,
+        # so a concurrent submit() appends behind it instead of starting a second worker on the lane
+        while True:
+            with self._lock:
+                queue = self._lanes[lane]
+                if not queue:
+                    del self._lanes[lane]
+                    self._idle.notify_all()
+                    return
+                fn, args, kwargs = queue[0]
+                skip = self._error is not None
+            try:
+                if not skip:
+                    fn(*args, **kwargs)
+            except BaseException as e:
+                with self._lock:
+                    if self._error is None:
+                        self._error = e
+            finally:
+                with self._lock:
+                    queue.popleft()
+                self._slots.release()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+
+def partition_for_key(key, partition_ids):
+    # partition of a routing key - stable across processes and runs (sha256, unlike hash()), so every producer
+    # sends a given key to the same partition as long as the partition count is unchanged
+    digest = sha256(key.encode('utf-8')).digest()
+    return partition_ids[int.from_bytes(digest[:8], 'big') % len(partition_ids)]
+
+
+def get_parse_pool(workers):
+    # process pool for the cpu-bound parse stage - created once per worker count and reused
+    with _parse_pools_lock:
+        pool = _parse_pools.get(workers)
+        if pool is None:
+            pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context(PARSE_POOL_START_METHOD)
+            )
+            _parse_pools[workers] = pool
+        return pool
+
+
+def available_cores():
+    # cores this process may run on (affinity / container cpuset where the platform reports it)
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def discard_parse_pool(workers, pool):
+    # drop a broken pool (a process died - OOM kill, crash in a C extension) so the next caller gets a new one
+    with _parse_pools_lock:
+        if _parse_pools.get(workers) is pool:
+            del _parse_pools[workers]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def parse_batch(parse_fn, bodies, ic, hl7cc, function_name, with_metrics=False):
+    # parse stage task - runs in a pool process, returns (messages in input order, PipelineMetrics or None)
+    # (the compiled extractor is memoized per config hash in the pool process, looked up once per batch)
+    from hl7_fields import get_extractor
+
+    extractor = get_extractor(hl7cc)
+    metrics = PipelineMetrics() if with_metrics else None
+    return [parse_fn(body, ic, hl7cc, function_name, extractor, metrics=metrics) for body in bodies], metrics
+
+
+def iter_batches(records, batch_size):
+    batch = []
+    for record in records:
+        batch.append(record.get('Body'))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def count_records(records, metrics):
+    # records passed through, counting them and their body bytes
+    for record in records:
+        metrics.count('records')
+        metrics.count('bytes_in', len(record.get('Body')))
+        yield record
+
+
+def process_records(records, parse_fn, ic, hl7cc, function_name, sink, extractor=None, dedup=None, metrics=None):
+    # avro records -> parse -> sink, staged per interface_config:
+    # - parse_workers: processes for the hl7 parse (0 = parse inline, the serial path) - only used with more
+    #   than one core and a parse of at least PARALLEL_PARSE_MIN_SECONDS per message (timed on the first
+    #   batch); otherwise messages are parsed inline, which is faster there
+    # - parse_batch_size: messages per parse task, bounded to parse_workers * 2 tasks in flight
+    # - upload_workers: threads for sink uploads (0 = upload inline), upload_max_pending queued uploads
+    # messages reach the sink in avro order, so output is the same as the serial path
+    # - dedup (DedupFilter): messages already processed are dropped before the parse stage, and the
+    #   written ones are recorded once the sink is closed
+    # - metrics (PipelineMetrics): stage timings from parse (incl. pool processes) and sink, message counts
+    #   by log_message_cd
+    parse_workers = ic.get('parse_workers', 0) if available_cores() > 1 else 0
+    upload_workers = ic.get('upload_workers', 0)
+
+    uploader = None
+    if upload_workers > 0:
+        uploader = BoundedExecutor(
+            upload_workers, ic.get('upload_max_pending', upload_workers * DEFAULT_UPLOAD_PENDING_PER_WORKER)
+        )
+        sink.uploader = uploader
+
+    if metrics is not None:
+        records = count_records(records, metrics)
+        sink.metrics = metrics
+    if dedup is not None:
+        records = dedup.filter(records)
+
+    def write(message):
+        sink.write(message)
+        if metrics is not None:
+            metrics.count('messages_' + message['log_message_cd'])
+
+    def write_batch(future):
+        messages, batch_metrics = future.result()
+        if batch_metrics is not None:
+            metrics.merge(batch_metrics)
+        for message in messages:
+            write(message)
+
+    def parse_inline(bodies):
+        # parse + write bodies in this process - returns seconds spent in the parse
+        parse_seconds = 0.0
+        for body in bodies:
+            start = time.perf_counter()
+            message = parse_fn(body, ic, hl7cc, function_name, extractor, metrics=metrics)
+            parse_seconds += time.perf_counter() - start
+            write(message)
+        return parse_seconds
+
+    try:
+        if parse_workers > 0:
+            batches = iter_batches(records, ic.get('parse_batch_size', DEFAULT_PARSE_BATCH_SIZE))
+            first = next(batches, [])
+            if first and parse_inline(first) / len(first) < PARALLEL_PARSE_MIN_SECONDS:
+                for bodies in batches:
+                    parse_inline(bodies)
+            else:
+                pool = get_parse_pool(parse_workers)
+                max_pending = parse_workers * DEFAULT_PARSE_PENDING_PER_WORKER
+                pending = deque()
+
+                try:
+                    for bodies in batches:
+                        if len(pending) >= max_pending:
+                            write_batch(pending[0][1])
+                            pending.popleft()
+                        # queued before the submit, so a batch a broken pool refuses is parsed inline below too
+                        pending.append((bodies, None))
+                        pending[-1] = (bodies, pool.submit(
+                            parse_batch, parse_fn, bodies, ic, hl7cc, function_name, metrics is not None
+                        ))
+
+                    while pending:
+                        write_batch(pending[0][1])
+                        pending.popleft()
+                except BrokenProcessPool as e:
+                    # a pool process died - the pool is dropped (recreated by the next call) and the batches it
+                    # had not returned are parsed inline, in order after the ones already written
+                    logging.warning(f"parse pool of {parse_workers} broken - {e} - parsing the rest inline")
+                    discard_parse_pool(parse_workers, pool)
+                    for bodies, _ in pending:
+                        parse_inline(bodies)
+                    for bodies in batches:
+                        parse_inline(bodies)
+        else:
+            for record in records:
+                write(parse_fn(record.get('Body'), ic, hl7cc, function_name, extractor, metrics=metrics))
+
+        written = sink.close()
+        if dedup is not None:
+            dedup.commit()
+        return written
+    finally:
+        if uploader is not None:
+            uploader.shutdown()
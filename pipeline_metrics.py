@@ -0,0 +1,221 @@
+import time
+import threading
+from bisect import bisect_left
+from collections import Counter
+from contextlib import nullcontext
+
+# Histogram bucket upper bounds (seconds) - 1 us .. ~140 s, 4 buckets per doubling (quantiles within ~19%)
+BUCKET_BOUNDS = tuple(1e-6 * 2 ** (i / 4) for i in range(109))
+
+# Every 4th bound (powers of 2 us) is exported as a prometheus bucket
+PROMETHEUS_BUCKET_STEP = 4
+
+# Quantiles reported per stage
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Stages timed on the hot path
+STAGE_DOWNLOAD = 'download'
+STAGE_AVRO_DECODE = 'avro_decode'
+STAGE_VERSION_OVERRIDE = 'version_override'
+STAGE_HL7_PARSE = 'hl7_parse'
+STAGE_EXTRACT = 'extract'
+STAGE_FAST_EXTRACT = 'fast_extract'
+STAGE_ENCODE = 'encode'
+STAGE_UPLOAD = 'upload'
+STAGE_ARCHIVE = 'archive'
+
+# Worker-wide totals since worker start (merged after each invocation) - served by the prometheus exporter
+_worker_metrics = None
+_worker_lock = threading.Lock()
+
+
+class Histogram:
+    # fixed-bucket latency histogram - O(log buckets) record, mergeable, approximate quantiles
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-th observation (capped at the observed max)
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else self.max, self.max)
+        return self.max
+
+
+class _StageTimer:
+    __slots__ = ('_metrics', '_stage', '_start')
+
+    def __init__(self, metrics, stage):
+        self._metrics = metrics
+        self._stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._metrics.observe(self._stage, time.perf_counter() - self._start)
+        return False
+
+
+class PipelineMetrics:
+    # per-invocation stage timings (histograms) and counters - thread safe (upload threads record into it),
+    # picklable (parse processes return theirs to be merged)
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = Counter()
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'stages': self.stages, 'counters': self.counters, 'started': self.started}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def timer(self, stage):
+        # with metrics.timer(STAGE_...): ...
+        return _StageTimer(self, stage)
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.record(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def timed(self, stage, fn):
+        # fn wrapped so every call is timed under stage
+        def timed_fn(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.observe(stage, time.perf_counter() - start)
+        return timed_fn
+
+    def timed_iter(self, stage, iterable):
+        # yields from iterable, timing each next() - e.g. avro decode (incl. streamed chunk reads)
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(stage, time.perf_counter() - start)
+            yield item
+
+    def merge(self, other):
+        with self._lock:
+            for stage, histogram in other.stages.items():
+                if stage not in self.stages:
+                    self.stages[stage] = Histogram()
+                self.stages[stage].merge(histogram)
+            self.counters.update(other.counters)
+
+    def summary(self):
+        # structured summary - per stage count/total/quantiles/max in ms, counters, wall time
+        with self._lock:
+            stages = {
+                stage: dict(
+                    {'count': h.count, 'total_ms': round(h.sum * 1e3, 3), 'max_ms': round(h.max * 1e3, 3)},
+                    **{f"p{round(q * 100)}_ms": round(h.quantile(q) * 1e3, 3) for q in QUANTILES}
+                )
+                for stage, h in self.stages.items()
+            }
+            return {
+                'elapsed_ms': round((time.perf_counter() - self.started) * 1e3, 3),
+                'stages': stages,
+                'counters': dict(self.counters)
+            }
+
+    def to_prometheus(self, prefix='hl7_pipeline'):
+        # prometheus text exposition - one histogram (seconds) labelled by stage, one counter per name
+        lines = [f"# TYPE {prefix}_stage_seconds histogram"]
+        with self._lock:
+            for stage, h in sorted(self.stages.items()):
+                cumulative = 0
+                for i, (bound, count) in enumerate(zip(BUCKET_BOUNDS, h.counts)):
+                    cumulative += count
+                    if i % PROMETHEUS_BUCKET_STEP == 0:
+                        lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound:.9g}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {h.count}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {h.sum:.9g}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {h.count}')
+
+            for name, value in sorted(self.counters.items()):
+                metric = f"{prefix}_{_metric_name(name)}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+class _NullMetrics:
+    # stand-in when metrics are off - same calls, no work
+
+    def timer(self, stage):
+        return nullcontext()
+
+    def observe(self, stage, seconds):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def timed(self, stage, fn):
+        return fn
+
+    def timed_iter(self, stage, iterable):
+        return iterable
+
+
+NULL_METRICS = _NullMetrics()
+
+
+def _metric_name(name):
+    return ''.join(c if c.isalnum() else '_' for c in name).lower()
+
+
+def record_worker_metrics(metrics):
+    # fold an invocation's metrics into the worker totals
+    global _worker_metrics
+    with _worker_lock:
+        if _worker_metrics is None:
+            _worker_metrics = PipelineMetrics()
+        _worker_metrics.merge(metrics)
+
+
+def worker_metrics():
+    # worker totals since start (empty PipelineMetrics before the first invocation)
+    with _worker_lock:
+        return _worker_metrics if _worker_metrics is not None else PipelineMetrics()
@@ -0,0 +1,130 @@
+import sqlite3
+import threading
+from hashlib import sha256
+from datetime import datetime, timezone
+
+# Blobs listed per page when resuming from a continuation token
+LIST_PAGE_SIZE = 1000
+
+
+class ReplayCheckpoint:
+    # persistent replay progress for blob -> event hub jobs (local sqlite file)
+    # - jobs: per job id, the last blob name completed in listing order + the listing page token to resume from
+    # - sent_hashes: content hashes already sent (across jobs), so restarts and overlapping jobs skip duplicates
+    # blobs complete out of order (concurrent sends), the stored position only advances over a contiguous run
+
+    def __init__(self, path, job_id):
+        self.job_id = job_id
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                last_blob TEXT,
+                continuation_token TEXT,
+                updated_at TEXT
+            );
+            CREATE TABLE IF NOT EXISTS sent_hashes (
+                content_hash TEXT PRIMARY KEY,
+                blob_name TEXT,
+                sent_at TEXT
+            );
+        """)
+
+        row = self._conn.execute(
+            'SELECT last_blob, continuation_token FROM jobs WHERE job_id = ?', (job_id,)
+        ).fetchone()
+        self.last_blob, self.continuation_token = row if row else (None, None)
+
+        self._next_seq = 0
+        self._pending = {}
+        self._claimed = set()
+
+    def track(self, blob_name, page_token):
+        # register a listed blob (in listing order) - returns its sequence number for complete()
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._pending[seq] = [blob_name, page_token, False]
+            return seq
+
+    def claim(self, content_hash):
+        # True if content_hash was not sent before (and is not in flight in this run)
+        with self._lock:
+            if content_hash in self._claimed:
+                return False
+            if self._conn.execute('SELECT 1 FROM sent_hashes WHERE content_hash = ?', (content_hash,)).fetchone():
+                return False
+            self._claimed.add(content_hash)
+            return True
+
+    def complete(self, seqs, content_hashes=()):
+        # mark blobs done (sent, skipped or filtered) and record the content hashes that were sent
+        now = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            for seq in seqs:
+                self._pending[seq][2] = True
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO sent_hashes (content_hash, blob_name, sent_at) VALUES (?, ?, ?)',
+                [(content_hash, blob_name, now) for content_hash, blob_name in content_hashes]
+            )
+
+            # advance the resume position over the contiguous run of completed blobs
+            advanced = False
+            while self._pending:
+                seq = next(iter(self._pending))
+                blob_name, page_token, done = self._pending[seq]
+                if not done:
+                    break
+                del self._pending[seq]
+                self.last_blob, self.continuation_token = blob_name, page_token
+                advanced = True
+
+            if advanced:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO jobs (job_id, last_blob, continuation_token, updated_at) VALUES (?, ?, ?, ?)',
+                    (self.job_id, self.last_blob, self.continuation_token, now)
+                )
+            self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+def content_md5_hash(blob):
+    # hash from the listing's Content-MD5 (no download needed), None if the blob has none
+    content_md5 = getattr(blob.content_settings, 'content_md5', None)
+    return 'md5:' + bytes(content_md5).hex() if content_md5 else None
+
+
+def hl7_message_hash(hl7_message):
+    # hash of an hl7 message (str, as extracted from the blob) - every replay sender records this one in sent_hashes,
+    # whatever it sends the message as, so a message sent by one is skipped by the others: the digest of its
+    # unicode_escape encoding (the event body blob_hubsProducer sends - function_app.get_message's message_uid)
+    return 'sha256:' + sha256(hl7_message.encode('unicode_escape')).hexdigest()
+
+
+def iter_replay_blobs(container_client, prefix, checkpoint=None, modified_after=None, modified_before=None,
+                      content_types=('text/plain',), suffixes=('.txt',)):
+    # list blobs under prefix, resuming after the checkpoint's last completed blob - yields (page token, blob, selected)
+    # - selected is False for blobs outside the last_modified window or content type/suffix filter; the listing
+    #   already carries these properties, so filtered blobs are never downloaded
+    token = checkpoint.continuation_token if checkpoint else None
+    last_blob = checkpoint.last_blob if checkpoint else None
+
+    pager = container_client.list_blobs(name_starts_with=prefix, results_per_page=LIST_PAGE_SIZE).by_page(
+        continuation_token=token
+    )
+    page_token = token
+    for page in pager:
+        for blob in page:
+            if last_blob is not None and blob.name <= last_blob:
+                continue
+
+            selected = (
+                (blob.content_settings.content_type in content_types or blob.name.endswith(suffixes))
+                and (modified_after is None or blob.last_modified >= modified_after)
+                and (modified_before is None or blob.last_modified < modified_before)
+            )
+            yield page_token, blob, selected
+        page_token = pager.continuation_token
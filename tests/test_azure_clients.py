@@ -0,0 +1,41 @@
+import time
+import threading
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+# ---
+from azure_clients import CachedTokenCredential, client_cache_stats
+
+SCOPE = 'https://storage.azure.com/.default'
+
+
+class CountingCredential:
+    def __init__(self):
+        self.fetches = 0
+        self._lock = threading.Lock()
+
+    def get_token(self, *scopes, **kwargs):
+        with self._lock:
+            self.fetches += 1
+            return SimpleNamespace(token=f"token-{self.fetches}", expires_on=time.time() + 3600)
+
+
+def test_token_counters_add_up_under_concurrent_calls():
+    # every get_token is counted once, as a hit or a fetch, from any number of threads and credentials
+    credentials = [CachedTokenCredential(CountingCredential()) for _ in range(4)]
+    before = client_cache_stats()
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(lambda i: credentials[i % 4].get_token(SCOPE), range(4000)))
+    after = client_cache_stats()
+
+    fetches = after['token_fetches'] - before['token_fetches']
+    assert fetches == sum(credential._credential.fetches for credential in credentials)
+    assert fetches + after['token_hits'] - before['token_hits'] == 4000
+
+
+def test_claims_bypass_the_cache():
+    wrapped = CountingCredential()
+    credential = CachedTokenCredential(wrapped)
+    first = credential.get_token(SCOPE)
+    assert credential.get_token(SCOPE) is first
+    assert credential.get_token(SCOPE, claims='{"access_token": {}}') is not first
+    assert wrapped.fetches == 2
@@ -0,0 +1,145 @@
+import os
+import json
+# ---
+import pytest
+from azure_clients import register_blob_service_client
+from blob_archive import ArchiveCopy, ArchiveError
+from benchmarks import bench_archive
+from benchmarks.common import INTERFACE_CONFIG
+from benchmarks.corpus import generate_corpus, write_corpus
+from benchmarks.standins import LocalBlobServiceClient, LocalContainerClient
+
+FILES = 3
+MESSAGES = 90
+
+IC = dict(INTERFACE_CONFIG, output_mode='ndjson', parse_mode='fast', archive_poll_interval=0.01)
+
+
+def source_and_archive(container, data=b'capture'):
+    source = container.get_blob_client('capture/file.avro')
+    source.upload_blob(data)
+    return source, container.get_blob_client('archive/file.avro')
+
+
+def modify(blob_client):
+    with open(blob_client.path, 'ab') as f:
+        f.write(b'appended')
+
+
+def setup(root, host, **options):
+    # capture files in a local account registered as host - returns (container, names)
+    service_client = LocalBlobServiceClient(str(root), **options)
+    register_blob_service_client(host, service_client)
+    container = service_client.get_container_client(IC['from_source_container'])
+    names = write_corpus(os.path.join(container.root, IC['from_source_folder']), generate_corpus(MESSAGES), FILES)
+    return container, names
+
+
+def remaining(container, folder):
+    return sorted(os.listdir(os.path.join(container.root, folder)))
+
+
+def test_copy_is_polled_to_completion_then_the_source_deleted(tmp_path):
+    container = LocalContainerClient(str(tmp_path), copy_polls=3)
+    source, archive_client = source_and_archive(container)
+    archive = ArchiveCopy.start(source, archive_client, poll_interval=0.01)
+    assert archive.status == 'pending'
+
+    assert archive.complete() is True
+    assert not os.path.exists(source.path)
+    with open(archive_client.path, 'rb') as f:
+        assert f.read() == b'capture'
+
+
+def test_failed_copy_is_retried(tmp_path):
+    container = LocalContainerClient(str(tmp_path), copy_polls=2, copy_failures=1)
+    source, archive_client = source_and_archive(container)
+    archive = ArchiveCopy.start(source, archive_client, poll_interval=0.01)
+
+    assert archive.complete() is True
+    assert archive.attempt == 2 and archive.status == 'success'
+    assert not os.path.exists(source.path)
+
+
+def test_copy_that_never_succeeds_leaves_the_source_in_place(tmp_path):
+    container = LocalContainerClient(str(tmp_path), copy_failures=100)
+    source, archive_client = source_and_archive(container)
+    archive = ArchiveCopy.start(source, archive_client, poll_interval=0.01, attempts=3)
+
+    with pytest.raises(ArchiveError):
+        archive.complete()
+    assert archive.attempt == 3
+    assert os.path.exists(source.path)
+
+
+def test_source_modified_after_the_copy_is_not_deleted(tmp_path):
+    # the conditional delete is pinned to the ETag the copy started from
+    container = LocalContainerClient(str(tmp_path))
+    source, archive_client = source_and_archive(container)
+    archive = ArchiveCopy.start(source, archive_client, poll_interval=0.01)
+    modify(source)
+
+    assert archive.complete() is False
+    assert os.path.exists(source.path)
+
+
+def test_source_modified_during_the_copy_is_not_archived(tmp_path):
+    # the pending copy fails, and its restart is refused for the new ETag
+    container = LocalContainerClient(str(tmp_path), copy_polls=3)
+    source, archive_client = source_and_archive(container)
+    archive = ArchiveCopy.start(source, archive_client, poll_interval=0.01)
+    modify(source)
+
+    with pytest.raises(ArchiveError, match='modified since processing started'):
+        archive.complete()
+    assert os.path.exists(source.path)
+    assert not os.path.exists(archive_client.path)
+
+
+def test_abort_stops_a_pending_copy(tmp_path):
+    container = LocalContainerClient(str(tmp_path), copy_polls=100)
+    source, archive_client = source_and_archive(container)
+    archive = ArchiveCopy.start(source, archive_client, poll_interval=0.01)
+    archive.abort()
+
+    assert container.copies[archive_client.blob_name][1] == 'aborted'
+    assert os.path.exists(source.path) and not os.path.exists(archive_client.path)
+
+
+def test_timed_out_copy_is_aborted_and_restarted(tmp_path):
+    container = LocalContainerClient(str(tmp_path), copy_polls=100)
+    source, archive_client = source_and_archive(container)
+    archive = ArchiveCopy.start(source, archive_client, poll_interval=0.01, timeout=0.0, attempts=2)
+    first = archive.copy_id
+
+    with pytest.raises(ArchiveError, match='timed_out'):
+        archive.complete()
+    assert archive.attempt == 2 and archive.copy_id != first
+    assert container.copies[archive_client.blob_name][1] == 'aborted'
+    assert os.path.exists(source.path)
+
+
+@pytest.mark.parametrize('batched', [False, True], ids=['per-file', 'batched'])
+def test_handler_archives_every_file(tmp_path, batched):
+    ic = dict(IC, from_source_host=f"https://archive-test-{batched}")
+    container, names = setup(tmp_path, ic['from_source_host'], copy_polls=3)
+    if batched:
+        responses = [bench_archive.request(dict(ic, file_workers=2), names)]
+    else:
+        responses = [bench_archive.request(ic, name) for name in names]
+
+    assert all(r.status_code == 200 for r in responses), [r.get_body() for r in responses]
+    assert remaining(container, ic['from_source_folder']) == ['manifest.json']
+    assert remaining(container, ic['from_source_archive_folder']) == sorted(names)
+
+
+def test_handler_reports_files_whose_copy_fails(tmp_path):
+    ic = dict(IC, from_source_host='https://archive-test-failures', archive_copy_attempts=2, file_workers=2)
+    container, names = setup(tmp_path, ic['from_source_host'], copy_polls=1, copy_failures=100)
+    response = bench_archive.request(ic, names[:2])
+    result = json.loads(response.get_body())
+
+    assert response.status_code == 500
+    assert all(r['status'] == 'ERROR' and r['more_info']['summary'] == 'ArchiveError'
+               for r in result['files'].values())
+    assert set(names[:2]) <= set(remaining(container, ic['from_source_folder']))
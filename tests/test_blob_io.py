@@ -0,0 +1,64 @@
+import os
+import sys
+import subprocess
+# ---
+import pytest
+from fastavro import reader
+from blob_io import BlobModifiedError, open_blob_stream
+from benchmarks.common import synthetic_adt, write_capture_avro
+from benchmarks.standins import LocalContainerClient
+
+CHUNK_SIZE = 64 * 1024
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def capture(tmp_path):
+    # (container, blob name) of a capture file spanning a few dozen chunks, in small avro blocks
+    os.makedirs(tmp_path / 'capture')
+    bodies = (m.encode('utf-8') for m in synthetic_adt(3000))
+    write_capture_avro(str(tmp_path / 'capture' / 'test.avro'), bodies, sync_interval=16 * 1024)
+    return LocalContainerClient(str(tmp_path)), 'capture/test.avro'
+
+
+def test_stream_reads_the_same_records(capture):
+    container, name = capture
+    with open(os.path.join(container.root, name), 'rb') as f:
+        expected = [record['Body'] for record in reader(f)]
+    with open_blob_stream(container.get_blob_client(name), CHUNK_SIZE) as stream:
+        assert [record['Body'] for record in reader(stream)] == expected
+
+
+def test_blob_rewritten_while_streaming_fails_the_file(capture):
+    # ranges are pinned to the ETag seen at open - a rewrite fails the read instead of mixing two versions
+    container, name = capture
+    blob_client = container.get_blob_client(name)
+    with open_blob_stream(blob_client, CHUNK_SIZE, read_ahead=0) as stream:
+        records = reader(stream)
+        next(records)
+        blob_client.upload_blob(b'rewritten', overwrite=True)
+        with pytest.raises(BlobModifiedError):
+            for _ in records:
+                pass
+
+
+def test_stream_peak_rss_is_bounded_by_the_chunks(tmp_path):
+    # the stream holds about 1 + read_ahead chunks, not the file - measured in a fresh process per mode
+    # (benchmarks.bench_avro_stream consume: records, body bytes, peak RSS growth)
+    os.makedirs(tmp_path / 'capture')
+    path = tmp_path / 'capture' / 'rss.avro'
+    corpus = [m.encode('utf-8') for m in synthetic_adt(5000)]
+    copies = 64 * 2**20 // sum(len(m) for m in corpus)
+    write_capture_avro(str(path), (m for _ in range(copies) for m in corpus))
+    file_size = path.stat().st_size
+
+    results = {}
+    for mode in ('readall', 'stream'):
+        out = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_avro_stream', str(tmp_path), 'capture/rss.avro', mode],
+            check=True, capture_output=True, text=True, cwd=ROOT
+        ).stdout.split()
+        results[mode] = tuple(int(v) for v in out)
+
+    assert results['stream'][:2] == results['readall'][:2] == (copies * len(corpus), copies * sum(map(len, corpus)))
+    assert results['stream'][2] < file_size / 4
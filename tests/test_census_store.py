@@ -0,0 +1,75 @@
+import json
+from datetime import datetime, timedelta
+# ---
+import numpy as np
+from census_stream import StreamingCensus
+from census_store import CensusStore, append_parsed_files
+
+
+def adt(event, visit, poc, dt):
+    return {'hl7_parsed': {'message_type_cd': 'ADT', 'trigger_event_type_cd': event, 'visit_number': visit,
+                           'point_of_care_cd': poc, 'message_dttm': dt.strftime('%Y%m%d%H%M%S')}}
+
+
+def runs():
+    # four runs of parsed output - ICU stays are admitted in the first run and stay open across the others
+    # (no ICU events at all in the last one), MED has events in every run
+    start = datetime(2024, 6, 1)
+    first = [adt('A01', 'V1', 'ICU', start), adt('A01', 'V2', 'ICU', start + timedelta(hours=5)),
+             adt('A01', 'V3', 'MED', start + timedelta(hours=1))]
+    second = [adt('A03', 'V3', 'MED', start + timedelta(hours=30)), adt('A01', 'V4', 'MED', start + timedelta(hours=40))]
+    third = [adt('A03', 'V2', 'ICU', start + timedelta(hours=60)), adt('A01', 'V5', 'MED', start + timedelta(hours=90))]
+    fourth = [adt('A01', 'V6', 'MED', start + timedelta(hours=130))]
+    return [first, second, third, fourth]
+
+
+def write_run(folder, i, messages):
+    path = folder / f"run{i}.ndjson"
+    path.write_text(''.join(json.dumps(message) + '\n' for message in messages))
+    return str(path)
+
+
+def test_store_appends_across_saved_runs(tmp_path):
+    # every run reloads the census state and the store from disk - the result must match one census that
+    # never left memory, flushed at the same points
+    reference_census, reference = StreamingCensus(), CensusStore()
+    for i, messages in enumerate(runs()):
+        path = write_run(tmp_path, i, messages)
+        census, store = append_parsed_files(str(tmp_path / 'store.npz'), str(tmp_path / 'state.json'), [path])
+
+        reference_census.process(f"run{i}.ndjson", messages)
+        rows = list(reference_census.flush())
+        reference.append(rows, until=reference_census.bin_start(reference_census.flushed_bin))
+
+    store = CensusStore.load(str(tmp_path / 'store.npz'))
+    assert store.end == reference.end
+    assert sorted(store.pocs) == sorted(reference.pocs)
+    for poc in store.pocs:
+        hours, counts = store.hourly(poc)
+        reference_hours, reference_counts = reference.hourly(poc)
+        assert np.array_equal(hours, reference_hours) and np.array_equal(counts, reference_counts), poc
+        assert store.range_stats(poc) == reference.range_stats(poc)
+        for period in ('day', 'week', 'month'):
+            rollup, reference_rollup = store.rollup(poc, period), reference.rollup(poc, period)
+            assert all(np.array_equal(rollup[key], reference_rollup[key]) for key in rollup), (poc, period)
+
+    # ICU's open stays carried over every run boundary - two patients until V2's discharge, then V1 alone
+    _, counts = store.hourly('ICU', datetime(2024, 6, 1, 5), datetime(2024, 6, 3, 12))
+    assert counts.min() == 2
+    _, counts = store.hourly('ICU', datetime(2024, 6, 3, 13), store.end)
+    assert len(counts) > 24 and counts.min() == counts.max() == 1
+
+
+def test_store_range_queries_match_dense_counts():
+    rng = np.random.default_rng(3)
+    counts = {f"POC{i}": rng.integers(0, 30, 24 * 100) for i in range(4)}
+    store = CensusStore()
+    for offset in range(0, 24 * 100, 24 * 7):
+        store.extend(datetime(2024, 1, 1) + timedelta(hours=offset),
+                     {poc: values[offset:offset + 24 * 7] for poc, values in counts.items()})
+    for _ in range(200):
+        poc = f"POC{rng.integers(0, 4)}"
+        a = int(rng.integers(0, 24 * 100))
+        b = int(rng.integers(a + 1, 24 * 100 + 1))
+        stats = store.range_stats(poc, datetime(2024, 1, 1) + timedelta(hours=a), datetime(2024, 1, 1) + timedelta(hours=b))
+        assert (stats['sum'], stats['max'], stats['hours']) == (counts[poc][a:b].sum(), counts[poc][a:b].max(), b - a)
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+# ---
+from census_stream import StreamingCensus
+
+
+def adt(event, visit, poc, dttm):
+    return {'hl7_parsed': {'message_type_cd': 'ADT', 'trigger_event_type_cd': event, 'visit_number': visit,
+                           'point_of_care_cd': poc, 'message_dttm': dttm}}
+
+
+FIRST_RUN = [adt('A01', 'V1', 'ICU', '20240601100000'), adt('A01', 'V2', 'MED', '20240601100000'),
+             adt('A03', 'V2', 'MED', '20240601120000')]
+SECOND_RUN = [adt('A01', 'V3', 'MED', '20240601140000')]
+
+
+def run(census, source, messages, until):
+    census.process(source, messages)
+    return list(census.flush(until=until))
+
+
+def test_open_stays_survive_save_and_load(tmp_path):
+    # ICU has an open stay but no events in the second run - it must still be flushed after a reload
+    expected = StreamingCensus()
+    run(expected, 'a.ndjson', FIRST_RUN, datetime(2024, 6, 1, 13))
+    expected_rows = run(expected, 'b.ndjson', SECOND_RUN, datetime(2024, 6, 1, 16))
+
+    census = StreamingCensus()
+    run(census, 'a.ndjson', FIRST_RUN, datetime(2024, 6, 1, 13))
+    census.save(str(tmp_path / 'state.json'))
+    census = StreamingCensus.load(str(tmp_path / 'state.json'))
+    rows = run(census, 'b.ndjson', SECOND_RUN, datetime(2024, 6, 1, 16))
+
+    assert rows == expected_rows
+    assert {poc for poc, _, _ in rows} == {'ICU', 'MED'}
+    assert [(poc, count) for poc, _, count in rows if poc == 'ICU'] == [('ICU', 1)] * 3
+
+
+def test_processed_sources_are_pruned_behind_the_watermark(tmp_path):
+    census = StreamingCensus()
+    start = datetime(2024, 6, 1)
+    for day in range(30):
+        dttm = (start + timedelta(days=day)).strftime('%Y%m%d%H%M%S')
+        census.process(f"{day:02d}.ndjson", [adt('A01', f"V{day}", 'ICU', dttm)])
+        list(census.flush(until=start + timedelta(days=day)))
+    assert census.process('29.ndjson', []) is False
+    assert '00.ndjson' not in census.processed
+    assert len(census.processed) <= 8
+
+    census.save(str(tmp_path / 'state.json'))
+    loaded = StreamingCensus.load(str(tmp_path / 'state.json'))
+    assert loaded.processed == census.processed
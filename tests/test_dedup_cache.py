@@ -0,0 +1,48 @@
+import pytest
+from dedup_cache import DedupCache, DedupFilter, dedup_config_hash
+from benchmarks.common import HL7_CLIENT_CONFIG, INTERFACE_CONFIG, synthetic_adt, capture_records
+
+
+@pytest.mark.parametrize('key, value', [
+    ('parse_mode', 'fast'), ('output_mode', 'ndjson'), ('output_raw_mode', 'column'), ('output_index', True),
+    ('output_index_folder', 'parsed_idx'), ('from_source_host', 'https://other'), ('from_source_container', 'hl7b'),
+])
+def test_output_affecting_keys_change_the_config_hash(key, value):
+    assert dedup_config_hash(dict(INTERFACE_CONFIG, **{key: value}), HL7_CLIENT_CONFIG) != \
+        dedup_config_hash(INTERFACE_CONFIG, HL7_CLIENT_CONFIG)
+
+
+def test_file_layout_keys_keep_the_config_hash():
+    ic = dict(INTERFACE_CONFIG, output_max_messages=10, output_row_group_size=100, upload_workers=8, parse_workers=2)
+    assert dedup_config_hash(ic, HL7_CLIENT_CONFIG) == dedup_config_hash(INTERFACE_CONFIG, HL7_CLIENT_CONFIG)
+
+
+def test_messages_are_processed_again_under_another_parse_mode():
+    cache = DedupCache()
+    bodies = [m.encode('utf-8') for m in synthetic_adt(10)]
+
+    def run(ic):
+        dedup = DedupFilter(cache, ic, HL7_CLIENT_CONFIG)
+        passed = list(dedup.filter(capture_records(bodies)))
+        dedup.commit()
+        return len(passed)
+
+    assert run(INTERFACE_CONFIG) == 10
+    assert run(INTERFACE_CONFIG) == 0
+    assert run(dict(INTERFACE_CONFIG, parse_mode='fast')) == 10
+
+
+@pytest.mark.parametrize('key, value', [('from_source_host', 'https://other'), ('from_source_container', 'hl7b')])
+def test_repointed_output_misses_the_cache(key, value):
+    # output goes to the account/container the capture is read from - a new one has none of it written yet
+    cache = DedupCache()
+    bodies = [m.encode('utf-8') for m in synthetic_adt(5)]
+
+    def run(ic):
+        dedup = DedupFilter(cache, ic, HL7_CLIENT_CONFIG)
+        passed = list(dedup.filter(capture_records(bodies)))
+        dedup.commit()
+        return len(passed)
+
+    assert run(INTERFACE_CONFIG) == 5
+    assert run(dict(INTERFACE_CONFIG, **{key: value})) == 5
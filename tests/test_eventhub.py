@@ -0,0 +1,180 @@
+import os
+import csv
+import sys
+import json
+import subprocess
+# ---
+import pytest
+from eventHubProducer import send_messages, send_messages_from_csv
+from function_app import process_event_batch, get_message, event_batch_stem
+from hl7_fields import get_extractor
+from output_sinks import create_sink
+from pipeline import process_records
+from benchmarks.common import HL7_CLIENT_CONFIG, INTERFACE_CONFIG, synthetic_adt, capture_records
+from benchmarks.bench_routing import JitterProducer, visit_messages
+from benchmarks.eventhub_harness import make_events, read_messages
+from benchmarks.standins import LocalContainerClient, LocalEventHubProducer
+
+BATCH_SIZE = 20
+COLUMN = 'dataset'
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def bodies():
+    return [m.encode('utf-8') for m in synthetic_adt(60)] + [b'not an hl7 message']
+
+
+def run_batches(container_client, ic, bodies):
+    # bodies as event batches of BATCH_SIZE through process_event_batch - blob names written
+    written = []
+    for start in range(0, len(bodies), BATCH_SIZE):
+        _, batch_written = process_event_batch(
+            make_events(bodies[start:start + BATCH_SIZE], start), ic, HL7_CLIENT_CONFIG, 'test', container_client
+        )
+        written.extend(batch_written)
+    return written
+
+
+def test_event_batches_match_the_avro_path(tmp_path, bodies):
+    container_client = LocalContainerClient(str(tmp_path))
+    avro_ic = dict(INTERFACE_CONFIG, to_source_folder='avro', output_mode='ndjson')
+    sink = create_sink(container_client, avro_ic, 'capture', HL7_CLIENT_CONFIG)
+    process_records(capture_records(bodies), get_message, avro_ic, HL7_CLIENT_CONFIG, 'test', sink,
+                    get_extractor(HL7_CLIENT_CONFIG))
+
+    ic = dict(INTERFACE_CONFIG, to_source_folder='eventhub', output_mode='ndjson')
+    written = run_batches(container_client, ic, bodies)
+    assert written and all(name.startswith('eventhub/eventhub_3_') for name in written)
+    assert read_messages(tmp_path / 'eventhub') == read_messages(tmp_path / 'avro')
+
+
+def test_redelivered_batch_is_skipped(tmp_path, bodies):
+    # at-least-once delivery - a batch processed before is dropped by the dedup filter, earlier output stays
+    container_client = LocalContainerClient(str(tmp_path))
+    ic = dict(INTERFACE_CONFIG, to_source_folder='eventhub', output_mode='ndjson', dedup_mode='memory',
+              interface_id='test-redelivery')
+    run_batches(container_client, ic, bodies)
+    before = read_messages(tmp_path / 'eventhub')
+
+    sink, written = process_event_batch(make_events(bodies[:BATCH_SIZE]), ic, HL7_CLIENT_CONFIG, 'test',
+                                        container_client)
+    assert sink.messages == 0 and written == []
+    assert read_messages(tmp_path / 'eventhub') == before
+
+
+def test_empty_batch_writes_nothing(tmp_path):
+    ic = dict(INTERFACE_CONFIG, to_source_folder='eventhub', output_mode='ndjson')
+    assert process_event_batch([], ic, HL7_CLIENT_CONFIG, 'test', LocalContainerClient(str(tmp_path))) == (None, [])
+    assert not (tmp_path / 'eventhub').exists()
+
+
+def test_batch_stem_is_stable_per_partition_and_sequence(bodies):
+    # a retried/redelivered batch writes the same blob names
+    assert event_batch_stem(make_events(bodies[:5], 40)) == 'eventhub_3_000000000040'
+    assert event_batch_stem(make_events(bodies[:5], 40, partition_id='7')) == 'eventhub_7_000000000040'
+
+
+def test_trigger_has_a_retry_policy_and_reraises():
+    # the trigger is only registered with an event hub configured - checked in a fresh interpreter
+    code = """
+import json, function_app
+from types import SimpleNamespace
+from benchmarks.common import HL7_CLIENT_CONFIG, INTERFACE_CONFIG
+from benchmarks.eventhub_harness import make_events
+trigger = next(f for f in function_app.app.get_functions() if f.get_function_name() == 'eventhub_trigger_parsehl7')
+retry = trigger.get_setting('retry_policy').get_dict_repr()
+assert retry['strategy'] == function_app.EVENT_HUB_RETRY_STRATEGY, retry
+assert retry['max_retry_count'] == function_app.EVENT_HUB_MAX_RETRIES, retry
+
+def failing_batch(*args):
+    raise RuntimeError('storage unavailable')
+
+function_app.process_event_batch = failing_batch
+function_app.throttled_container_client = lambda *args: None
+try:
+    trigger.get_user_function()(make_events([b'MSH|^~\\&|A']), SimpleNamespace(function_name='test'))
+except RuntimeError:
+    print('reraised')
+"""
+    env = dict(os.environ, HL7_EVENT_HUB_NAME='hl7', HL7_INTERFACE_CONFIG=json.dumps(INTERFACE_CONFIG),
+               HL7_CLIENT_CONFIG=json.dumps(HL7_CLIENT_CONFIG))
+    out = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True, env=env, cwd=ROOT)
+    assert out.stdout.split() == ['reraised']
+
+
+def write_export(path, messages, bad_rows=()):
+    # csv export of messages (\r escaped as in the hl7 exports) - rows in bad_rows get an extra field
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', COLUMN, 'source'])
+        for i, message in enumerate(messages):
+            writer.writerow([i, message.replace('\r', '\\r'), 'EPIC'] + (['unexpected'] if i in bad_rows else []))
+
+
+def test_csv_loader_skips_and_counts_bad_lines(tmp_path):
+    messages = visit_messages(20, 3)
+    write_export(tmp_path / 'export.csv', messages, bad_rows={4, 17})
+    producer = LocalEventHubProducer(4)
+    summary = send_messages_from_csv(str(tmp_path / 'export.csv'), COLUMN, producer)
+
+    assert summary['rows'] == len(messages) and summary['bad_lines'] == 2
+    assert summary['events'] == producer.events == len(messages) - 2
+    assert not (tmp_path / 'export.csv.deadletter.csv').exists()
+
+
+def test_csv_loader_dead_letters_an_event_larger_than_a_batch(tmp_path):
+    # one message over the batch size limit - written to the dead-letter file, the rest of the load is sent
+    messages = visit_messages(10, 2)
+    oversized = messages[5] + 'NTE|1||' + 'x' * 8192 + '\r'
+    messages[5] = oversized
+    write_export(tmp_path / 'export.csv', messages)
+    producer = LocalEventHubProducer(4, max_size_in_bytes=4096)
+    summary = send_messages_from_csv(str(tmp_path / 'export.csv'), COLUMN, producer)
+
+    assert summary['dead_lettered'] == 1 and summary['events'] == len(messages) - 1
+    with open(tmp_path / 'export.csv.deadletter.csv', newline='', encoding='utf-8') as f:
+        assert list(csv.DictReader(f)) == [{COLUMN: oversized.replace('\r', '\\r')}]
+
+
+@pytest.mark.parametrize('routing_field', [None, 'pv1.pv1_19'], ids=['round-robin', 'routed'])
+def test_csv_loader_keeps_csv_order_per_partition(tmp_path, routing_field):
+    # sends finish out of submission order (jittered latency, 4 senders) - each partition still gets its events
+    # in csv order
+    messages = visit_messages(40, 4)
+    write_export(tmp_path / 'export.csv', messages)
+    producer = JitterProducer(4, 0.0, 2048)
+    summary = send_messages_from_csv(str(tmp_path / 'export.csv'), COLUMN, producer, routing_field=routing_field)
+
+    assert summary['events'] == len(messages) and summary['batches'] > 8
+    position = {message: i for i, message in enumerate(messages)}
+    for bodies in producer.sent.values():
+        order = [position[body] for body in bodies]
+        assert order == sorted(order)
+
+
+@pytest.mark.parametrize('routing_field', [None, 'pv1.pv1_19'], ids=['round-robin', 'routed'])
+def test_routing_keeps_csv_order_within_a_partition(routing_field):
+    # visits interleaved, plus messages without PV1-19 (sent round-robin even when routing) - routed visits stay on
+    # one partition, and every partition gets its routed and unrouted events in csv order
+    messages = visit_messages(60, 4)
+    for i in range(0, len(messages), 10):
+        messages[i] = messages[i].split('PV1|')[0]
+    producer = JitterProducer(4, 0.0, 2048)
+    stats = send_messages(producer, messages, send_workers=4, routing_field=routing_field)
+
+    assert stats.events == len(messages)
+    assert stats.unrouted == (len(messages) if routing_field is None else len(range(0, len(messages), 10)))
+    position = {message: i for i, message in enumerate(messages)}
+    for bodies in producer.sent.values():
+        order = [position[body] for body in bodies]
+        assert order == sorted(order)
+
+    # routed: a visit's events (those with PV1-19) on one partition; round-robin spreads them
+    visits = {}
+    for partition_id, bodies in producer.sent.items():
+        for body in bodies:
+            if 'PV1|' in body:
+                visits.setdefault(body.split('|', 10)[9].split('.')[0], set()).add(partition_id)
+    split = sum(1 for partitions in visits.values() if len(partitions) > 1)
+    assert split == 0 if routing_field else split > 0
@@ -0,0 +1,37 @@
+import pytest
+# ---
+from function_app import get_message, PARSE_MODE_FAST
+from hl7_fields import get_extractor
+from benchmarks.common import HL7_CLIENT_CONFIG, INTERFACE_CONFIG, synthetic_adt, synthetic_oru
+from benchmarks.corpus import generate_corpus
+
+FAST_IC = dict(INTERFACE_CONFIG, parse_mode=PARSE_MODE_FAST)
+
+
+def parsed(bodies, ic):
+    extractor = get_extractor(HL7_CLIENT_CONFIG)
+    return [get_message(body, ic, HL7_CLIENT_CONFIG, 'test', extractor)['hl7_parsed'] for body in bodies]
+
+
+@pytest.mark.parametrize('messages', [synthetic_adt, synthetic_oru], ids=['adt', 'oru'])
+@pytest.mark.parametrize('version', ['2.3', '2.5', '2.9'])
+def test_fast_mode_matches_full_parse(messages, version):
+    bodies = [m.encode('utf-8') for m in messages(40, version)]
+    assert parsed(bodies, FAST_IC) == parsed(bodies, INTERFACE_CONFIG)
+
+
+def test_fast_mode_falls_back_for_grouped_segments():
+    # PV1 is in a group of ORU_R01 - the full parse resolves no pv1 paths, neither may fast mode
+    fields = parsed([synthetic_oru(1)[0].encode('utf-8')], FAST_IC)[0]
+    assert (fields['visit_number'], fields['patient_class_cd'], fields['point_of_care_cd'], fields['room']) == \
+        ('', '', '', '')
+    assert fields['message_type_cd'] == 'ORU'
+
+
+def test_fast_mode_matches_full_parse_on_corpus():
+    # mixed versions / types and malformed messages - same parsed fields and error codes
+    bodies = [body for *_, body in generate_corpus(400)]
+    fast = [get_message(b, FAST_IC, HL7_CLIENT_CONFIG, 'test') for b in bodies]
+    full = [get_message(b, INTERFACE_CONFIG, HL7_CLIENT_CONFIG, 'test') for b in bodies]
+    assert [(m['log_message_cd'], m['hl7_parsed']) for m in fast] == \
+        [(m['log_message_cd'], m['hl7_parsed']) for m in full]
@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import threading
+# ---
+import function_app
+from azure_clients import register_blob_service_client
+from folder_drain import HeldLease, drain_folder, list_capture_files
+from io_throttle import IOController, ThrottledError
+from benchmarks import bench_drain
+from benchmarks.common import HL7_CLIENT_CONFIG, INTERFACE_CONFIG
+from benchmarks.corpus import generate_corpus, write_corpus
+from benchmarks.standins import LocalBlobServiceClient
+
+FILES = 9
+MESSAGES = 450
+SHARDS = 3
+
+IC = dict(INTERFACE_CONFIG, output_mode='ndjson', parse_mode='fast', file_workers=2)
+
+
+def setup(root, host):
+    # FILES capture files under from_source_folder of a stand-in account registered as host
+    service_client = LocalBlobServiceClient(str(root))
+    register_blob_service_client(host, service_client)
+    container = service_client.get_container_client(IC['from_source_container'])
+    folder = os.path.join(container.root, IC['from_source_folder'])
+    names = write_corpus(folder, generate_corpus(MESSAGES), FILES)
+    os.remove(os.path.join(folder, 'manifest.json'))
+    return container, names
+
+
+def drain(ic, **drain_args):
+    response = bench_drain.request(ic, from_source_drain=drain_args)
+    assert response.status_code == 200, response.get_body()[:200]
+    return json.loads(response.get_body())
+
+
+def assert_drained(container, ic):
+    # every capture file archived once, every message written once
+    assert os.listdir(os.path.join(container.root, ic['from_source_folder'])) == []
+    assert len(os.listdir(os.path.join(container.root, ic['from_source_archive_folder']))) == FILES
+    folder = os.path.join(container.root, ic['to_source_folder'])
+    lines = sum(sum(1 for _ in open(os.path.join(folder, name), 'rb'))
+                for name in os.listdir(folder) if not name.endswith('.index.ndjson'))
+    assert lines == MESSAGES
+
+
+def test_concurrent_shard_callers_process_each_file_once(tmp_path):
+    # two callers per shard at the same time - the blob leases keep them from processing the same file
+    ic = dict(IC, from_source_host='https://drain-test-shards')
+    container, _ = setup(tmp_path, ic['from_source_host'])
+    summaries = []
+
+    def call(shard_index):
+        summaries.append(drain(ic, shard_index=shard_index, shard_count=SHARDS))
+
+    threads = [threading.Thread(target=call, args=(shard,)) for shard in range(SHARDS) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(summaries) == len(threads)
+    assert sum(s['files_done'] for s in summaries) == FILES
+    assert sum(s['files_failed'] for s in summaries) == 0
+    assert_drained(container, ic)
+
+
+def test_time_budget_stops_starting_files(tmp_path):
+    # 0.1s per file, 0.25s budget - the third file would end past the budget, it is left for the next call
+    container, names = setup(tmp_path, 'https://drain-test-budget-files')
+
+    def process(name, held):
+        time.sleep(0.1)
+        return {}
+
+    summary = drain_folder(container, names, process, workers=1, time_budget=0.25,
+                           folder=IC['from_source_folder'])
+    assert sorted(summary['done']) == names[:2]
+    assert summary['remaining'] == names[2:]
+
+
+def test_time_budget_calls_drain_every_file_once(tmp_path):
+    ic = dict(IC, from_source_host='https://drain-test-budget', file_workers=1)
+    container, _ = setup(tmp_path, ic['from_source_host'])
+    calls = [drain(ic, time_budget_seconds=0.05)]
+    while calls[-1]['files_remaining']:
+        calls.append(drain(ic, time_budget_seconds=0.05))
+        assert len(calls) <= FILES
+
+    assert sum(c['files_done'] for c in calls) == FILES
+    assert_drained(container, ic)
+
+
+def test_file_whose_lease_is_lost_is_failed_and_not_archived(tmp_path):
+    ic = dict(IC, from_source_host='https://drain-test-lease')
+    container, _ = setup(tmp_path, ic['from_source_host'])
+    folder = ic['from_source_folder']
+    names = list_capture_files(container, folder)
+
+    def process(name, held):
+        if name == names[0]:
+            # the lease expires (renewals stalled) - the next renewal fails
+            container.leases.pop(f"{folder}/{name}")
+            while held.lost is None:
+                time.sleep(0.05)
+        return function_app.process_avro_file(container, name, ic, HL7_CLIENT_CONFIG, 'test', held)
+
+    summary = drain_folder(container, names, process, workers=2, lease_duration=2, folder=folder)
+
+    assert list(summary['failed']) == [names[0]]
+    assert summary['failed'][names[0]]['summary'] == 'LeaseLostError'
+    assert sorted(summary['done']) == names[1:]
+    assert all(result['archived'] for result in summary['done'].values())
+    # not deleted - left in place for the instance that may hold its lease now
+    assert os.listdir(os.path.join(container.root, folder)) == [names[0]]
+
+
+class FlakyLease:
+    # lease whose first renewal is throttled
+
+    def __init__(self):
+        self.renewals = 0
+
+    def renew(self):
+        self.renewals += 1
+        if self.renewals == 1:
+            raise ThrottledError('server busy', retry_after=0.01)
+
+    def release(self):
+        pass
+
+
+def test_throttled_renewal_is_retried_through_the_controller():
+    lease = FlakyLease()
+    held = HeldLease(lease, duration=2, controller=IOController('lease-test', base_delay=0.01))
+    time.sleep(1.3)
+    held.release()
+    assert lease.renewals == 2 and held.lost is None
+    held.check()
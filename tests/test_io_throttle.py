@@ -0,0 +1,163 @@
+import os
+import threading
+from http.server import ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+# ---
+import pytest
+from azure.core.exceptions import ResourceNotFoundError
+from azure_clients import register_blob_service_client
+from blob_hubsHttp import EventHubsHttpSender
+from blob_hubsProducer import replay
+from eventHubProducer import send_messages
+from io_throttle import IOController, ThrottledClient, DeadLetterError, throttle_of
+from benchmarks import bench_throttle
+from benchmarks.bench_replay import write_blobs, PREFIX
+from benchmarks.bench_throttle import ThrottlingEventHubs
+from benchmarks.common import INTERFACE_CONFIG, synthetic_adt
+from benchmarks.corpus import generate_corpus, write_corpus
+from benchmarks.standins import LocalBlobServiceClient, LocalContainerClient, LocalEventHubProducer, ServiceLimit
+
+
+def test_failed_calls_leave_the_limits_unchanged():
+    # a non-throttle error is raised as it is - no additive increase, unlike an unthrottled success
+    controller = IOController('test', max_concurrency=16)
+    controller.limit = 4.0
+
+    def missing():
+        raise ResourceNotFoundError('The specified blob does not exist.')
+
+    for _ in range(50):
+        with pytest.raises(ResourceNotFoundError):
+            controller.call(missing)
+    assert controller.limit == 4.0
+    assert controller.stats()['calls'] == 50 and controller.in_flight == 0
+
+    for _ in range(50):
+        controller.call(lambda: None)
+    assert controller.limit > 4.0
+
+
+def test_listing_pages_go_through_the_controller(tmp_path):
+    # every page request of list_blobs is throttled/retried, not only the call that creates the pager
+    names = [f"in/{i:04d}.json" for i in range(60)]
+    for name in names:
+        os.makedirs(tmp_path / 'in', exist_ok=True)
+        (tmp_path / name).write_bytes(b'{}')
+    limit = ServiceLimit(20, retry_after=0.05)
+    limit._tokens = 0.0
+    container = ThrottledClient(LocalContainerClient(str(tmp_path), limit=limit), IOController('test', 4))
+
+    listed = [blob.name for blob in container.list_blobs(name_starts_with='in/', results_per_page=5)]
+    assert listed == names
+    assert limit.throttled > 0
+
+    pages = container.list_blobs(name_starts_with='in/', results_per_page=25).by_page()
+    first = list(next(pages))
+    assert pages.continuation_token == first[-1].name
+    assert [blob.name for page in pages for blob in page] == names[25:]
+
+
+def test_controller_delivers_every_call_over_the_service_limit(tmp_path):
+    # uploads from 8 threads against a 100/s account - without the controller throttled uploads are lost
+    for controller in (None, IOController('test', 8)):
+        limit = ServiceLimit(100, retry_after=0.1)
+        container = LocalContainerClient(str(tmp_path / ('controller' if controller else 'none')), limit=limit)
+        dropped = hammer(container, controller, 300)
+        assert limit.throttled > 0
+        if controller is None:
+            assert dropped > 0
+        else:
+            assert dropped == 0 and controller.stats()['dead_lettered'] == 0
+
+
+def test_handler_output_is_complete_when_storage_throttles(tmp_path):
+    # legacy json output (one upload per message): retried uploads all land; without retries the throttled ones
+    # are dead-lettered, never lost
+    corpus = generate_corpus(300)
+    expected = None
+    for name, rate, options in (('unthrottled', None, {}), ('retried', 40, {}), ('noretries', 40, {'io_retries': 0})):
+        host = f"https://throttle-test-{name}"
+        limit = ServiceLimit(rate, retry_after=0.1) if rate else None
+        service_client = LocalBlobServiceClient(str(tmp_path / name), limit=limit)
+        register_blob_service_client(host, service_client)
+        ic = dict(INTERFACE_CONFIG, from_source_host=host, output_mode='json', parse_mode='fast', upload_workers=8,
+                  **options)
+        container = service_client.get_container_client(ic['from_source_container'])
+        names = write_corpus(os.path.join(container.root, ic['from_source_folder']), corpus, 1)
+
+        response = bench_throttle.request(ic, names[0])
+        assert response.status_code == 200, response.get_body()[:200]
+        written, dead_letters = output_counts(os.path.join(container.root, ic['to_source_folder']))
+        expected = written if expected is None else expected
+        if name == 'retried':
+            assert limit.throttled > 0 and written == expected
+        elif name == 'noretries':
+            assert written + dead_letters == expected
+
+
+def test_producers_lose_nothing_when_event_hubs_throttles(tmp_path):
+    write_blobs(str(tmp_path), 300)
+    producer = LocalEventHubProducer(4, 0.002, 16 * 1024, limit=ServiceLimit(2, retry_after=0.1))
+    summary = replay(LocalContainerClient(str(tmp_path)), producer, PREFIX, controller=IOController('test-replay', 4))
+    assert producer.limit.throttled > 0
+    assert producer.events == 300 and summary['dead_lettered'] == 0
+
+    # csv loader without retries - what is still throttled goes to the dead letter callback, counted
+    messages = synthetic_adt(300)
+    dead_letters = []
+    producer = LocalEventHubProducer(4, 0.002, 16 * 1024, limit=ServiceLimit(2, retry_after=0.1))
+    stats = send_messages(producer, messages, controller=IOController('test-csv', 4, retries=0),
+                          dead_letter=lambda batch, error: dead_letters.extend(batch))
+    assert dead_letters and stats.dead_lettered == len(dead_letters)
+    assert producer.events + len(dead_letters) == len(messages)
+
+
+def test_http_sender_resends_on_429():
+    ThrottlingEventHubs.limit = ServiceLimit(10, retry_after=0.1)
+    ThrottlingEventHubs.received = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ThrottlingEventHubs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    corpus = synthetic_adt(300)
+    try:
+        sender = EventHubsHttpSender('test', 'test', 'test', 'key', 8, max_batch_bytes=8 * 1024,
+                                     base_url=f"http://127.0.0.1:{server.server_port}",
+                                     controller=IOController('test-http', 8))
+        for hl7_message in corpus:
+            sender.add(hl7_message)
+        sender.close()
+    finally:
+        server.shutdown()
+    assert ThrottlingEventHubs.limit.throttled > 0
+    assert sender.dead_lettered == 0 and sorted(ThrottlingEventHubs.received) == sorted(corpus)
+
+
+def hammer(container, controller, calls):
+    # calls uploads from 8 threads - returns how many were dropped as throttled
+    dropped = []
+
+    def upload(i):
+        blob_client = container.get_blob_client(f"load/{i:05d}.json")
+        try:
+            if controller is None:
+                blob_client.upload_blob(b'{}', overwrite=True)
+            else:
+                controller.call(blob_client.upload_blob, b'{}', overwrite=True)
+        except Exception as e:
+            if not throttle_of(e)[0] and not isinstance(e, DeadLetterError):
+                raise
+            dropped.append(i)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(upload, range(calls)))
+    return len(dropped)
+
+
+def output_counts(folder):
+    # (messages written, messages dead-lettered) in a json output folder
+    names = os.listdir(folder)
+    dead_letters = 0
+    for name in names:
+        if name.endswith('.deadletter.ndjson'):
+            with open(os.path.join(folder, name)) as f:
+                dead_letters += sum(1 for _ in f)
+    return sum(1 for name in names if name.endswith('.json')), dead_letters
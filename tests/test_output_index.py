@@ -0,0 +1,124 @@
+import os
+import random
+# ---
+import pytest
+import output_index
+from azure_clients import register_blob_service_client
+from output_index import (IndexReader, compact, encode_segment, entry_key, index_folder, list_segments,
+                          LEVEL_COMPACTED, LEVEL_NEW, SEGMENT_SUFFIX)
+from benchmarks import bench_index
+from benchmarks.common import INTERFACE_CONFIG
+from benchmarks.corpus import generate_corpus, write_corpus
+from benchmarks.standins import LocalBlobServiceClient, LocalContainerClient
+
+FILES = 6
+MESSAGES = 600
+FOLDER = 'parsed_index'
+
+
+def process(root, mode):
+    # FILES capture files processed with output_index - (container, ic, messages scanned from the output)
+    ic = dict(INTERFACE_CONFIG, from_source_host=f"https://index-test-{mode}", output_mode=mode, parse_mode='fast',
+              output_index=True)
+    service_client = LocalBlobServiceClient(str(root))
+    register_blob_service_client(ic['from_source_host'], service_client)
+    container = service_client.get_container_client(ic['from_source_container'])
+    names = write_corpus(os.path.join(container.root, ic['from_source_folder']), generate_corpus(MESSAGES), FILES)
+    for name in names:
+        response = bench_index.request(ic, from_source_file_avro=name)
+        assert response.status_code == 200, response.get_body()[:200]
+    return container, ic, bench_index.scan(container, ic)
+
+
+def assert_lookups_match_the_scan(reader, messages):
+    for name, kwargs, expected in bench_index.queries(messages, random.Random(7)):
+        assert {entry['message_uid'] for entry in reader.lookup(**kwargs)} == expected, (name, kwargs)
+
+
+@pytest.mark.parametrize('mode', ['ndjson', 'json'])
+def test_lookups_match_a_scan_of_the_output(tmp_path, mode):
+    container, ic, messages = process(tmp_path / 'account', mode)
+    reader = IndexReader(container, index_folder(ic), str(tmp_path / 'index.sqlite'))
+    try:
+        reader.sync()
+        # json mode: a message duplicated in the capture overwrites its blob - two identical entries, one result
+        entries = reader.lookup(limit=2 * len(messages))
+        assert len(entries) == len(messages)
+        assert_lookups_match_the_scan(reader, messages)
+        for entry in random.Random(3).sample(entries, 20):
+            assert reader.fetch(entry)['message_uid'] == entry['message_uid']
+
+        summary = compact(container, index_folder(ic), min_segments=4, segment_bytes=64 * 1024)
+        synced = reader.sync()
+        # every input merged away, no entry duplicated by the compaction
+        assert summary['status'] == 'compacted' and summary['merged'] == FILES and summary['kept'] == 0
+        assert sorted(blob.name for blob in list_segments(container, index_folder(ic))) == sorted(summary['written'])
+        assert synced['dropped'] == FILES and synced['entries'] == summary['entries']
+        assert len(reader.lookup(limit=2 * len(messages))) == len(messages)
+        assert_lookups_match_the_scan(reader, messages)
+    finally:
+        reader.close()
+
+
+def entries(uids, blob):
+    # index entries of messages uids written as ndjson lines of blob
+    return sorted(({
+        'message_dttm': f"2024-06-01T{i:02d}:00:00", 'message_uid': uid, 'visit_number': f"V{uid}",
+        'message_control_id': f"C{uid}", 'message_type_cd': 'ADT', 'log_message_cd': 'OK', 'blob': blob,
+        'offset': 100 * i, 'length': 100, 'row': None
+    } for i, uid in enumerate(uids)), key=entry_key)
+
+
+def write_segment(container, stem, segment_entries):
+    container.get_blob_client(f"{FOLDER}/{LEVEL_NEW}/{stem}{SEGMENT_SUFFIX}").upload_blob(
+        encode_segment(segment_entries), overwrite=True
+    )
+
+
+def test_compaction_drops_duplicate_entries(tmp_path):
+    # an l0 segment and its copy already in l1 (compacted earlier, then seen again) - one entry each
+    container = LocalContainerClient(str(tmp_path))
+    write_segment(container, 'a', entries(['a1', 'a2'], 'parsed/a.ndjson'))
+    first = compact(container, FOLDER, min_segments=1)
+    write_segment(container, 'a', entries(['a1', 'a2'], 'parsed/a.ndjson'))
+    write_segment(container, 'b', entries(['b1'], 'parsed/b.ndjson'))
+
+    summary = compact(container, FOLDER, min_segments=1)
+    assert summary['merged'] == 3 and summary['entries'] == 3
+    assert [blob.name for blob in list_segments(container, FOLDER)] == summary['written']
+    assert first['written'][0] not in summary['written']
+
+
+def test_segment_rewritten_during_compaction_is_kept_without_its_old_entries(tmp_path, monkeypatch):
+    # file b reprocessed while the compaction runs - its new l0 segment stays, the l1 segments do not keep
+    # the entries of its old segment (their output location was rewritten too)
+    container = LocalContainerClient(str(tmp_path))
+    write_segment(container, 'a', entries(['a1', 'a2'], 'parsed/a.ndjson'))
+    write_segment(container, 'b', entries(['b1', 'b2'], 'parsed/b.ndjson'))
+    rewritten = entries(['b1', 'b2'], 'parsed/b_rewritten.ndjson')
+    write_compacted = output_index._write_compacted
+    calls = []
+
+    def reprocessed_meanwhile(*args):
+        if not calls:
+            write_segment(container, 'b', rewritten)
+        calls.append(args)
+        return write_compacted(*args)
+
+    monkeypatch.setattr(output_index, '_write_compacted', reprocessed_meanwhile)
+    summary = compact(container, FOLDER, min_segments=1)
+
+    assert summary['kept'] == 1 and summary['entries'] == 2
+    assert sorted(blob.name for blob in list_segments(container, FOLDER, LEVEL_NEW)) == \
+        [f"{FOLDER}/{LEVEL_NEW}/b{SEGMENT_SUFFIX}"]
+    assert [blob.name for blob in list_segments(container, FOLDER, LEVEL_COMPACTED)] == summary['written']
+
+    reader = IndexReader(container, FOLDER, str(tmp_path / 'index.sqlite'))
+    try:
+        reader.sync()
+        found = reader.lookup()
+        assert {entry['message_uid'] for entry in found} == {'a1', 'a2', 'b1', 'b2'}
+        assert {entry['blob'] for entry in found if entry['message_uid'].startswith('b')} == \
+            {'parsed/b_rewritten.ndjson'}
+    finally:
+        reader.close()
@@ -0,0 +1,74 @@
+import os
+import json
+import signal
+# ---
+import pytest
+import pipeline
+from function_app import get_message, PARSE_MODE_FAST
+from output_sinks import create_sink
+from benchmarks.common import HL7_CLIENT_CONFIG, INTERFACE_CONFIG, synthetic_adt, capture_records
+from benchmarks.standins import LocalContainerClient
+
+MESSAGES = 40
+
+
+def run(root, ic):
+    # parsed messages written for ic, without the per-run processed_dttm
+    container_client = LocalContainerClient(str(root))
+    ic = dict(INTERFACE_CONFIG, output_mode='ndjson', **ic)
+    records = capture_records(m.encode('utf-8') for m in synthetic_adt(MESSAGES))
+    sink = create_sink(container_client, ic, 'run')
+    pipeline.process_records(records, get_message, ic, HL7_CLIENT_CONFIG, 'test', sink)
+    messages = []
+    for path in sorted((root / ic['to_source_folder']).glob('*.ndjson')):
+        if path.name.endswith('.index.ndjson'):
+            continue
+        for line in path.read_text().splitlines():
+            message = json.loads(line)
+            message.pop('processed_dttm')
+            messages.append(message)
+    return messages
+
+
+def test_parse_pool_matches_the_serial_path(tmp_path, monkeypatch):
+    # forced onto the (spawned) pool - same messages in the same order as the serial path
+    monkeypatch.setattr(pipeline, 'available_cores', lambda: 4)
+    monkeypatch.setattr(pipeline, 'PARALLEL_PARSE_MIN_SECONDS', 0.0)
+    serial = run(tmp_path / 'serial', {})
+    parallel = run(tmp_path / 'parallel', {'parse_workers': 2, 'parse_batch_size': 8})
+    assert parallel == serial and len(serial) == MESSAGES
+
+
+@pytest.mark.parametrize('cores, ic', [
+    (1, {}),                                # a single core - nothing to run the pool on
+    (4, {'parse_mode': PARSE_MODE_FAST}),   # the fast parse is cheaper than the round trip to a pool process
+], ids=['single-core', 'fast-parse'])
+def test_parse_workers_parse_inline_where_the_pool_does_not_help(tmp_path, monkeypatch, cores, ic):
+    monkeypatch.setattr(pipeline, 'available_cores', lambda: cores)
+
+    def no_pool(workers):
+        raise AssertionError('parse pool used')
+
+    monkeypatch.setattr(pipeline, 'get_parse_pool', no_pool)
+    assert len(run(tmp_path, dict(ic, parse_workers=2, parse_batch_size=8))) == MESSAGES
+
+
+def test_broken_parse_pool_is_replaced(tmp_path, monkeypatch):
+    # a pool process killed (OOM kill, crash) - the run still parses everything, the next gets a new pool
+    monkeypatch.setattr(pipeline, 'available_cores', lambda: 4)
+    monkeypatch.setattr(pipeline, 'PARALLEL_PARSE_MIN_SECONDS', 0.0)
+    ic = {'parse_workers': 2, 'parse_batch_size': 8}
+    serial = run(tmp_path / 'serial', {})
+    assert run(tmp_path / 'warm', ic) == serial
+
+    pool = pipeline.get_parse_pool(2)
+    for process in list(pool._processes.values()):
+        try:
+            os.kill(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass    # already reaped - the pool terminates the others once it sees one die
+        process.join()
+
+    assert run(tmp_path / 'broken', ic) == serial
+    assert pipeline.get_parse_pool(2) is not pool
+    assert run(tmp_path / 'replaced', ic) == serial
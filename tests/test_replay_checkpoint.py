@@ -0,0 +1,46 @@
+import sqlite3
+from hashlib import sha256
+# ---
+from blob_hubsProducer import replay
+from replay_checkpoint import ReplayCheckpoint, hl7_message_hash
+from benchmarks.bench_replay import write_blobs, PREFIX
+from benchmarks.common import synthetic_adt
+from benchmarks.standins import LocalContainerClient, LocalEventHubProducer
+
+BLOBS = 20
+
+
+def sent_hashes(path):
+    with sqlite3.connect(path) as conn:
+        return {row[0] for row in conn.execute('SELECT content_hash FROM sent_hashes')}
+
+
+def test_replay_records_the_shared_message_hash(tmp_path):
+    # the hash the producer records is the message_uid of the event it sent (its unicode_escape body)
+    write_blobs(str(tmp_path / 'blobs'), BLOBS)
+    producer = LocalEventHubProducer(4)
+    checkpoint = ReplayCheckpoint(str(tmp_path / 'checkpoint.sqlite'), 'producer')
+    replay(LocalContainerClient(str(tmp_path / 'blobs')), producer, PREFIX, checkpoint=checkpoint)
+    checkpoint.close()
+
+    messages = synthetic_adt(BLOBS)
+    assert sent_hashes(tmp_path / 'checkpoint.sqlite') == {hl7_message_hash(m) for m in messages}
+    bodies = [body for bodies in producer.sent.values() for body in bodies]
+    assert {'sha256:' + sha256(body.encode('utf-8')).hexdigest() for body in bodies} == \
+        {hl7_message_hash(m) for m in messages}
+
+
+def test_messages_sent_by_the_http_sender_are_skipped_by_the_producer(tmp_path):
+    # blob_hubsHttp records hl7_message_hash of the message it extracted - the producer's replay of the same
+    # messages (another job on the same checkpoint file) sends none of them again
+    write_blobs(str(tmp_path / 'blobs'), BLOBS)
+    path = str(tmp_path / 'checkpoint.sqlite')
+    http_job = ReplayCheckpoint(path, 'http')
+    http_job.complete([], [(hl7_message_hash(m), f"{i:06d}.txt") for i, m in enumerate(synthetic_adt(BLOBS))])
+    http_job.close()
+
+    producer = LocalEventHubProducer(4)
+    checkpoint = ReplayCheckpoint(path, 'producer')
+    summary = replay(LocalContainerClient(str(tmp_path / 'blobs')), producer, PREFIX, checkpoint=checkpoint)
+    checkpoint.close()
+    assert producer.events == 0 and summary['duplicates'] == BLOBS
@@ -0,0 +1,33 @@
+import os
+import sys
+import subprocess
+# ---
+import pytest
+from benchmarks.bench_startup import DEFERRED_MODULES, import_profile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def deferred_loaded(modules):
+    return sorted(name for name in modules if name.split('.')[0] in DEFERRED_MODULES or name in DEFERRED_MODULES)
+
+
+@pytest.mark.parametrize('module', ['function_app', 'logIPsFunctionApp'])
+def test_cold_import_defers_heavy_modules(module, monkeypatch):
+    monkeypatch.chdir(ROOT)
+    monkeypatch.delenv('HL7_WARMUP', raising=False)
+    modules, _ = import_profile(module)
+    assert module in modules
+    assert deferred_loaded(modules) == []
+
+
+def test_sync_warm_up_loads_the_deferred_modules():
+    # HL7_WARMUP=sync - the modules the first request needs are in place once function_app is imported
+    code = (
+        "import sys, function_app\n"
+        "print(' '.join(sorted(m for m in sys.modules if m.split('.')[0] in ('fastavro', 'hl7apy'))))\n"
+    )
+    env = dict(os.environ, HL7_WARMUP='sync')
+    out = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True, env=env, cwd=ROOT)
+    loaded = out.stdout.split()
+    assert 'fastavro' in loaded and 'hl7apy' in loaded